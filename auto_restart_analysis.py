@@ -6,24 +6,122 @@ AUTO-RESTART MAXIMUM DATA EXTRACTION
 """
 
 import os
+import re
+import sys
 import csv
 import time
+import random
+import sqlite3
+import hashlib
+import json
+import heapq
+import bisect
+import queue
 import signal
+import operator
 import threading
-import subprocess
-import pandas as pd
-import google.generativeai as genai
-from datetime import datetime
+import functools
+import itertools
+import collections
+from concurrent.futures import ThreadPoolExecutor, as_completed, CancelledError, TimeoutError as FuturesTimeout
+from datetime import datetime, timedelta
 from pathlib import Path
 
-# API 키 설정
-api_key = os.environ.get('GEMINI_API_KEY')
-if not api_key:
-    print("GEMINI_API_KEY 환경변수를 설정하세요")
-    exit(1)
+try:
+    import orjson  # 선택 의존성: 설치되어 있으면 JSON 응답 검증이 더 빠름
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
 
-genai.configure(api_key=api_key)
-model = genai.GenerativeModel('gemini-2.5-flash')
+MODEL_NAME = 'gemini-2.5-flash'
+
+class MissingApiKeyError(RuntimeError):
+    """API 키 환경변수가 설정되지 않음"""
+
+class ModelProvider:
+    """모델 백엔드 인터페이스 - generate_content(prompt, system_instruction=None, **kwargs)가 응답 객체를 반환
+    
+    system_instruction은 단계별 고정 지시문으로, 백엔드가 지원하면 재사용 가능한 컨텍스트로 보낸다.
+    """
+    model_name = MODEL_NAME
+    
+    def generate_content(self, prompt, system_instruction=None, **kwargs):
+        raise NotImplementedError
+    
+    def close(self):
+        """백엔드 자원 정리 (컨텍스트 캐시 등)"""
+
+class GeminiProvider(ModelProvider):
+    """Gemini 백엔드 - 첫 호출 때 SDK를 불러오고 API 키를 확인 (import 시점 비용 없음)
+    
+    system_instruction마다 GenerativeModel을 하나씩 만들어 재사용한다. context_cache가 켜져 있으면
+    지시문을 CachedContent로 한 번만 올리고 cache_ttl(초)이 끝나기 전에 새로 만든다. 모델의 최소 캐시
+    크기보다 작은 지시문은 생성이 거부되므로 system instruction으로 보낸다 (2.5 모델은 암묵적 캐시 적용).
+    """
+    def __init__(self, model_name=MODEL_NAME, api_key_env='GEMINI_API_KEY', context_cache=False, cache_ttl=3600):
+        self.model_name = model_name
+        self.api_key_env = api_key_env
+        self.context_cache = context_cache
+        self.cache_ttl = cache_ttl
+        self.lock = threading.Lock()
+        self._configured = False
+        self._models = {}  # system instruction → (GenerativeModel, 재생성 시각)
+        self._cached_contents = []
+    
+    def check_api_key(self):
+        """API 키 확인 (없으면 MissingApiKeyError)"""
+        api_key = os.environ.get(self.api_key_env)
+        if not api_key:
+            raise MissingApiKeyError(f"{self.api_key_env} 환경변수를 설정하세요")
+        return api_key
+    
+    def get_model(self, system_instruction=None):
+        """GenerativeModel을 (system instruction별로) 처음 필요할 때 한 번만 생성"""
+        entry = self._models.get(system_instruction)
+        if entry is None or entry[1] < time.time():
+            with self.lock:
+                entry = self._models.get(system_instruction)
+                if entry is None or entry[1] < time.time():
+                    entry = self._create_model(system_instruction)
+                    self._models[system_instruction] = entry
+        return entry[0]
+    
+    def _create_model(self, system_instruction):
+        """(GenerativeModel, 재생성 시각) 생성 - 컨텍스트 캐시를 만들 수 없으면 system instruction으로 전송"""
+        import google.generativeai as genai
+        
+        if not self._configured:
+            genai.configure(api_key=self.check_api_key())
+            self._configured = True
+        
+        if system_instruction and self.context_cache:
+            try:
+                from google.generativeai import caching
+                
+                cached = caching.CachedContent.create(
+                    model=self.model_name, system_instruction=system_instruction,
+                    ttl=timedelta(seconds=self.cache_ttl))
+                self._cached_contents.append(cached)
+                # 만료 직전 호출이 실패하지 않도록 TTL의 90%가 지나면 새로 생성
+                return genai.GenerativeModel.from_cached_content(cached), time.time() + self.cache_ttl * 0.9
+            except Exception as e:
+                print(f"⚠️ 컨텍스트 캐시 생성 실패 - system instruction으로 전송: {e}")
+        
+        return genai.GenerativeModel(self.model_name, system_instruction=system_instruction), float('inf')
+    
+    def generate_content(self, prompt, system_instruction=None, **kwargs):
+        return self.get_model(system_instruction).generate_content(prompt, **kwargs)
+    
+    def close(self):
+        """이번 실행에서 만든 컨텍스트 캐시 삭제 (남겨 두면 TTL까지 저장 비용 발생)"""
+        with self.lock:
+            cached_contents, self._cached_contents = self._cached_contents, []
+            self._models.clear()
+        for cached in cached_contents:
+            try:
+                cached.delete()
+            except Exception as e:
+                print(f"⚠️ 컨텍스트 캐시 삭제 실패: {e}")
 
 # 선박 의약품 목록 (medi.md 기반)
 SHIP_MEDICINES = """
@@ -36,30 +134,2120 @@ SHIP_MEDICINES = """
 - 해열진통소염제: 케토프로펜
 - 수액제: 생리식염주사액, 5%당 링겔, 주사용 증류수
 
-내용약:
-- 항생제: 아목시실린, 독시싸이클린, 클로람페니콜
-- 해열진통소염제: 아세트아미노펜, 아스피린, 디클로페낙나트륨
-- 감기약: 종합감기약
-- 진해거담제: 카보시스테인, 용각산
-- 진정제: 독실아민숙시네이트
-- 진훈제(멀미약): 디메칠하이드리에이트
-- 소화제: 훼스탈포르테, 베아제, 활명수
-- 제산제: 암포젤엠현탁액, 탈시드
-- 진경제: 복합부스코판
-- 정장제: 로페라미드, 정로환
-- 해독제: 오로친정, 메치오닌
-- 비타민: 레모나세립, 비콤푸렉스
+내용약:
+- 항생제: 아목시실린, 독시싸이클린, 클로람페니콜
+- 해열진통소염제: 아세트아미노펜, 아스피린, 디클로페낙나트륨
+- 감기약: 종합감기약
+- 진해거담제: 카보시스테인, 용각산
+- 진정제: 독실아민숙시네이트
+- 진훈제(멀미약): 디메칠하이드리에이트
+- 소화제: 훼스탈포르테, 베아제, 활명수
+- 제산제: 암포젤엠현탁액, 탈시드
+- 진경제: 복합부스코판
+- 정장제: 로페라미드, 정로환
+- 해독제: 오로친정, 메치오닌
+- 비타민: 레모나세립, 비콤푸렉스
+
+외용약:
+- 화농성질환용: 테라마이신연고, 황산겐타마이신연고
+- 안과용약: 뷰렌점안액, 테라코트릴눈/귀약
+- 진통진양제: 훼너간크림, 맥살겔연고, 카라민로숀
+- 소독제: 베타딘액, 포비돈액, 과산화수소, 소독용알콜
+- 창상보호제: 화상가아제
+"""
+
+def estimate_tokens(text):
+    """토큰 수 대략 추정 (문자 4개 ≈ 1토큰)"""
+    return len(text) // 4 + 1
+
+def is_rate_limit_error(error):
+    """429 / 할당량 초과 예외인지 판별"""
+    if type(error).__name__ in ("ResourceExhausted", "TooManyRequests"):
+        return True
+    if getattr(error, "code", None) == 429:
+        return True
+    message = str(error).lower()
+    return "429" in message or "quota" in message or "rate limit" in message
+
+class RateLimiter:
+    """분당 요청 수(RPM) / 토큰 수(TPM) 기준 공유 토큰 버킷
+    
+    레이트 리밋 오류가 나면 모든 워커가 함께 지수 백오프(지터 포함)로 쉬고,
+    허용 속도를 줄였다가 성공이 이어지면 설정값까지 천천히 회복한다.
+    """
+    def __init__(self, rpm=60, tpm=None, burst_seconds=1.0,
+                 base_backoff=2.0, max_backoff=120.0):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.burst_seconds = burst_seconds
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.lock = threading.Lock()
+        self.rate_scale = 1.0  # 레이트 리밋 발생 시 줄어드는 속도 배율
+        self.blocked_until = 0.0
+        self.request_level = self._request_capacity()
+        self.token_level = self._token_capacity()
+        self.last_refill = time.monotonic()
+    
+    def _request_capacity(self):
+        return max(1.0, self.rpm / 60 * self.burst_seconds) if self.rpm else 0.0
+    
+    def _token_capacity(self):
+        return max(1.0, self.tpm / 60 * self.burst_seconds) if self.tpm else 0.0
+    
+    def _refill(self, now):
+        elapsed = now - self.last_refill
+        self.last_refill = now
+        if self.rpm:
+            self.request_level = min(self._request_capacity(),
+                                     self.request_level + elapsed * self.rpm / 60 * self.rate_scale)
+        if self.tpm:
+            self.token_level = min(self._token_capacity(),
+                                   self.token_level + elapsed * self.tpm / 60 * self.rate_scale)
+    
+    def acquire(self, tokens=0):
+        """요청 1건과 추정 토큰을 확보할 때까지 대기"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self.blocked_until - now
+                if wait <= 0:
+                    wait = 0.0
+                    if self.rpm and self.request_level < 1:
+                        wait = (1 - self.request_level) / (self.rpm / 60 * self.rate_scale)
+                    if self.tpm:
+                        # 버킷보다 큰 요청은 가득 찼을 때 통과시키고 부족분은 빚으로 남긴다
+                        needed = min(tokens, self._token_capacity())
+                        if self.token_level < needed:
+                            wait = max(wait, (needed - self.token_level) / (self.tpm / 60 * self.rate_scale))
+                    if wait <= 0:
+                        self.request_level -= 1
+                        self.token_level -= tokens
+                        return
+            time.sleep(wait)
+    
+    def settle(self, estimated_tokens, actual_tokens):
+        """실제 사용 토큰(usage_metadata)과 추정치의 차이를 반영"""
+        if self.tpm and actual_tokens:
+            with self.lock:
+                self.token_level -= actual_tokens - estimated_tokens
+    
+    def record_success(self):
+        """성공 시 줄였던 속도를 조금씩 회복"""
+        with self.lock:
+            self.rate_scale = min(1.0, self.rate_scale + 0.02)
+    
+    def backoff(self, attempt):
+        """레이트 리밋 발생: 지수 백오프 + 지터만큼 전체 대기, 속도 감소"""
+        delay = min(self.max_backoff, self.base_backoff * (2 ** attempt))
+        delay = delay / 2 + random.uniform(0, delay / 2)
+        with self.lock:
+            self.rate_scale = max(0.1, self.rate_scale * 0.7)
+            self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+        return delay
+
+def format_cargo_entry(cargo_id, guide_no, name):
+    """화물 행을 프롬프트/결과에 쓰는 화물 문자열로 변환"""
+    # ID가 없거나 "— —"인 경우 처리
+    if cargo_id and cargo_id != "— —":
+        if guide_no:
+            return f"{cargo_id}: {name} (Guide: {guide_no})"
+        return f"{cargo_id}: {name}"
+    # ID가 없는 경우 이름과 가이드만 사용
+    if guide_no:
+        return f"{name} (Guide: {guide_no})"
+    return name
+
+def normalize_material_name(name):
+    """중복 판별용 물질명 정규화 (공백/대소문자/끝 쉼표 무시)"""
+    return " ".join(name.split()).rstrip(",").strip().casefold()
+
+def parse_shard(value):
+    """'i/N' 샤드 지정 → (i, N) (i는 1부터 N까지)"""
+    try:
+        index, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise ValueError(f"샤드 형식은 i/N 입니다: {value}")
+    if count < 1 or not 1 <= index <= count:
+        raise ValueError(f"샤드 번호는 1부터 {count}까지입니다: {value}")
+    return index, count
+
+def shard_of(row, count):
+    """화물 행의 샤드 번호 (1부터) - 물질명 + Guide_No의 SHA-256 기준
+    
+    실행 환경(PYTHONHASHSEED, 호스트, 화물 리스트 순서)과 무관하게 같은 값이 나오며,
+    중복 제거로 묶이는 행들은 항상 같은 샤드에 들어간다.
+    """
+    key = f"{normalize_material_name(row['Name_of_Material'])}\0{row['Guide_No'].strip()}"
+    return int.from_bytes(hashlib.sha256(key.encode('utf-8')).digest()[:8], 'big') % count + 1
+
+def shard_path(path, shard):
+    """샤드별 파일 경로 (results.csv → results.shard2of4.csv)"""
+    path = Path(path)
+    index, count = shard
+    return path.with_name(f"{path.stem}.shard{index}of{count}{path.suffix}")
+
+class ResponseCache:
+    """모델 원본 응답 디스크 캐시 (SQLite)
+    
+    키는 모델명 + 프롬프트 텍스트의 SHA-256이다. 재실행, 파서 변경, 중단 후 복구 시
+    같은 프롬프트는 API를 다시 호출하지 않고 캐시에서 응답을 재생한다.
+    전체 크기가 max_bytes를 넘으면 가장 오래 사용되지 않은 응답부터 삭제한다.
+    """
+    def __init__(self, path='response_cache.sqlite3', max_bytes=2 * 1024**3):
+        self.path = str(path)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                text TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            )""")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses(accessed)")
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+    
+    @staticmethod
+    def make_key(model_name, prompt):
+        return hashlib.sha256(f"{model_name}\0{prompt}".encode('utf-8')).hexdigest()
+    
+    def get(self, model_name, prompt):
+        """캐시된 응답 텍스트 반환 (없으면 None)"""
+        key = self.make_key(model_name, prompt)
+        with self.lock:
+            row = self.conn.execute("SELECT text FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (time.time(), key))
+            return row[0]
+    
+    def put(self, model_name, prompt, text):
+        """응답 저장 후 용량 초과 시 LRU 삭제"""
+        key = self.make_key(model_name, prompt)
+        size = len(text.encode('utf-8'))
+        now = time.time()
+        with self.lock:
+            old = self.conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, text, size, created, accessed) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model_name, text, size, now, now))
+            self.total_bytes += size - (old[0] if old else 0)
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+    
+    def _evict(self):
+        """가장 오래 사용되지 않은 응답부터 최대 용량의 90%까지 삭제"""
+        target = self.max_bytes * 0.9
+        rows = self.conn.execute("SELECT key, size FROM responses ORDER BY accessed").fetchall()
+        evicted = []
+        for key, size in rows:
+            if self.total_bytes <= target:
+                break
+            evicted.append((key,))
+            self.total_bytes -= size
+        self.conn.executemany("DELETE FROM responses WHERE key = ?", evicted)
+        self.evictions += len(evicted)
+    
+    def stats(self):
+        """적중/미스/삭제 카운터"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'bytes': self.total_bytes,
+            }
+    
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+# 응답 파싱용 미리 컴파일한 패턴
+BACKUP_KEYWORDS = re.compile(r'risk|toxic|hazard|treat|procedure|data|effect')
+
+def split_pipe_lines(stage_data):
+    """'|'가 2개 이상이고 공백 제거 후 20자를 넘는 줄을 앞 5개 필드까지만 분할
+    
+    줄 분할/공백 제거/구분자 분할을 모두 str 메서드(C 구현)로 처리한다.
+    (정규식 한 줄 문법은 CPython에서 이 방식보다 10배 이상 느림)
+    """
+    return [line.split('|', 5) for line in map(str.strip, stage_data.split('\n'))
+            if len(line) > 20 and line.count('|') >= 2]
+
+def backup_sentences(stage_data):
+    """백업 파싱: 키워드가 들어간 30자 초과 문장 최대 10개"""
+    sentences = []
+    for sentence in stage_data.replace('\n', '.').split('.'):
+        sentence = sentence.strip()
+        if len(sentence) > 30 and BACKUP_KEYWORDS.search(sentence.lower()):
+            sentences.append(sentence)
+            if len(sentences) == 10:
+                break
+    return sentences
+
+# 묶음 응답의 화물 구분 줄: "### CARGO 3" / "### END CARGO 3"
+PACK_MARKER = re.compile(r'^[ \t]*#+[ \t]*(END[ \t]+)?CARGO[ \t]+(\d+)\b.*$', re.MULTILINE | re.IGNORECASE)
+
+def split_packed_stage_data(stage_data, count):
+    """묶음 응답을 화물별 조각으로 분리 → {화물 순번(0부터): 조각 텍스트}
+    
+    끝 구분 줄이나 다음 화물 구분 줄로 닫히지 않은 조각(출력 한도에서 잘린 경우)과
+    파이프 구분 행이 없는 조각은 빠지며, 빠진 화물은 단독으로 다시 요청한다.
+    """
+    slices = {}
+    if not stage_data:
+        return slices
+    
+    markers = list(PACK_MARKER.finditer(stage_data))
+    for i, marker in enumerate(markers):
+        if marker.group(1):
+            continue
+        index = int(marker.group(2)) - 1
+        if not 0 <= index < count or index in slices:
+            continue
+        if i + 1 == len(markers):
+            break  # 닫히지 않은 마지막 조각
+        next_marker = markers[i + 1]
+        if next_marker.group(1) and int(next_marker.group(2)) - 1 != index:
+            continue
+        text = stage_data[marker.end():next_marker.start()]
+        if split_pipe_lines(text):
+            slices[index] = text.strip()
+    return slices
+
+def parse_stage_rows(stage_data, stage_name):
+    """응답 텍스트를 (Category, Description, Detail1, Detail2, Detail3) 튜플 목록으로 변환
+    
+    parse_stage_data와 같은 행을 화물/Stage 없이 만든다 (캐시 응답 재파싱 등 대량 처리용).
+    Category는 화물마다 같은 값이 반복되므로 인턴한다.
+    """
+    if not stage_data:
+        return []
+    
+    intern = sys.intern
+    rows = [(intern(p[0].strip()), p[1].strip(), p[2].strip(),
+             p[3].strip() if len(p) > 3 else '', p[4].strip() if len(p) > 4 else '')
+            for p in split_pipe_lines(stage_data)]
+    if rows:
+        return rows
+    return [(intern(f'{stage_name} Item {i+1}'), sentence, '', '', '')
+            for i, sentence in enumerate(backup_sentences(stage_data))]
+
+class StreamingStageParser:
+    """스트리밍 응답 증분 파서
+    
+    청크를 받는 대로 줄바꿈까지 완성된 줄만 split_pipe_lines와 같은 규칙으로 행으로 만든다.
+    생성이 형식을 분명히 벗어나면 violation에 이유를 남긴다:
+    'prose'(prose_limit자가 지나도록 파이프 행 없음), 'repetition'(같은 행이 max_repeats번 연속),
+    'medicine'(row_check가 문제를 돌려준 행 - 선박 의약품 단계의 비치 목록 밖 의약품).
+    """
+    def __init__(self, prose_limit=2000, max_repeats=3, row_check=None):
+        self.prose_limit = prose_limit
+        self.max_repeats = max_repeats
+        self.row_check = row_check  # 파이프 분할 행 → 문제(참이면 위반) / None이면 검사 안 함
+        self.chunks = []
+        self.pending = ''  # 아직 줄바꿈이 오지 않은 마지막 줄
+        self.consumed = 0  # 완성된 줄 길이 합 (줄바꿈 포함)
+        self.accepted = 0  # 반복이 시작되기 전까지의 길이 (부분 결과로 쓸 수 있는 부분)
+        self.rows = []
+        self.last_line = None
+        self.repeats = 0
+        self.violation = None
+    
+    def feed(self, text):
+        """청크 추가 → 새로 완성된 파이프 행 수"""
+        self.chunks.append(text)
+        lines = (self.pending + text).split('\n')
+        self.pending = lines.pop()
+        return self._consume(lines, 1)
+    
+    def finish(self):
+        """스트림 끝: 줄바꿈 없이 끝난 마지막 줄 처리 → 새 파이프 행 수"""
+        lines, self.pending = [self.pending], ''
+        return self._consume(lines, 0)
+    
+    def _consume(self, lines, newline):
+        added = 0
+        for line in lines:
+            self.consumed += len(line) + newline
+            line = line.strip()
+            if len(line) > 20 and line.count('|') >= 2:
+                if line == self.last_line:
+                    self.repeats += 1
+                    if self.repeats >= self.max_repeats:
+                        self.violation = 'repetition'
+                        return added
+                    continue
+                parts = line.split('|', 5)
+                if self.row_check and self.row_check(parts):
+                    self.violation = 'medicine'
+                    return added
+                self.last_line = line
+                self.repeats = 1
+                self.rows.append(parts)
+                added += 1
+            self.accepted = self.consumed
+        if not self.rows and self.consumed + len(self.pending) > self.prose_limit:
+            self.violation = 'prose'
+        return added
+    
+    @property
+    def text(self):
+        return "".join(self.chunks)
+    
+    def partial_text(self):
+        """형식 위반 전까지 받은 텍스트 (반복된 줄 / 검사에 걸린 행 제외)"""
+        return self.text[:self.accepted]
+
+class StreamFormatError(Exception):
+    """스트리밍 응답이 형식을 벗어나 중간에 멈춤 (reason: 'prose' / 'repetition' / 'medicine')"""
+    def __init__(self, reason, partial_text, rows):
+        super().__init__(f"스트림 형식 위반 ({reason})")
+        self.reason = reason
+        self.partial_text = partial_text
+        self.rows = rows
+
+def chunk_text(chunk):
+    """스트리밍 청크의 텍스트 (finish_reason만 담긴 마지막 청크 등 내용이 없으면 빈 문자열)"""
+    try:
+        return chunk.text or ''
+    except ValueError:
+        return ''
+
+class StreamedResponse:
+    """스트리밍으로 받은 응답을 한 번에 받은 응답과 같은 모양(text, candidates, usage_metadata)으로 묶음
+    
+    partial이면 형식 위반으로 중간에 멈춘 응답의 앞부분이다 (캐시하지 않음).
+    """
+    def __init__(self, text, last_chunk=None, partial=False):
+        self.text = text
+        self.candidates = getattr(last_chunk, 'candidates', None)
+        self.usage_metadata = getattr(last_chunk, 'usage_metadata', None)
+        self.partial = partial
+
+# 결과 행에서 화물/단계를 제외한 내용 컬럼
+RESULT_FIELDS = ['Category', 'Description', 'Detail1', 'Detail2', 'Detail3']
+
+# 출력 파일 컬럼 순서
+OUTPUT_FIELDS = ['Cargo', 'Stage'] + RESULT_FIELDS
+RESULT_INDEX = {field: i for i, field in enumerate(RESULT_FIELDS)}
+
+class ResultRow:
+    """결과 행 하나 - 화물 / Stage / 내용 튜플 (Category, Description, Detail1-3)
+    
+    행마다 컬럼 이름을 키로 들고 있던 dict 대신 슬롯 3개만 쓰고, 화물/Stage/Category는 인턴한 문자열,
+    내용 튜플은 같은 응답(가이드 공유 단계, 대체 데이터)이나 작업 단위 화물끼리 공유한다.
+    row['Description'], row.get(...), dict(row)로 기존 행 dict처럼 읽을 수 있다.
+    """
+    __slots__ = ('cargo', 'stage', 'values')
+    
+    def __init__(self, cargo, stage, values):
+        self.cargo = cargo
+        self.stage = stage
+        self.values = values
+    
+    @classmethod
+    def from_tuple(cls, row):
+        """OUTPUT_FIELDS 순서 튜플(read_result_rows) → ResultRow (화물/Stage/Category 인턴)"""
+        return cls(sys.intern(row[0]), sys.intern(row[1]), (sys.intern(row[2]),) + tuple(row[3:]))
+    
+    def with_cargo(self, cargo):
+        """같은 내용을 다른 화물 행으로 (내용 튜플 공유)"""
+        return ResultRow(cargo, self.stage, self.values)
+    
+    def as_tuple(self):
+        return (self.cargo, self.stage) + self.values
+    
+    def keys(self):
+        return OUTPUT_FIELDS
+    
+    def __iter__(self):
+        return iter(OUTPUT_FIELDS)
+    
+    def __len__(self):
+        return len(OUTPUT_FIELDS)
+    
+    def __getitem__(self, field):
+        if field == 'Cargo':
+            return self.cargo
+        if field == 'Stage':
+            return self.stage
+        return self.values[RESULT_INDEX[field]]
+    
+    def get(self, field, default=None):
+        try:
+            return self[field]
+        except KeyError:
+            return default
+    
+    def __eq__(self, other):
+        if isinstance(other, ResultRow):
+            return self.cargo == other.cargo and self.stage == other.stage and self.values == other.values
+        return NotImplemented
+    
+    __hash__ = None
+    
+    def __repr__(self):
+        return f"ResultRow({self.cargo!r}, {self.stage!r}, {self.values!r})"
+
+def result_row_tuple(row):
+    """ResultRow, 행 dict 또는 read_result_rows 튜플 → OUTPUT_FIELDS 순서 튜플"""
+    if isinstance(row, ResultRow):
+        return row.as_tuple()
+    if isinstance(row, tuple):
+        return row
+    return tuple(row.get(field, '') for field in OUTPUT_FIELDS)
+
+@functools.lru_cache(maxsize=256)
+def shared_stage_rows(stage_data, stage_name):
+    """parse_stage_rows 결과 튜플 - 같은 응답 텍스트는 한 번만 파싱하고 행 튜플 공유
+    
+    가이드 공유 단계와 대체 데이터는 화물마다 같은 텍스트라 행 내용이 메모리에 한 벌만 남는다.
+    """
+    return tuple(parse_stage_rows(stage_data, stage_name))
+
+# 사전 인코딩 출력(.djsonl): 머리글 줄, 문자열 사전 줄 ["S", 문자열...], 블록 줄 [화물 id, Stage id, 행 목록 | 블록 번호]
+# 화물/Stage/Category는 문자열 사전 id로, 앞서 나온 블록과 같은 행 목록은 블록 번호로만 쓴다. 파트 파일마다 사전이 따로다.
+DICTIONARY_FORMAT = 'cargo-results-dict/1'
+
+def output_format_for(path):
+    """출력 파일 확장자 → 'csv' / 'jsonl' / 'djsonl'(사전 인코딩)"""
+    return {'.jsonl': 'jsonl', '.djsonl': 'djsonl'}.get(Path(path).suffix, 'csv')
+
+class DictionaryEncoder:
+    """사전 인코딩 출력 파일 한 파트의 문자열 사전 / 블록 사전 (블록은 행 목록 JSON의 다이제스트로 식별)"""
+    def __init__(self):
+        self.strings = {}  # 문자열 → id
+        self.blocks = {}  # 행 목록 다이제스트 → 블록 번호
+    
+    @staticmethod
+    def _digest(payload):
+        return hashlib.blake2b(payload.encode('utf-8'), digest_size=16).digest()
+    
+    @classmethod
+    def load(cls, path):
+        """기존 파일에 이어 쓰기 위해 사전 다시 만들기"""
+        encoder = cls()
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if isinstance(record, dict):
+                    continue
+                if record[0] == 'S':
+                    for value in record[1:]:
+                        encoder.strings.setdefault(value, len(encoder.strings))
+                elif isinstance(record[2], list):
+                    payload = json.dumps(record[2], ensure_ascii=False, separators=(',', ':'))
+                    encoder.blocks.setdefault(cls._digest(payload), len(encoder.blocks))
+        return encoder
+    
+    def encode(self, rows):
+        """OUTPUT_FIELDS 순서 튜플 목록 → 쓸 텍스트 (새 문자열 사전 줄 + 연속한 (화물, Stage)마다 블록 줄)"""
+        new_strings = []
+        
+        def string_id(value):
+            index = self.strings.get(value)
+            if index is None:
+                index = self.strings[value] = len(self.strings)
+                new_strings.append(value)
+            return index
+        
+        lines = []
+        for (cargo, stage), group in itertools.groupby(rows, key=operator.itemgetter(0, 1)):
+            prefix = f"[{string_id(cargo)},{string_id(stage)},"
+            payload = json.dumps([[string_id(row[2])] + list(row[3:]) for row in group],
+                                 ensure_ascii=False, separators=(',', ':'))
+            digest = self._digest(payload)
+            block = self.blocks.get(digest)
+            if block is None:
+                self.blocks[digest] = len(self.blocks)
+                lines.append(f"{prefix}{payload}]\n")
+            else:
+                lines.append(f"{prefix}{block}]\n")
+        if new_strings:
+            lines.insert(0, json.dumps(['S'] + new_strings, ensure_ascii=False, separators=(',', ':')) + '\n')
+        return "".join(lines)
+
+def read_dictionary_rows(lines):
+    """사전 인코딩 출력 줄들 → OUTPUT_FIELDS 순서 튜플 (같은 블록의 내용 문자열은 공유)"""
+    strings = []
+    blocks = []
+    for line in lines:
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        if isinstance(record, dict):
+            continue  # 머리글
+        if record[0] == 'S':
+            strings.extend(record[1:])
+            continue
+        rows = record[2]
+        if isinstance(rows, int):
+            rows = blocks[rows]
+        else:
+            rows = [(strings[row[0]],) + tuple(row[1:]) for row in rows]
+            blocks.append(rows)
+        prefix = (strings[record[0]], strings[record[1]])
+        for values in rows:
+            yield prefix + values
+
+class ResultWriter:
+    """결과 행 스트리밍 기록기 (추가 전용 CSV, JSONL 또는 사전 인코딩 JSONL)
+    
+    단계 결과가 나오는 대로 하나의 출력 파일에 이어 쓰고, flush_interval초마다
+    fsync로 디스크에 확정한다. rollover_bytes를 넘으면 다음 파트 파일로 넘어간다.
+    확정될 때마다 on_flush(기록된 (화물, Stage) 목록, (기준 경로, 파트 번호, 바이트 위치))를 호출한다.
+    confirmed(파트 번호, 바이트 위치, 끝 지문)를 주면 그 뒤에 남은 행(확정 기록 전에 강제 종료된 행)을 잘라내고 이어 쓴다.
+    """
+    def __init__(self, path='maximum_data_results.csv', output_format=None,
+                 flush_interval=5.0, rollover_bytes=None, on_flush=None, confirmed=None):
+        self.base_path = Path(path)
+        self.output_format = output_format or output_format_for(self.base_path)
+        self.flush_interval = flush_interval
+        self.rollover_bytes = rollover_bytes
+        self.on_flush = on_flush
+        self.lock = threading.Lock()
+        self.pending_keys = []
+        self.rows_written = 0
+        self.last_flush = time.monotonic()
+        self.discarded_bytes = self._discard_unconfirmed(confirmed) if confirmed else 0
+        self.part = self._last_part()
+        self.file = None
+        self._open()
+    
+    def _part_path(self, part):
+        if part == 0:
+            return self.base_path
+        return self.base_path.with_name(f"{self.base_path.stem}.part{part:04d}{self.base_path.suffix}")
+    
+    def _last_part(self):
+        part = 0
+        while self._part_path(part + 1).exists():
+            part += 1
+        return part
+    
+    def _open(self):
+        path = self._part_path(self.part)
+        is_new = not path.exists() or path.stat().st_size == 0
+        if not is_new:
+            self._trim_partial_line(path)
+        self.encoder = None
+        if self.output_format == 'djsonl':
+            self.encoder = DictionaryEncoder() if is_new else DictionaryEncoder.load(path)
+        self.file = open(path, 'a', encoding='utf-8', newline='')
+        self.csv_writer = None
+        if self.output_format == 'csv':
+            self.csv_writer = csv.writer(self.file)
+            if is_new:
+                self.file.write('\ufeff')  # 기존 배치 파일과 같은 utf-8-sig
+                self.csv_writer.writerow(OUTPUT_FIELDS)
+        elif self.encoder is not None and is_new:
+            self.file.write(json.dumps({'format': DICTIONARY_FORMAT, 'fields': OUTPUT_FIELDS}) + '\n')
+    
+    def _discard_unconfirmed(self, confirmed):
+        """마지막 확정 위치 뒤의 내용(뒤 파트 포함) 제거 → 제거한 바이트 수
+        
+        확정 위치보다 짧거나 확정 위치 앞부분의 지문이 다르면 다른 방법(병합, 수동 편집)으로 바뀐 파일이므로
+        건드리지 않는다.
+        """
+        part, offset, digest = confirmed
+        path = self._part_path(part)
+        if not path.exists() or path.stat().st_size < offset or file_tail_digest(path, offset) != digest:
+            return 0
+        discarded = path.stat().st_size - offset
+        later = part + 1
+        while self._part_path(later).exists():
+            discarded += self._part_path(later).stat().st_size
+            self._part_path(later).unlink()
+            later += 1
+        if path.stat().st_size > offset:
+            with open(path, 'rb+') as f:
+                f.truncate(offset)
+        return discarded
+    
+    @staticmethod
+    def _trim_partial_line(path):
+        """강제 종료로 끝이 잘린 마지막 줄 제거"""
+        with open(path, 'rb+') as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            f.seek(max(0, size - 65536))
+            tail = f.read()
+            if tail.endswith(b'\n'):
+                return
+            cut = tail.rfind(b'\n')
+            if cut >= 0:
+                f.truncate(size - len(tail) + cut + 1)
+    
+    @property
+    def path(self):
+        return self._part_path(self.part)
+    
+    def write_rows(self, rows, keys=()):
+        """행 추가 (rows: ResultRow 또는 행 dict, keys: 이 행들로 출력이 끝나는 (화물, Stage) 목록)"""
+        rows = [result_row_tuple(row) for row in rows]
+        with self.lock:
+            if self.csv_writer:
+                self.csv_writer.writerows(rows)
+            elif self.encoder is not None:
+                self.file.write(self.encoder.encode(rows))
+            else:
+                for row in rows:
+                    self.file.write(json.dumps(dict(zip(OUTPUT_FIELDS, row)), ensure_ascii=False) + '\n')
+            self.rows_written += len(rows)
+            self.pending_keys.extend(keys)
+            if time.monotonic() - self.last_flush >= self.flush_interval:
+                self._flush()
+    
+    def flush(self):
+        """버퍼를 디스크에 확정"""
+        with self.lock:
+            self._flush()
+    
+    def _flush(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.last_flush = time.monotonic()
+        keys, self.pending_keys = self.pending_keys, []
+        size = os.fstat(self.file.fileno()).st_size
+        position = (self.base_path, self.part, size, file_tail_digest(self.path, size))
+        if self.rollover_bytes and self.file.tell() >= self.rollover_bytes:
+            self.file.close()
+            self.part += 1
+            self._open()
+        if keys and self.on_flush:
+            self.on_flush(keys, position)
+    
+    def close(self):
+        with self.lock:
+            self._flush()
+            self.file.close()
+
+SHARD_FILE_PATTERN = re.compile(r'\.shard(\d+)of(\d+)(?:\.part(\d+))?$')
+
+def read_result_rows(path):
+    """출력 파일(CSV/JSONL/사전 인코딩 JSONL)의 행을 OUTPUT_FIELDS 순서 튜플로 읽기"""
+    path = Path(path)
+    with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+        if path.suffix == '.djsonl':
+            yield from read_dictionary_rows(f)
+        elif path.suffix == '.jsonl':
+            for line in f:
+                if line.strip():
+                    row = json.loads(line)
+                    yield tuple(row.get(field, '') for field in OUTPUT_FIELDS)
+        else:
+            for row in csv.DictReader(f):
+                yield tuple(row.get(field) or '' for field in OUTPUT_FIELDS)
+
+def merge_shard_outputs(output_path, cargo_order=None):
+    """샤드 출력 파일(롤오버 파트 포함)을 하나의 중복 없는 결과 파일로 병합
+    
+    같은 (화물, Stage) 결과가 여러 번 나오면 처음 나온 블록만 남긴다. cargo_order(화물 목록)를 주면
+    화물 리스트 순서 → 단계 순서로 정렬한다. 결과는 임시 파일에 쓴 뒤 output_path로 교체한다.
+    """
+    output_path = Path(output_path)
+    shard_files = []
+    for path in output_path.parent.glob(f"{output_path.stem}.shard*{output_path.suffix}"):
+        match = SHARD_FILE_PATTERN.search(path.name[:len(path.name) - len(output_path.suffix)])
+        if match:
+            shard_files.append(((int(match.group(2)), int(match.group(1)), int(match.group(3) or 0)), path))
+    if not shard_files:
+        raise FileNotFoundError(f"{output_path.stem}.shard*{output_path.suffix} 파일이 없습니다")
+    shard_files.sort()
+    
+    counts = {count for (count, _, _), _ in shard_files}
+    if len(counts) > 1:
+        raise ValueError(f"샤드 수가 다른 출력 파일이 섞여 있습니다: {sorted(counts)}")
+    count = counts.pop()
+    missing_shards = sorted(set(range(1, count + 1)) - {index for (_, index, _), _ in shard_files})
+    
+    blocks = {}  # (화물, Stage) → 행 튜플 목록
+    duplicates = 0
+    for _, path in shard_files:
+        current_key = None
+        for row in read_result_rows(path):
+            key = (row[0], row[1])
+            if key != current_key:
+                current_key = key
+                if key in blocks:
+                    duplicates += 1
+                    current_rows = None
+                else:
+                    current_rows = blocks[key] = []
+            if current_rows is not None:
+                current_rows.append(ResultRow.from_tuple(row))
+    
+    stage_order = {stage_key: i for i, (_, _, stage_key) in enumerate(STAGES)}
+    cargo_rank = {cargo: i for i, cargo in enumerate(dict.fromkeys(cargo_order or []))}
+    keys = sorted(blocks, key=lambda key: (cargo_rank.get(key[0], len(cargo_rank)), key[0],
+                                           stage_order.get(key[1], len(stage_order))))
+    
+    temp_path = output_path.with_name(output_path.name + '.merging')
+    if temp_path.exists():
+        temp_path.unlink()
+    writer = ResultWriter(temp_path, output_format=output_format_for(output_path), flush_interval=float('inf'))
+    rows = 0
+    for key in keys:
+        writer.write_rows(blocks[key])
+        rows += len(blocks[key])
+    writer.close()
+    os.replace(temp_path, output_path)
+    
+    merged_cargos = {cargo for cargo, _ in blocks}
+    return {
+        'files': len(shard_files),
+        'shards': count,
+        'missing_shards': missing_shards,
+        'rows': rows,
+        'stages': len(blocks),
+        'duplicates': duplicates,
+        'cargos': len(merged_cargos),
+        'missing_cargos': [cargo for cargo in cargo_rank if cargo not in merged_cargos],
+    }
+
+def replace_result_blocks(path, replacements, output_format=None):
+    """출력 파일(롤오버 파트 포함)의 (화물, Stage) 블록을 새 행으로 제자리 교체
+    
+    replacements: {(화물, Stage): [ResultRow 또는 행 dict, ...]}. 같은 키의 블록마다 (목록에 같은 화물이 여러 번
+    있으면 여러 블록) 새 행으로 바꿔 쓴다. 파일에 없던 단계는 같은 화물의 블록 사이에 단계 순서대로 끼워 넣고,
+    화물 자체가 없으면 마지막 파트 끝에 추가한다. 바뀐 파일만 임시 파일에 다시 쓴 뒤 교체하며,
+    실제로 블록을 기록한 키 목록을 반환한다 (행이 없는 교체는 기록하지 않음).
+    """
+    base = Path(path)
+    output_format = output_format or output_format_for(base)
+    parts = [part for part in [base] + sorted(base.parent.glob(
+        f"{base.stem}.part[0-9][0-9][0-9][0-9]{base.suffix}")) if part.exists()]
+    stage_order = {stage_key: i for i, (_, _, stage_key) in enumerate(STAGES)}
+    
+    # 파일에 없는 단계는 같은 화물 블록 옆에 끼워 넣음
+    present = {(row[0], row[1]) for part in parts for row in read_result_rows(part)}
+    present_cargos = {cargo for cargo, _ in present}
+    inserts = {}  # 화물 → 끼워 넣을 Stage 목록 (단계 순서)
+    for cargo, stage_key in replacements:
+        if (cargo, stage_key) not in present and cargo in present_cargos:
+            inserts.setdefault(cargo, []).append(stage_key)
+    for stage_keys in inserts.values():
+        stage_keys.sort(key=lambda stage_key: stage_order.get(stage_key, len(stage_order)))
+    
+    done = set()
+    
+    def write_block(writer, key):
+        """교체 행 기록 → 기록한 행이 있으면 True"""
+        rows = replacements[key]
+        if rows:
+            writer.write_rows(rows)
+            done.add(key)
+        return bool(rows)
+    
+    for part in parts:
+        temp_path = part.with_name(part.name + '.repairing')
+        if temp_path.exists():
+            temp_path.unlink()
+        writer = ResultWriter(temp_path, output_format=output_format, flush_interval=float('inf'))
+        changed = False
+        skipping = False
+        current_key = None
+        block = []  # 교체하지 않는 현재 블록의 행
+        
+        def insert_missing(cargo, before=None):
+            """cargo의 빠진 단계 중 before 단계보다 앞선 것(None이면 전부) 기록"""
+            pending = inserts.get(cargo)
+            written = False
+            while pending and (before is None or
+                               stage_order.get(pending[0], len(stage_order)) < stage_order.get(before, len(stage_order))):
+                written = write_block(writer, (cargo, pending.pop(0))) or written
+            return written
+        
+        for row in read_result_rows(part):
+            key = (row[0], row[1])
+            if key != current_key:
+                if block:
+                    writer.write_rows(block)
+                    block = []
+                if current_key is not None and current_key[0] != key[0] and inserts.get(current_key[0]):
+                    changed = insert_missing(current_key[0]) or changed
+                if inserts.get(key[0]):
+                    changed = insert_missing(key[0], before=key[1]) or changed
+                current_key = key
+                skipping = key in replacements
+                if skipping:
+                    # 빈 교체 행이면 기존 블록을 지우는 것이므로 파일은 바뀜
+                    changed = True
+                    write_block(writer, key)
+            if not skipping:
+                block.append(row)
+        if block:
+            writer.write_rows(block)
+        if current_key is not None and inserts.get(current_key[0]):
+            changed = insert_missing(current_key[0]) or changed
+        writer.close()
+        if changed:
+            os.replace(temp_path, part)
+        else:
+            temp_path.unlink()
+    
+    remaining = [key for key in replacements if key not in done and replacements[key]]
+    if remaining:
+        writer = ResultWriter(base, output_format=output_format, flush_interval=float('inf'))
+        for key in remaining:
+            write_block(writer, key)
+        writer.close()
+    return [key for key in replacements if key in done]
+
+def file_tail_digest(path, offset, size=256):
+    """offset 바로 앞 size바이트의 지문 - 확정 위치가 같은 파일 내용을 가리키는지 확인용"""
+    with open(path, 'rb') as f:
+        f.seek(max(0, offset - size))
+        return hashlib.blake2b(f.read(min(offset, size)), digest_size=8).hexdigest()
+
+def output_end_position(path):
+    """출력 파일(롤오버 파트 포함)의 끝 위치 (마지막 파트 번호, 크기, 끝 지문) - 제자리 교체 후 확정 위치 갱신용"""
+    base = Path(path)
+    part = 0
+    while base.with_name(f"{base.stem}.part{part + 1:04d}{base.suffix}").exists():
+        part += 1
+    last = base if part == 0 else base.with_name(f"{base.stem}.part{part:04d}{base.suffix}")
+    size = last.stat().st_size if last.exists() else 0
+    return part, size, file_tail_digest(last, size) if last.exists() else None
+
+def output_position_key(path):
+    """진행 기록 meta의 출력 확정 위치 키 (작업 디렉토리와 무관하게 절대 경로 기준)"""
+    return f"output_position:{Path(path).resolve()}"
+
+# 진행 기록(ledger) 기본 위치: 작업 디렉토리와 무관하게 스크립트 옆에 둔다
+BASE_DIR = Path(__file__).resolve().parent
+DEFAULT_LEDGER_PATH = BASE_DIR / 'analysis_progress.sqlite3'
+
+class ProgressLedger:
+    """화물/단계별 완료 기록 (SQLite)
+    
+    배치 CSV를 매번 다시 읽지 않고 인덱스된 테이블에서 진행 상황을 복원한다.
+    날짜와 작업 디렉토리에 관계없이 같은 기록을 이어 쓴다.
+    """
+    def __init__(self, path=DEFAULT_LEDGER_PATH, read_only=False):
+        self.path = str(path)
+        self.lock = threading.Lock()
+        if read_only:
+            # 실행 계획(--plan)용: 기록 파일을 읽기 전용으로 복사한 메모리 DB에서만 작업 (파일은 만들지도 바꾸지도 않음)
+            self.conn = sqlite3.connect(":memory:", check_same_thread=False, isolation_level=None)
+            if os.path.exists(self.path):
+                # WAL 파일이 남아 있지 않으면(정상 종료) immutable로 열어 -wal/-shm 파일도 만들지 않음
+                option = "mode=ro" if os.path.exists(self.path + "-wal") else "immutable=1"
+                source = sqlite3.connect(f"{Path(self.path).resolve().as_uri()}?{option}", uri=True)
+                try:
+                    source.backup(self.conn)
+                finally:
+                    source.close()
+        else:
+            self.conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS cargo_progress (
+                cargo TEXT PRIMARY KEY,
+                batch INTEGER NOT NULL,
+                completed REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS stage_progress (
+                cargo TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                batch INTEGER NOT NULL,
+                completed REAL NOT NULL,
+                rows TEXT,
+                written INTEGER NOT NULL DEFAULT 0,
+                fingerprint TEXT,
+                failed INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (cargo, stage)
+            );
+        """)
+        # 이전 버전 기록 파일에는 단계 결과/출력 기록/입력 지문/실패 컬럼이 없음
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(stage_progress)")}
+        if 'rows' not in columns:
+            self.conn.execute("ALTER TABLE stage_progress ADD COLUMN rows TEXT")
+        if 'written' not in columns:
+            self.conn.execute("ALTER TABLE stage_progress ADD COLUMN written INTEGER NOT NULL DEFAULT 0")
+        if 'fingerprint' not in columns:
+            self.conn.execute("ALTER TABLE stage_progress ADD COLUMN fingerprint TEXT")
+        if 'failed' not in columns:
+            self.conn.execute("ALTER TABLE stage_progress ADD COLUMN failed INTEGER NOT NULL DEFAULT 0")
+    
+    def get_meta(self, key, default=None):
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+    
+    def set_meta(self, key, value):
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+    
+    def last_batch(self):
+        """마지막으로 기록된 배치 번호"""
+        return int(self.get_meta('last_batch', 0))
+    
+    def processed_cargos(self):
+        """모든 단계가 끝난 화물 집합"""
+        with self.lock:
+            return {row[0] for row in self.conn.execute("SELECT cargo FROM cargo_progress")}
+    
+    def completed_stages(self, cargo):
+        """화물별 완료된 단계 집합 (실패로 기록된 단계 제외)"""
+        with self.lock:
+            rows = self.conn.execute("SELECT stage FROM stage_progress WHERE cargo = ? AND failed = 0", (cargo,))
+            return {row[0] for row in rows}
+    
+    def stage_results(self, cargo):
+        """화물별로 저장된 단계 결과 {Stage: ([[Category, Description, Detail1-3], ...], 출력 기록 여부)}
+        
+        배치 CSV에서 가져와 행 내용이 없는 단계와 실패(오류 / 대체 데이터 / 빈 결과)로 기록된 단계는 제외한다.
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT stage, rows, written FROM stage_progress "
+                "WHERE cargo = ? AND rows IS NOT NULL AND failed = 0", (cargo,))
+            return {stage: (json.loads(payload), bool(written)) for stage, payload, written in rows}
+    
+    def stage_rows(self):
+        """저장된 모든 단계 결과 [(화물, Stage, 행 목록 또는 None)] - 배치 CSV에서 가져온 단계는 None"""
+        with self.lock:
+            rows = self.conn.execute("SELECT cargo, stage, rows FROM stage_progress ORDER BY rowid").fetchall()
+        return [(cargo, stage, json.loads(payload) if payload is not None else None) for cargo, stage, payload in rows]
+    
+    def stage_fingerprints(self):
+        """기록된 단계의 입력 지문 {(화물, Stage): 지문 또는 None} - 지문 기록 전 버전의 단계는 None"""
+        with self.lock:
+            rows = self.conn.execute("SELECT cargo, stage, fingerprint FROM stage_progress").fetchall()
+        return {(cargo, stage): fingerprint for cargo, stage, fingerprint in rows}
+    
+    def set_fingerprints(self, entries):
+        """지문이 없는 단계에 현재 입력 지문을 기준값으로 기록 (entries: [(지문, 화물, Stage)])"""
+        with self.lock:
+            self.conn.executemany(
+                "UPDATE stage_progress SET fingerprint = ? WHERE cargo = ? AND stage = ? AND fingerprint IS NULL",
+                list(entries))
+    
+    def mark_written(self, cargo_stages, position=None):
+        """출력 파일에 확정된 (화물, Stage) 표시
+        
+        position: (출력 기준 경로, 파트 번호, 바이트 위치, 끝 지문) - 같은 트랜잭션에 확정 위치를 기록해
+        재시작 시 그 뒤에 남은 행(fsync 후 기록 전에 강제 종료)을 잘라낼 수 있게 한다.
+        """
+        with self.lock:
+            self.conn.execute("BEGIN")
+            try:
+                self.conn.executemany("UPDATE stage_progress SET written = 1 WHERE cargo = ? AND stage = ?",
+                                      list(cargo_stages))
+                if position is not None:
+                    path, *confirmed = position
+                    self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                                      (output_position_key(path), json.dumps(confirmed)))
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+    
+    def output_position(self, path):
+        """출력 파일의 마지막 확정 위치 (파트 번호, 바이트 위치, 끝 지문) - 기록 전 버전이면 None"""
+        value = self.get_meta(output_position_key(path))
+        return tuple(json.loads(value)) if value else None
+    
+    def record_stage(self, cargos, stage, batch_num, results, fingerprint=None, failed=False):
+        """단계 하나가 끝나는 즉시 결과 행과 입력 지문을 저장 (작업 단위의 모든 화물에 기록)
+        
+        failed: 오류 / 대체 데이터 / 빈 결과 - 행은 --repair 검사용으로 남기되 재시작 시 다시 요청한다
+        """
+        payload = json.dumps([row.values for row in results], ensure_ascii=False)
+        now = time.time()
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO stage_progress (cargo, stage, batch, completed, rows, fingerprint, failed) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(cargo, stage, batch_num, now, payload, fingerprint, int(failed)) for cargo in cargos])
+    
+    def record_batch(self, batch_num, cargo_stages):
+        """배치 저장 후 화물 완료를 한 트랜잭션으로 기록
+        
+        cargo_stages: {화물: 완료된 Stage 값 목록} - 아직 기록되지 않은 단계만 추가한다
+        """
+        now = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN")
+            try:
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO stage_progress (cargo, stage, batch, completed, written) VALUES (?, ?, ?, ?, 1)",
+                    [(cargo, stage, batch_num, now) for cargo, stages in cargo_stages.items() for stage in stages])
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO cargo_progress (cargo, batch, completed) VALUES (?, ?, ?)",
+                    [(cargo, batch_num, now) for cargo in cargo_stages])
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES ('last_batch', "
+                    "MAX(?, COALESCE((SELECT CAST(value AS INTEGER) FROM meta WHERE key = 'last_batch'), 0)))",
+                    (batch_num,))
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+    
+    def import_batch_files(self, directory='.'):
+        """기존 배치 CSV(모든 날짜)에서 진행 상황을 한 번만 가져오기"""
+        if self.get_meta('imported_batch_files'):
+            return 0
+        
+        imported = 0
+        for file in sorted(Path(directory).glob('maximum_data_batch_*_*.csv')):
+            try:
+                # 파일명 형식: maximum_data_batch_X_YYYYMMDD_HHMM.csv
+                batch_num = int(file.stem.split('_')[3])
+            except (IndexError, ValueError):
+                continue
+            
+            cargo_stages = {}
+            try:
+                with open(file, 'r', encoding='utf-8-sig', newline='') as f:
+                    for row in csv.DictReader(f):
+                        cargo = row.get('Cargo')
+                        if cargo:
+                            cargo_stages.setdefault(cargo, set()).add(row.get('Stage', ''))
+            except Exception as e:
+                print(f"  ⚠️ 파일 읽기 오류 {file}: {e}")
+                continue
+            
+            self.record_batch(batch_num, cargo_stages)
+            imported += 1
+        
+        self.set_meta('imported_batch_files', datetime.now().isoformat())
+        return imported
+    
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+class ModelCallTimeout(Exception):
+    """모델 호출이 호출별 제한 시간 안에 끝나지 않음"""
+
+class CallShutdown(Exception):
+    """중단 요청이나 호출 풀 종료 때문에 실행하지 못한 모델 호출 - 오류 결과로 기록하지 않고 다음 실행에서 다시 요청"""
+
+class CallSupervisor:
+    """모델 호출 감시자
+    
+    호출마다 제한 시간을 두고, 멈춘 호출 하나만 포기한 뒤 호출한 쪽에서 재시도하게 한다.
+    포기한 호출이 스레드를 계속 붙잡아 호출 풀이 고갈되면 프로세스를 끝내지 않고
+    새 호출 풀로 교체한다. 호출별 지연 시간을 기록한다.
+    """
+    def __init__(self, call_timeout=120.0, pool_size=4):
+        self.call_timeout = call_timeout
+        self.pool_size = max(2, pool_size)
+        self.lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix='model-call')
+        self.generation = 0  # 풀 교체 횟수
+        self.closed = False  # shutdown 이후에는 새 호출 대신 CallShutdown
+        self.stuck_calls = 0  # 현재 풀에서 포기했지만 아직 끝나지 않은 호출 수
+        self.timeouts = 0
+        self.latencies = []
+    
+    def call(self, fn, *args, **kwargs):
+        """제한 시간 안에 fn 실행, 초과 시 ModelCallTimeout"""
+        with self.lock:
+            pool, generation = self.pool, self.generation
+        
+        start = time.monotonic()
+        try:
+            return self._wait(pool, generation, self.call_timeout, "응답 없음", fn, *args, **kwargs)
+        finally:
+            with self.lock:
+                self.latencies.append(time.monotonic() - start)
+    
+    def stream(self, fn, *args, stall_timeout=None, **kwargs):
+        """스트리밍 호출 → 청크 생성기
+        
+        첫 응답은 call_timeout, 이후 청크 사이는 stall_timeout(기본 call_timeout) 안에 와야 하며
+        넘으면 ModelCallTimeout. 지연 시간은 스트림이 끝나거나 중단될 때까지로 기록한다.
+        """
+        with self.lock:
+            pool, generation = self.pool, self.generation
+        
+        stall_timeout = stall_timeout or self.call_timeout
+        start = time.monotonic()
+        try:
+            iterator = iter(self._wait(pool, generation, self.call_timeout, "응답 없음", fn, *args, **kwargs))
+            while True:
+                chunk = self._wait(pool, generation, stall_timeout, "출력 없음 (스트림 멈춤)", next, iterator, None)
+                if chunk is None:
+                    return
+                yield chunk
+        finally:
+            with self.lock:
+                self.latencies.append(time.monotonic() - start)
+    
+    def _wait(self, pool, generation, timeout, message, fn, *args, **kwargs):
+        try:
+            future = pool.submit(fn, *args, **kwargs)
+        except RuntimeError as e:
+            # 종료된 풀: 멈춘 호출 때문에 교체된 풀이면 재시도, 감시자/인터프리터 종료면 중단
+            if not self.closed and generation != self.generation:
+                raise ModelCallTimeout("호출 풀 재시작") from e
+            raise CallShutdown(f"호출 풀 종료됨 ({e})") from e
+        try:
+            return future.result(timeout=timeout)
+        except FuturesTimeout:
+            future.cancel()
+            self._abandon(future, generation)
+            raise ModelCallTimeout(f"{timeout:g}초 내 {message}")
+        except CancelledError as e:
+            if not self.closed and generation != self.generation:
+                raise ModelCallTimeout("호출 풀 재시작") from e
+            raise CallShutdown("호출 풀 종료로 취소됨") from e
+    
+    def _abandon(self, future, generation):
+        """멈춘 호출 포기 - 풀의 절반 이상이 멈춰 있으면 풀 교체"""
+        with self.lock:
+            self.timeouts += 1
+            if generation != self.generation:
+                return
+            self.stuck_calls += 1
+            restart = self.stuck_calls >= self.pool_size // 2
+        
+        future.add_done_callback(lambda _: self._release(generation))
+        if restart:
+            self.restart_pool("멈춘 호출이 호출 풀을 점유")
+    
+    def _release(self, generation):
+        with self.lock:
+            if generation == self.generation and self.stuck_calls > 0:
+                self.stuck_calls -= 1
+    
+    def restart_pool(self, reason):
+        """프로세스 재시작 없이 호출 풀 교체 (멈춘 스레드는 버림)"""
+        with self.lock:
+            old_pool = self.pool
+            self.pool = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix='model-call')
+            self.generation += 1
+            self.stuck_calls = 0
+        old_pool.shutdown(wait=False, cancel_futures=True)
+        print(f"\n🔁 호출 풀 재시작 ({reason}) - {self.generation}회째")
+    
+    def latency_stats(self):
+        """호출 지연 시간 통계 (초)"""
+        with self.lock:
+            latencies = sorted(self.latencies)
+            timeouts, restarts = self.timeouts, self.generation
+        if not latencies:
+            return {'count': 0, 'p50': 0.0, 'p90': 0.0, 'p99': 0.0, 'max': 0.0,
+                    'timeouts': timeouts, 'restarts': restarts}
+        
+        def percentile(q):
+            return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+        
+        return {
+            'count': len(latencies),
+            'p50': percentile(0.50),
+            'p90': percentile(0.90),
+            'p99': percentile(0.99),
+            'max': latencies[-1],
+            'timeouts': timeouts,
+            'restarts': restarts,
+        }
+    
+    def shutdown(self):
+        """호출 풀 종료 - 이후 호출은 CallShutdown (호출하는 작업 스레드를 먼저 끝낸 뒤 부를 것)"""
+        with self.lock:
+            pool = self.pool
+            self.closed = True
+        pool.shutdown(wait=False, cancel_futures=True)
+
+# 응답 finish_reason 코드 (google.generativeai Candidate.FinishReason)
+FINISH_REASONS = {0: 'UNSPECIFIED', 1: 'STOP', 2: 'MAX_TOKENS', 3: 'SAFETY', 4: 'RECITATION', 5: 'OTHER'}
+
+def finish_reason_name(value):
+    """finish_reason 값(enum 또는 정수) → 이름"""
+    if value is None:
+        return None
+    return getattr(value, 'name', None) or FINISH_REASONS.get(value, str(value))
+
+# 모델 호출 지연 히스토그램 구간 (초)
+LATENCY_BUCKETS = (0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300)
+
+class MetricsRecorder:
+    """호출/단계/화물 단위 구조화 지표
+    
+    record(event, **fields)로 받은 이벤트를 단계별로 집계하고, path를 주면 JSONL로 한 줄씩
+    기록한다. start_server(port)는 같은 집계를 Prometheus 텍스트 형식으로 /metrics에 노출한다.
+    이벤트: call(모델 요청 1건, 재시도 포함), stage(화물 단계 결과), cargo(화물 완료).
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = open(path, 'a', encoding='utf-8', buffering=1) if path else None  # 줄 단위로 바로 기록
+        self.counters = {}  # (지표 이름, 라벨 튜플) → 값
+        self.histograms = {}  # Stage → [구간별 개수..., 합계, 개수]
+        self.server = None
+    
+    def _add(self, name, labels, value=1):
+        key = (name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+    
+    def record(self, event, **fields):
+        fields = {'ts': round(time.time(), 3), 'event': event, **fields}
+        with self.lock:
+            if self.file:
+                self.file.write(json.dumps(fields, ensure_ascii=False) + '\n')
+            stage = fields.get('stage')
+            if event == 'call':
+                self._add('model_calls_total', (('stage', stage), ('outcome', fields['outcome'])))
+                self._add('model_call_seconds_total', (('stage', stage),), fields['latency_s'])
+                self._add('rate_limit_wait_seconds_total', (('stage', stage),), fields['wait_s'])
+                for kind in ('input', 'output', 'cached'):
+                    self._add('tokens_total', (('stage', stage), ('kind', kind)), fields[f'{kind}_tokens'])
+                for reason in ('rate_limit', 'timeout', 'schema', 'stream', 'medicine'):
+                    if fields[f'{reason}_retries']:
+                        self._add('retries_total', (('stage', stage), ('reason', reason)), fields[f'{reason}_retries'])
+                if fields['finish_reason']:
+                    self._add('finish_reason_total', (('stage', stage), ('reason', fields['finish_reason'])))
+                if fields['first_row_s'] is not None:
+                    self._add('first_row_seconds_total', (('stage', stage),), fields['first_row_s'])
+                    self._add('first_row_calls_total', (('stage', stage),))
+                if fields['outcome'] != 'cache':
+                    buckets = self.histograms.setdefault(stage, [0] * (len(LATENCY_BUCKETS) + 2))
+                    for i, bound in enumerate(LATENCY_BUCKETS):
+                        if fields['latency_s'] <= bound:
+                            buckets[i] += 1
+                    buckets[-2] += fields['latency_s']
+                    buckets[-1] += 1
+            elif event == 'stage':
+                self._add('stages_total', (('stage', stage), ('source', fields['source'])))
+                self._add('stage_rows_total', (('stage', stage),), fields['rows'])
+                self._add('stage_seconds_total', (('stage', stage),), fields['duration_s'])
+                if fields['fallback']:
+                    self._add('fallback_stages_total', (('stage', stage),))
+                if fields['failed']:
+                    self._add('failed_stages_total', (('stage', stage),))
+            elif event == 'cargo':
+                self._add('cargos_total', ())
+                self._add('cargo_rows_total', (), fields['rows'])
+                self._add('cargo_seconds_total', (), fields['duration_s'])
+    
+    def render_prometheus(self):
+        """Prometheus 텍스트 형식 (지표 이름 앞에 cargo_analysis_ 접두사)"""
+        def label_text(labels):
+            if not labels:
+                return ''
+            escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+                       for _, value in labels)
+            return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+        
+        lines = []
+        with self.lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                lines.append(f"cargo_analysis_{name}{label_text(labels)} {value:g}")
+            for stage, buckets in sorted(self.histograms.items()):
+                for bound, count in zip(LATENCY_BUCKETS, buckets):
+                    lines.append(f"cargo_analysis_model_call_seconds_bucket"
+                                 f"{label_text((('stage', stage), ('le', bound)))} {count}")
+                lines.append(f"cargo_analysis_model_call_seconds_bucket{label_text((('stage', stage), ('le', '+Inf')))} "
+                             f"{buckets[-1]}")
+                lines.append(f"cargo_analysis_model_call_seconds_sum{label_text((('stage', stage),))} {buckets[-2]:g}")
+                lines.append(f"cargo_analysis_model_call_seconds_count{label_text((('stage', stage),))} {buckets[-1]}")
+        lines.append("cargo_analysis_up 1")
+        return "\n".join(lines) + "\n"
+    
+    def start_server(self, port, host='127.0.0.1'):
+        """/metrics HTTP 엔드포인트를 데몬 스레드로 시작"""
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        
+        recorder = self
+        
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = recorder.render_prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def log_message(self, format, *args):
+                pass
+        
+        self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True, name='metrics-http').start()
+        return self.server.server_address
+    
+    def stage_summary(self):
+        """단계별 합계: {Stage: {calls, seconds, input_tokens, output_tokens, rows, stages, fallback, failed, retries,
+        first_row_s, first_row_calls}}"""
+        summary = {}
+        with self.lock:
+            for (name, labels), value in self.counters.items():
+                labels = dict(labels)
+                if 'stage' not in labels:
+                    continue
+                entry = summary.setdefault(labels['stage'], {
+                    'calls': 0, 'seconds': 0.0, 'input_tokens': 0, 'output_tokens': 0,
+                    'rows': 0, 'stages': 0, 'fallback': 0, 'failed': 0, 'retries': 0,
+                    'first_row_s': 0.0, 'first_row_calls': 0})
+                if name == 'model_calls_total' and labels['outcome'] != 'cache':
+                    entry['calls'] += value
+                elif name == 'model_call_seconds_total':
+                    entry['seconds'] += value
+                elif name == 'tokens_total' and labels['kind'] in ('input', 'output'):
+                    entry[f"{labels['kind']}_tokens"] += value
+                elif name == 'stage_rows_total':
+                    entry['rows'] += value
+                elif name == 'stages_total':
+                    entry['stages'] += value
+                elif name == 'fallback_stages_total':
+                    entry['fallback'] += value
+                elif name == 'failed_stages_total':
+                    entry['failed'] += value
+                elif name == 'retries_total':
+                    entry['retries'] += value
+                elif name == 'first_row_seconds_total':
+                    entry['first_row_s'] += value
+                elif name == 'first_row_calls_total':
+                    entry['first_row_calls'] += value
+        return summary
+    
+    def close(self):
+        if self.server:
+            self.server.shutdown()
+            self.server = None
+        with self.lock:
+            if self.file:
+                self.file.close()
+                self.file = None
+
+# 5단계 분석 정의: (단계 이름, 추출 메서드 이름, 결과 Stage 값)
+STAGES = [
+    ("위험성 분석", "extract_maximum_data_stage1", "Risk Analysis"),
+    ("응급처치", "extract_maximum_data_stage2", "Emergency Procedures"),
+    ("통계 데이터", "extract_maximum_data_stage3", "Statistical Data"),
+    ("환경/추가 정보", "extract_maximum_data_stage4", "Environmental/Additional"),
+    ("선박 의약품 가이드라인", "extract_maximum_data_stage5", "Maritime Medical Guidelines"),
+]
+
+# 단계별 프롬프트: (화물별 머리말, 고정 지시문)
+# 머리말 + 지시문이 기존 단일 프롬프트와 같도록 나눈 것으로, 고정 지시문은
+# 접두사 캐시 모드에서 system instruction / 컨텍스트 캐시로 한 번만 보낸다.
+STAGE_PROMPTS = {
+    "Risk Analysis": (
+        """
+        Analyze {cargo} comprehensively for ALL POSSIBLE health risks.
+""",
+        """        
+        PROVIDE EXACTLY 28-47 DETAILED HEALTH RISKS covering:
+        1. ACUTE INHALATION (mild, moderate, severe, lethal concentrations)
+        2. ACUTE DERMAL (splash, vapor, prolonged contact, sensitization)
+        3. ACUTE OCULAR (direct contact, vapor, splash, permanent damage)
+        4. ACUTE ORAL (accidental ingestion, intentional, various doses)
+        5. CHRONIC INHALATION (occupational, environmental, long-term)
+        6. CHRONIC DERMAL (repeated contact, absorption, accumulation)
+        7. SYSTEMIC TOXICITY (liver, kidney, heart, lung, nervous system)
+        8. REPRODUCTIVE EFFECTS (male, female, fertility, hormonal)
+        9. DEVELOPMENTAL EFFECTS (pregnancy, fetal, pediatric, growth)
+        10. CARCINOGENIC EFFECTS (various cancer types, mechanisms)
+        11. RESPIRATORY SENSITIZATION (asthma, allergic reactions)
+        12. SKIN SENSITIZATION (contact dermatitis, allergies)
+        13. IMMUNOTOXICITY (immune suppression, autoimmune)
+        14. NEUROTOXICITY (CNS, PNS, cognitive, motor effects)
+        15. CARDIOVASCULAR EFFECTS (arrhythmia, hypertension, cardiac arrest)
+        16. HEMATOLOGICAL EFFECTS (anemia, bleeding, blood chemistry)
+        17. ENDOCRINE DISRUPTION (thyroid, adrenal, pancreatic)
+        18. GENETIC TOXICITY (mutagenic, DNA damage, chromosomal)
+        19. SPECIAL POPULATIONS (elderly, children, pregnant, diseased)
+        20. ENVIRONMENTAL EXPOSURE (air, water, food contamination)
+        
+        Format: RISK_TYPE|DETAILED_DESCRIPTION|SEVERITY_LEVEL|ONSET_TIME|DURATION|MECHANISM
+        MINIMUM 28 entries, MAXIMUM 47 entries. Be exhaustive and specific.
+        """),
+    "Emergency Procedures": (
+        """
+        Comprehensive emergency procedures for {cargo}:
+""",
+        """        
+        PROVIDE EXACTLY 24-38 EMERGENCY SCENARIOS covering:
+        1. MILD INHALATION (low concentration, brief exposure)
+        2. MODERATE INHALATION (significant symptoms, respiratory distress)
+        3. SEVERE INHALATION (life-threatening, pulmonary edema)
+        4. SKIN CONTACT (liquid splash, minimal area)
+        5. EXTENSIVE SKIN CONTACT (large area, prolonged exposure)
+        6. EYE CONTACT (splash, vapor exposure, chemical burns)
+        7. ORAL INGESTION (accidental small amounts)
+        8. LARGE ORAL INGESTION (intentional, life-threatening)
+        9. DERMAL ABSORPTION (chronic exposure through skin)
+        10. COMBINED EXPOSURES (multiple routes simultaneously)
+        11. PEDIATRIC EXPOSURES (children, dose adjustments)
+        12. PREGNANCY EXPOSURES (maternal and fetal considerations)
+        13. ELDERLY EXPOSURES (age-related complications)
+        14. PRE-EXISTING CONDITIONS (asthma, liver disease, etc.)
+        15. OCCUPATIONAL EXPOSURES (workplace accidents)
+        16. MASS CASUALTY INCIDENTS (multiple victims)
+        17. CONFINED SPACE EXPOSURES (enhanced toxicity)
+        18. FIRE/EXPLOSION SCENARIOS (thermal injury + chemical)
+        19. CONTAMINATED CLOTHING/PPE (decontamination procedures)
+        20. TRANSPORTATION ACCIDENTS (spill response)
+        21. HOME EXPOSURES (household accident management)
+        22. DELAYED ONSET TOXICITY (symptoms hours/days later)
+        23. ALLERGIC REACTIONS (sensitization responses)
+        24. CHEMICAL BURNS (acid/base tissue damage)
+        25. SYSTEMIC POISONING (organ failure management)
+        
+        Format: SCENARIO|IMMEDIATE_ACTION|MEDICAL_TREATMENT|MONITORING_REQUIREMENTS|PROGNOSIS|FOLLOW_UP
+        MINIMUM 24 entries, MAXIMUM 38 entries. Include specific protocols.
+        """),
+    "Statistical Data": (
+        """
+        Comprehensive statistical and epidemiological data for {cargo}:
+""",
+        """        
+        PROVIDE EXACTLY 19-33 DATA POINTS covering:
+        1. ACUTE TOXICITY VALUES (LD50 oral, dermal, inhalation LC50)
+        2. EXPOSURE LIMITS (PEL, TLV-TWA, TLV-STEL, TLV-C, IDLH)
+        3. CARCINOGENICITY DATA (cancer slope factors, unit risk)
+        4. DOSE-RESPONSE RELATIONSHIPS (NOAEL, LOAEL, BMD)
+        5. HUMAN EPIDEMIOLOGY (occupational studies, case reports)
+        6. MORTALITY STATISTICS (death rates, causes of death)
+        7. MORBIDITY DATA (hospitalization rates, ICU admissions)
+        8. RECOVERY STATISTICS (treatment success rates, disabilities)
+        9. EMERGENCY ROOM VISITS (annual cases, severity distribution)
+        10. LONG-TERM HEALTH OUTCOMES (chronic disease rates)
+        11. PEDIATRIC EXPOSURE DATA (children's vulnerability factors)
+        12. PREGNANCY OUTCOMES (birth defects, miscarriage rates)
+        13. OCCUPATIONAL ILLNESS RATES (by industry, job function)
+        14. ENVIRONMENTAL EXPOSURE LEVELS (air, water, soil concentrations)
+        15. BIOMONITORING DATA (blood, urine levels in populations)
+        16. PHARMACOKINETIC PARAMETERS (absorption, distribution, elimination)
+        17. BENCHMARK DOSES (critical effect levels)
+        18. RISK ASSESSMENT VALUES (cancer risk, non-cancer hazard)
+        19. EMERGENCY RESPONSE STATISTICS (response times, outcomes)
+        20. COST DATA (medical costs, lost productivity)
+        21. REGULATORY STATUS (various countries, classifications)
+        22. ANALYTICAL METHODS (detection limits, methods)
+        23. ANIMAL STUDY DATA (species differences, extrapolation)
+        24. MECHANISM OF ACTION DATA (molecular targets, pathways)
+        25. GENETIC POLYMORPHISM EFFECTS (susceptible populations)
+        
+        Format: DATA_TYPE|SPECIFIC_VALUE|DATA_SOURCE|CONFIDENCE_LEVEL|POPULATION|NOTES
+        MINIMUM 19 entries, MAXIMUM 33 entries. Include numerical values when available.
+        """),
+    "Environmental/Additional": (
+        """
+        Comprehensive environmental, regulatory, and additional safety information for {cargo}:
+""",
+        """        
+        PROVIDE EXACTLY 19-28 INFORMATION ENTRIES covering:
+        1. ENVIRONMENTAL FATE (biodegradation, persistence, half-life)
+        2. ECOLOGICAL TOXICITY (aquatic, terrestrial, avian effects)
+        3. BIOACCUMULATION POTENTIAL (BCF, BAF values)
+        4. ENVIRONMENTAL MONITORING (detection in air, water, soil)
+        5. CLIMATE CHANGE IMPACTS (ozone depletion, global warming)
+        6. PHYSICAL PROPERTIES (density, viscosity, vapor pressure)
+        7. CHEMICAL PROPERTIES (pH, reactivity, stability)
+        8. FIRE/EXPLOSION HAZARDS (flash point, autoignition, LEL/UEL)
+        9. INCOMPATIBLE MATERIALS (reaction hazards, forbidden mixtures)
+        10. STORAGE REQUIREMENTS (temperature, humidity, container types)
+        11. TRANSPORTATION REGULATIONS (UN classification, packaging)
+        12. WORKPLACE REGULATIONS (OSHA, ACGIH standards)
+        13. INTERNATIONAL REGULATIONS (EU REACH, GHS classification)
+        14. RESTRICTED USE LISTS (banned countries, limited applications)
+        15. SUBSTITUTION ALTERNATIVES (safer chemical options)
+        16. GREEN CHEMISTRY ASPECTS (sustainable production, disposal)
+        17. WASTE MANAGEMENT (treatment, disposal methods)
+        18. EMERGENCY PLANNING (SARA Title III, RMP requirements)
+        19. COMMUNITY RIGHT-TO-KNOW (reporting requirements)
+        20. INDUSTRIAL HYGIENE (monitoring methods, PPE selection)
+        21. RISK MANAGEMENT (process safety, prevention measures)
+        22. TRAINING REQUIREMENTS (worker education, certification)
+        23. MEDICAL SURVEILLANCE (health monitoring programs)
+        24. INCIDENT REPORTING (mandatory reporting systems)
+        25. INSURANCE CONSIDERATIONS (liability, coverage requirements)
+        26. ECONOMIC IMPACTS (production costs, market trends)
+        27. TECHNOLOGY DEVELOPMENTS (detection, treatment innovations)
+        28. RESEARCH GAPS (unknown effects, needed studies)
+        29. PUBLIC HEALTH IMPLICATIONS (community exposure risks)
+        30. INTERNATIONAL COOPERATION (treaties, agreements)
+        
+        Format: CATEGORY|DETAILED_INFORMATION|REGULATORY_STATUS|IMPLEMENTATION_REQUIREMENTS|EFFECTIVENESS_DATA|REFERENCES
+        MINIMUM 19 entries, MAXIMUM 28 entries. Provide specific details and references.
+        """),
+    "Maritime Medical Guidelines": (
+        """
+        You are a maritime medical expert analyzing cargo hazards for {cargo}.
+""",
+        f"""        
+        Available medicines on ship:
+        {SHIP_MEDICINES}
+        
+        PROVIDE EXACTLY 15-25 MARITIME MEDICAL SCENARIOS covering:
+        1. ACUTE INHALATION POISONING (mild, moderate, severe treatment protocols)
+        2. CHEMICAL BURNS (acid, alkali, thermal injury management)
+        3. EYE CONTAMINATION (irrigation, specific antidotes, vision protection)
+        4. SKIN EXPOSURE (decontamination, wound care, systemic absorption)
+        5. ORAL INGESTION (gastric lavage alternatives, activated charcoal, antidotes)
+        6. RESPIRATORY DISTRESS (oxygen therapy, bronchodilators, ventilation)
+        7. CARDIOVASCULAR COLLAPSE (shock management, cardiac support)
+        8. NEUROLOGICAL SYMPTOMS (seizures, coma, altered consciousness)
+        9. ALLERGIC REACTIONS (anaphylaxis, sensitization responses)
+        10. SYSTEMIC TOXICITY (liver, kidney, multi-organ support)
+        11. BURN WOUND MANAGEMENT (cooling, dressing, pain control)
+        12. INFECTION PREVENTION (wound care, antibiotic prophylaxis)
+        13. PAIN MANAGEMENT (analgesics available on ship)
+        14. SHOCK TREATMENT (fluid resuscitation, vasopressors)
+        15. ANTIDOTE ADMINISTRATION (specific reversal agents if available)
+        16. SUPPORTIVE CARE (IV fluids, electrolyte management)
+        17. EVACUATION PROTOCOLS (stabilization for transfer)
+        18. MONITORING REQUIREMENTS (vital signs, laboratory alternatives)
+        19. DRUG INTERACTIONS (maritime medicine compatibility)
+        20. DOSE CALCULATIONS (weight-based, age-adjusted dosing)
+        21. ADMINISTRATION ROUTES (IV, IM, PO, topical preferences)
+        22. CONTRAINDICATIONS (when NOT to use specific medicines)
+        23. EMERGENCY PROCEDURES (when medicines are insufficient)
+        24. PREVENTION MEASURES (post-exposure prophylaxis)
+        25. COMMUNICATION PROTOCOLS (medical advice via radio)
+        
+        Format: MEDICAL_SCENARIO|SPECIFIC_SHIP_MEDICINES|DOSAGE_ROUTE|MONITORING|CONTRAINDICATIONS|PROGNOSIS
+        MINIMUM 15 entries, MAXIMUM 25 entries.
+        
+        CRITICAL: For each scenario, you MUST:
+        - Use ONLY medicines from the ship's inventory listed above
+        - Specify exact medicine names (e.g., "에피네프린 1앰플", "아세트아미노펜 500mg")
+        - Include dosage and administration route
+        - Consider maritime environment limitations
+        - Provide realistic treatment protocols using available resources
+        """),
+}
+
+def build_stage_prompt(stage_key, cargo):
+    """머리말과 고정 지시문을 합친 단일 프롬프트"""
+    header, instructions = STAGE_PROMPTS[stage_key]
+    return header.format(cargo=cargo) + instructions
 
-외용약:
-- 화농성질환용: 테라마이신연고, 황산겐타마이신연고
-- 안과용약: 뷰렌점안액, 테라코트릴눈/귀약
-- 진통진양제: 훼너간크림, 맥살겔연고, 카라민로숀
-- 소독제: 베타딘액, 포비돈액, 과산화수소, 소독용알콜
-- 창상보호제: 화상가아제
-"""
+# 묶음 요청: 화물 목록과 화물별 구분 줄 안내 (항목 수 규칙은 화물마다 적용)
+PACKED_CARGO_LIST = """
+        Cargos:
+{cargo_lines}
+        Answer EVERY cargo above separately with its own complete set of entries (the entry counts apply to EACH cargo).
+        Start each cargo's entries with a line "### CARGO <number>" and end them with a line "### END CARGO <number>".
+        """
+
+def build_packed_prompt(stage_key, cargos, split=False):
+    """여러 화물을 한 번에 요청하는 (프롬프트, 고정 지시문) - split이 아니면 고정 지시문은 None"""
+    header, instructions = STAGE_PROMPTS[stage_key]
+    header = header.format(cargo="EACH of the cargos listed below")
+    cargo_lines = "\n".join(f"        CARGO {i}: {cargo}" for i, cargo in enumerate(cargos, 1))
+    cargo_list = PACKED_CARGO_LIST.format(cargo_lines=cargo_lines)
+    if split:
+        return header + cargo_list, instructions
+    return header + instructions + cargo_list, None
+
+# 단계 이름 → 결과 Stage 값
+STAGE_KEYS = {stage_name: stage_key for stage_name, _, stage_key in STAGES}
+
+# 단계별 응답 필드 (각 프롬프트의 Format 줄과 동일)
+STAGE_FIELDS = {
+    "Risk Analysis": ["RISK_TYPE", "DETAILED_DESCRIPTION", "SEVERITY_LEVEL", "ONSET_TIME", "DURATION", "MECHANISM"],
+    "Emergency Procedures": ["SCENARIO", "IMMEDIATE_ACTION", "MEDICAL_TREATMENT", "MONITORING_REQUIREMENTS",
+                             "PROGNOSIS", "FOLLOW_UP"],
+    "Statistical Data": ["DATA_TYPE", "SPECIFIC_VALUE", "DATA_SOURCE", "CONFIDENCE_LEVEL", "POPULATION", "NOTES"],
+    "Environmental/Additional": ["CATEGORY", "DETAILED_INFORMATION", "REGULATORY_STATUS",
+                                 "IMPLEMENTATION_REQUIREMENTS", "EFFECTIVENESS_DATA", "REFERENCES"],
+    "Maritime Medical Guidelines": ["MEDICAL_SCENARIO", "SPECIFIC_SHIP_MEDICINES", "DOSAGE_ROUTE", "MONITORING",
+                                    "CONTRAINDICATIONS", "PROGNOSIS"],
+}
+
+def structured_generation_config(stage_key):
+    """구조화 출력 모드 generation_config (단계별 JSON 응답 스키마)"""
+    fields = STAGE_FIELDS[stage_key]
+    return {
+        'response_mime_type': 'application/json',
+        'response_schema': {
+            'type': 'array',
+            'items': {
+                'type': 'object',
+                'properties': {field: {'type': 'string'} for field in fields},
+                'required': fields,
+            },
+        },
+    }
+
+def structured_output_instruction(stage_key):
+    """구조화 출력 모드에서 프롬프트 끝에 붙이는 안내 (Format 줄 대신 JSON으로 응답)"""
+    return (f"\n        Respond ONLY with a JSON array. Each entry is an object with the string keys "
+            f"{', '.join(STAGE_FIELDS[stage_key])} (the Format fields above).\n")
+
+def structured_to_pipe_text(text, fields):
+    """JSON 응답을 검증해 파이프 구분 텍스트로 변환 (스키마 불일치 시 None)
+    
+    변환된 줄은 parse_stage_data가 그대로 읽을 수 있도록 값 안의 '|'와 줄바꿈을 치환한다.
+    """
+    try:
+        entries = json_loads(text)
+    except ValueError:
+        return None
+    if isinstance(entries, dict) and len(entries) == 1:
+        # {"entries": [...]}처럼 한 번 감싼 응답 허용
+        entries = next(iter(entries.values()))
+    if not isinstance(entries, list) or not entries:
+        return None
+    
+    lines = []
+    for entry in entries:
+        if not isinstance(entry, dict):
+            return None
+        values = []
+        for field in fields:
+            value = entry.get(field)
+            if value is None or isinstance(value, (dict, list)):
+                return None
+            values.append(str(value).replace('|', '/').replace('\n', ' ').strip())
+        lines.append('|'.join(values))
+    return '\n'.join(lines)
+
+# 단계별 요청 항목 수 (최소, 최대) - 각 프롬프트의 MINIMUM/MAXIMUM 줄과 동일
+STAGE_ENTRY_LIMITS = {
+    "Risk Analysis": (28, 47),
+    "Emergency Procedures": (24, 38),
+    "Statistical Data": (19, 33),
+    "Environmental/Additional": (19, 28),
+    "Maritime Medical Guidelines": (15, 25),
+}
+
+class PackSizer:
+    """단계별 묶음 크기 결정 - 화물당 출력 토큰 추정치를 출력 토큰 한도에 맞춤
+    
+    추정치는 처음에 최대 항목 수 × row_tokens로 시작해 실제 응답 크기로 갱신하고(지수 이동 평균),
+    출력이 잘린 묶음이 나오면 해당 단계의 최대 묶음 크기를 절반으로 줄인다.
+    headroom은 출력 한도 중 응답 본문에 쓸 비율 (나머지는 thinking 토큰 등 여유분).
+    """
+    def __init__(self, max_pack=8, max_output_tokens=65536, headroom=0.5, row_tokens=100):
+        self.max_pack = max(1, int(max_pack))
+        self.max_output_tokens = max_output_tokens
+        self.headroom = headroom
+        self.row_tokens = row_tokens
+        self.lock = threading.Lock()
+        self.estimates = {}  # Stage → 화물당 출력 토큰
+        self.limits = {}  # Stage → 잘림 이후 최대 묶음 크기
+    
+    def pack_size(self, stage_key):
+        with self.lock:
+            per_cargo = self.estimates.get(stage_key) or STAGE_ENTRY_LIMITS[stage_key][1] * self.row_tokens
+            fit = int(self.max_output_tokens * self.headroom // max(per_cargo, 1))
+            return max(1, min(self.max_pack, self.limits.get(stage_key, self.max_pack), fit))
+    
+    def record(self, stage_key, pack_size, output_tokens, answered, truncated):
+        """묶음 응답 결과 반영 (answered: 조각을 받은 화물 수, truncated: 마지막 조각이 잘림)"""
+        with self.lock:
+            if answered:
+                per_cargo = output_tokens / answered
+                previous = self.estimates.get(stage_key)
+                self.estimates[stage_key] = per_cargo if previous is None else previous * 0.7 + per_cargo * 0.3
+            if truncated and pack_size > 1:
+                self.limits[stage_key] = max(1, min(self.limits.get(stage_key, pack_size), pack_size // 2))
+
+class WorkQueue:
+    """(작업 단위, 단계) 작업 우선순위 큐 - 워커별 힙 + 작업 훔치기
+    
+    작업은 affinity 키(Guide_No)로 워커 하나에 배정해 같은 가이드의 공유 단계/묶음 요청이
+    한 워커에서 이어지게 한다 (가이드 단계 생성을 다른 워커가 기다리며 멈추지 않음).
+    자기 힙이 빈 워커는 가장 많이 밀린 워커의 힙에서 우선순위가 가장 높은 작업을 가져온다.
+    """
+    def __init__(self, workers):
+        self.heaps = [[] for _ in range(max(1, int(workers)))]
+        self.condition = threading.Condition()
+        self.sequence = 0  # 같은 우선순위는 넣은 순서대로
+        self.closed = False
+        self.steals = 0
+    
+    def put(self, priority, affinity, task):
+        with self.condition:
+            worker = int.from_bytes(hashlib.sha256(str(affinity).encode('utf-8')).digest()[:4], 'big') % len(self.heaps)
+            heapq.heappush(self.heaps[worker], (priority, self.sequence, task))
+            self.sequence += 1
+            self.condition.notify_all()
+    
+    def get(self, worker):
+        """worker의 다음 작업 (없으면 훔침) - 큐가 닫히고 비면 None"""
+        with self.condition:
+            while True:
+                heap = self.heaps[worker]
+                if not heap:
+                    heap = max(self.heaps, key=len)
+                    if heap:
+                        self.steals += 1
+                if heap:
+                    return heapq.heappop(heap)[2]
+                if self.closed:
+                    return None
+                self.condition.wait()
+    
+    def pending(self):
+        """아직 워커가 가져가지 않은 작업 수"""
+        with self.condition:
+            return sum(len(heap) for heap in self.heaps)
+    
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+# 단계별 생성 범위 정책 (--guide-shared 사용 시)
+# 'material': 작업 단위(물질)마다 생성, 'guide': Guide_No마다 한 번 생성해 같은 가이드 화물에 재사용
+DEFAULT_STAGE_POLICY = {
+    "Risk Analysis": "material",
+    "Emergency Procedures": "material",
+    "Statistical Data": "material",
+    "Environmental/Additional": "material",
+    "Maritime Medical Guidelines": "guide",
+}
+
+def guide_subject(guide_no):
+    """가이드 공유 단계에서 화물명 대신 프롬프트에 넣을 대상 문자열"""
+    return f"hazardous materials covered by ERG Guide {guide_no}"
+
+# ERG 가이드별 위험 등급 (낮을수록 먼저 처리, --priority hazard)
+GUIDE_HAZARD_RANKS = [
+    ((112, 113, 114), 0),  # 폭발물
+    ((117, 119, 123, 124, 125), 1),  # 흡입 독성 가스
+    ((158, 161, 162, 163, 164, 165, 166), 2),  # 감염성 / 방사성 물질
+    ((131, 134, 151, 152, 153, 154, 155, 156, 157), 3),  # 독성 / 부식성 물질
+    ((111, 115, 116, 118, 122) + tuple(range(135, 151)), 4),  # 인화성 가스, 자연발화·금수성, 산화제, 유기과산화물
+    (tuple(range(126, 134)), 5),  # 인화성 액체 / 고체
+]
+DEFAULT_HAZARD_RANK = 6  # 불활성 가스, 저위험 물질, 가이드 없음
+
+# --priority 기준: hazard(가이드 위험 등급), partial(이어서 할 단계가 있는 화물), file(화물 리스트 순서)
+PRIORITY_KEYS = ("hazard", "partial", "file")
+
+def guide_hazard_rank(guide_no):
+    """Guide_No → 위험 등급 (GUIDE_HAZARD_RANKS)"""
+    try:
+        guide = int(str(guide_no).strip())
+    except ValueError:
+        return DEFAULT_HAZARD_RANK
+    for guides, rank in GUIDE_HAZARD_RANKS:
+        if guide in guides:
+            return rank
+    return DEFAULT_HAZARD_RANK
+
+def parse_priority(value):
+    """'partial,hazard' → ('partial', 'hazard') - 앞에 둔 기준을 먼저 비교"""
+    keys = tuple(key.strip() for key in value.split(',') if key.strip())
+    unknown = [key for key in keys if key not in PRIORITY_KEYS]
+    if unknown:
+        raise ValueError(f"알 수 없는 우선순위 기준: {', '.join(unknown)} (가능: {', '.join(PRIORITY_KEYS)})")
+    return keys
+
+# 선박 의약품 비치 기준 (medi.md 별표를 항목별로 정리한 medi_inventory.json)
+DEFAULT_MEDICINE_PATH = BASE_DIR / 'medi_inventory.json'
+MEDICINE_STAGE = "Maritime Medical Guidelines"  # 의약품 열(SPECIFIC_SHIP_MEDICINES)을 검사할 단계
+
+# 별칭을 만들 때 떼는 제형/염 표기
+MEDICINE_FORM_SUFFIX = re.compile(r'(?:외용연고|연질캅셀|당의정|내복액|현탁액|점안액|주사액|설하정|'
+                                  r'注|정|캅셀|캡슐|액|연고|크림|로숀|세립|좌약|트로키)$')
+MEDICINE_SALT_PREFIX = re.compile(r'^(?:염산|황산|초산|멸균|주사용|소독용)')
+# 이름 비교 전에 떼는 농도 표기 ("5% 포도당 링겔", "0.9% 생리식염수")
+MEDICINE_CONCENTRATION = re.compile(r'\d+(?:\.\d+)?\s*%')
+# 같은 약을 달리 적는 외래어 표기 → 한 가지로 통일 (예전 표기 → 요즘 표기)
+MEDICINE_SPELLINGS = (('링겔', '링거'), ('링게르', '링거'), ('싸이', '사이'), ('메칠', '메틸'), ('에칠', '에틸'))
+# 성분이 이보다 많은 복합제는 상품명으로만 알아봄 (감초, 계피 같은 생약 이름이 일반 단어와 겹치지 않게)
+MEDICINE_MAX_GENERICS = 2
+SHIP_MEDICINE_LINE = re.compile(r'^- [^:]+:\s*(.+)$', re.MULTILINE)
+
+def load_medicine_inventory(path=DEFAULT_MEDICINE_PATH):
+    """비치 기준 파일 → 비치 의약품 목록
+    
+    [{'section': '주사약', 'category': '항생제', 'generic': [...], 'brands': [...], 'aliases': ['chloramphenicol'],
+      'international': '2', 'domestic': '1', 'unit': '10바이알', 'minimal': False}, ...]
+    aliases는 모델이 성분명을 영어로 쓸 때 알아볼 이름, minimal은 수량 앞 ⋆ 표시(최소 비치 단위) 여부다.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def medicine_name_key(text):
+    """이름 비교용 키 (농도 표기, 공백, 가운뎃점 제거 + casefold + 외래어 표기 통일)"""
+    key = re.sub(r'[\s•·]+', '', MEDICINE_CONCENTRATION.sub('', text)).casefold()
+    for old, new in MEDICINE_SPELLINGS:
+        key = key.replace(old, new)
+    return key
+
+def medicine_aliases(name):
+    """이름 하나로 알아볼 키 목록: 원래 이름, 괄호 제거, 제형 접미사 제거, 염 접두사 제거"""
+    base = medicine_name_key(re.sub(r'\([^)]*\)', '', name))
+    keys = {medicine_name_key(name), base}
+    stem = base
+    for _ in range(2):  # "테라마이신외용연고", "로페린캅셀(정)" 등
+        stem = MEDICINE_FORM_SUFFIX.sub('', stem)
+        keys.add(stem)
+    keys.add(MEDICINE_SALT_PREFIX.sub('', stem))
+    return {key for key in keys if len(key) >= 2 and not MEDICINE_FORM_SUFFIX.fullmatch(key)}
+
+def ship_medicine_names():
+    """프롬프트에 넣는 SHIP_MEDICINES 목록의 이름들"""
+    return [name.strip() for line in SHIP_MEDICINE_LINE.findall(SHIP_MEDICINES)
+            for name in line.split(',') if name.strip()]
+
+# 의약품 열 항목 구분: 괄호 밖의 , ; + 、 줄바꿈, 및·또는·and·or
+MEDICINE_ITEM_SEPARATOR = re.compile(r'[,;+、\n]|\s(?:및|또는|혹은|and|or)\s', re.IGNORECASE)
+# 이름을 뺀 나머지가 용량/투여 표기뿐이면 이름 없는 항목으로 보지 않음
+MEDICINE_DOSE = re.compile(r'\([^)]*\)|[\d.,~\-]+\s*(?:mg|mcg|μg|g|ml|l|iu|cc|%|앰플|바이알|정|캅셀|캡슐|매|포|회|일|시간|분)?'
+                           r'(?:\s*/\s*(?:min|분|hr|h|시간|일|kg))?', re.IGNORECASE)
+# 약이 아닌 처치/표기 (산소, 세척용 물, "해당 없음" 등)는 목록 밖 의약품으로 보지 않음
+MEDICINE_NON_DRUG = re.compile(r'산소|oxygen|물|water|세척|투여|적용|필요시|해당|없음|불필요|none|n/?a|의료상담|무선', re.IGNORECASE)
+
+class MedicineMatcher:
+    """선박 비치 의약품 이름 다중 패턴 매처 (Aho-Corasick)
+    
+    모든 이름 키를 오토마톤 하나로 만들어 두고, 행의 의약품 열을 항목별로 나눈 뒤
+    항목들을 이어 붙인 텍스트를 한 번만 훑어 어느 항목에 비치 의약품 이름이 들어 있는지 찾는다.
+    """
+    def __init__(self, names, aliases=()):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [()]  # 상태별로 끝나는 키 길이들
+        self.names = {}  # 키 → 원래 이름
+        for name in names:
+            for key in medicine_aliases(name):
+                self.names.setdefault(key, name)
+                self._add(key)
+        for alias, name in aliases:
+            key = medicine_name_key(alias)
+            self.names.setdefault(key, name)
+            self._add(key)
+        self._build()
+    
+    @classmethod
+    def from_inventory(cls, inventory, extra_names=()):
+        names, aliases = list(extra_names), []
+        for entry in inventory:
+            names.extend(entry['brands'])
+            if len(entry['generic']) <= MEDICINE_MAX_GENERICS:
+                names.extend(entry['generic'])
+            name = (entry['generic'] + entry['brands'])[0]
+            aliases.extend((alias, name) for alias in entry['aliases'])
+        return cls(names, aliases)
+    
+    def _add(self, key):
+        state = 0
+        for char in key:
+            nxt = self.goto[state].get(char)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[state][char] = nxt
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append(())
+            state = nxt
+        self.output[state] += (len(key),)
+    
+    def _build(self):
+        queue = collections.deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, nxt in self.goto[state].items():
+                queue.append(nxt)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[nxt] = self.goto[fallback].get(char, 0) if state else 0
+                self.output[nxt] += self.output[self.fail[nxt]]
+    
+    def find(self, text):
+        """text 안에서 찾은 이름 키 [(시작, 끝), ...]"""
+        found = []
+        state = 0
+        goto, fail, output = self.goto, self.fail, self.output
+        for i, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for length in output[state]:
+                found.append((i + 1 - length, i + 1))
+        return found
+    
+    def unlisted(self, cell):
+        """의약품 열 하나 → 비치 의약품 이름이 없는 항목 목록 (빈 목록이면 정상)"""
+        masked = re.sub(r'\([^()]*\)', lambda m: ' ' * len(m.group()), cell)
+        items, start = [], 0
+        for separator in MEDICINE_ITEM_SEPARATOR.finditer(masked):
+            items.append(cell[start:separator.start()])
+            start = separator.end()
+        items.append(cell[start:])
+        items = [item.strip() for item in items if item.strip()]
+        keys = [medicine_name_key(item) for item in items]
+        # 항목 키를 \0으로 이어 한 번만 훑음 - 키에 \0이 없으므로 매치가 항목 경계를 넘지 않음
+        bounds, offset = [], 0
+        for key in keys:
+            offset += len(key) + 1
+            bounds.append(offset)
+        matched = {bisect.bisect_right(bounds, begin) for begin, _ in self.find("\0".join(keys))}
+        return [item for index, item in enumerate(items)
+                if index not in matched and not self._no_medicine(item)]
+    
+    @staticmethod
+    def _no_medicine(item):
+        rest = MEDICINE_NON_DRUG.sub('', medicine_name_key(MEDICINE_DOSE.sub('', item)))
+        return len(re.sub(r'\W', '', rest)) <= 1  # 남은 조사 한 글자("물로 세척")까지는 허용
+    
+    def row_problem(self, parts):
+        """파이프 분할 행 → 비치 목록 밖 의약품 항목 목록 (SPECIFIC_SHIP_MEDICINES 열 기준)"""
+        if len(parts) < 2:
+            return []
+        cell = parts[1].strip()
+        if cell == STAGE_FIELDS[MEDICINE_STAGE][1]:
+            return []  # 머리글 행
+        return self.unlisted(cell)
+
+def unlisted_medicine_rows(stage_data, matcher):
+    """응답 텍스트에서 비치 목록 밖 의약품이 들어간 행 수"""
+    return sum(1 for parts in split_pipe_lines(stage_data) if matcher.row_problem(parts))
+
+MEDICINE_UNLISTED_NOTE = "비치 목록 밖"
+
+def flag_unlisted_medicine_rows(stage_data, matcher):
+    """비치 목록 밖 의약품이 들어간 행의 의약품 열 끝에 "(비치 목록 밖: 항목, ...)" 표시를 붙인 텍스트
+    
+    행은 빼지 않고 그대로 두어 사람이 확인할 수 있게 한다 (표시를 붙여도 검사에는 계속 걸려 --repair 대상으로 남음).
+    """
+    lines = []
+    for line in stage_data.split('\n'):
+        stripped = line.strip()
+        if len(stripped) > 20 and stripped.count('|') >= 2:
+            parts = stripped.split('|', 5)
+            unlisted = matcher.row_problem(parts)
+            if unlisted and MEDICINE_UNLISTED_NOTE not in parts[1]:
+                parts[1] = f"{parts[1].strip()} ({MEDICINE_UNLISTED_NOTE}: {', '.join(unlisted)})"
+                line = '|'.join(parts)
+        lines.append(line)
+    return "\n".join(lines)
+
+def build_medicine_matcher(path=DEFAULT_MEDICINE_PATH):
+    """비치 기준 파일 목록 + SHIP_MEDICINES 이름으로 매처 생성"""
+    return MedicineMatcher.from_inventory(load_medicine_inventory(path), ship_medicine_names())
+
+FAILURE_PREFIXES = ("API 오류", "응답 형식 오류")
+
+def is_failed_stage_data(stage_data):
+    """API 오류 / 응답 형식 오류로 얻은 단계 데이터인지 확인"""
+    return not stage_data or stage_data.startswith(FAILURE_PREFIXES)
+
+# 다시 요청할 때까지 완료로 기록하지 않는 단계 결과 문제 ('short'는 --repair에서만 다시 요청)
+FAILED_STAGE_PROBLEMS = ('empty', 'error', 'fallback')
+
+def stage_rows_problem(stage_key, rows, fallback_rows, medicine_matcher=None):
+    """저장된 단계 결과 행의 문제 → 'empty' / 'error' / 'fallback' / 'medicine' / 'short' / None(정상)
+    
+    rows, fallback_rows: [[Category, Description, Detail1, Detail2, Detail3], ...]
+    'medicine'은 medicine_matcher가 있을 때 선박 의약품 단계에 비치 목록 밖 의약품 행이 있는 경우,
+    'short'는 프롬프트가 요구한 최소 항목 수(STAGE_ENTRY_LIMITS)보다 적은 경우다.
+    """
+    if not rows:
+        return 'empty'
+    if any(row[1].startswith(FAILURE_PREFIXES) or row[0].startswith(FAILURE_PREFIXES) for row in rows):
+        return 'error'
+    if rows == fallback_rows:
+        return 'fallback'
+    if medicine_matcher is not None and stage_key == MEDICINE_STAGE and any(
+            medicine_matcher.row_problem(row) for row in rows):
+        return 'medicine'
+    if stage_key in STAGE_ENTRY_LIMITS and len(rows) < STAGE_ENTRY_LIMITS[stage_key][0]:
+        return 'short'
+    return None
+
+def stage_prompt_fingerprints():
+    """단계별 프롬프트 템플릿 지문 {Stage: 16자리 hex}
+    
+    머리말 + 고정 지시문 원문 기준이라 선박 의약품 목록(SHIP_MEDICINES)이 바뀌면
+    그 목록을 넣은 선박 의약품 가이드라인 단계의 지문도 바뀐다.
+    """
+    return {stage_key: hashlib.sha256("\0".join(STAGE_PROMPTS[stage_key]).encode('utf-8')).hexdigest()[:16]
+            for _, _, stage_key in STAGES}
+
+def cargo_rows_fingerprint(rows):
+    """작업 단위 입력 행(ID_No, Guide_No, Name_of_Material) 지문 - 앞뒤 공백 차이는 무시"""
+    key = "\n".join(sorted("\0".join(row[field].strip() for field in ('ID_No', 'Guide_No', 'Name_of_Material'))
+                           for row in rows))
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]
+
+def stage_input_fingerprint(rows_fingerprint, prompt_fingerprint):
+    """(화물, 단계) 입력 지문 - 입력 행이나 단계 프롬프트 중 하나라도 바뀌면 달라짐"""
+    return hashlib.sha256(f"{rows_fingerprint}\0{prompt_fingerprint}".encode('utf-8')).hexdigest()[:16]
 
 class AutoRestartAnalyzer:
-    def __init__(self):
+    def __init__(self, max_workers=1, rate_limiter=None, max_rate_limit_retries=8, dedupe=True,
+                 stage_policy=None, response_cache=None, ledger=None, writer_options=None,
+                 call_timeout=120.0, max_timeout_retries=3, model=None, cargo_list_path='cargolist.csv',
+                 structured_output=False, max_schema_retries=2, prefix_cache=False, pack_sizer=None,
+                 shard=None, metrics=None, plan_only=False, stream=False, stall_timeout=30.0, max_stream_retries=2,
+                 priority=("file",), batch_size=10, batch_seconds=60.0, medicine_matcher=None, max_medicine_retries=2):
+        self.medicine_matcher = medicine_matcher  # None이면 선박 의약품 단계 비치 목록 검사 안 함
+        self.max_medicine_retries = max_medicine_retries  # 비치 목록 밖 의약품이 나온 응답 재요청 횟수
+        self.priority = tuple(priority)  # 작업 단위 처리 순서 기준 (PRIORITY_KEYS)
+        self.batch_size = max(1, int(batch_size))  # 배치를 확정할 작업 단위 수
+        self.batch_seconds = batch_seconds  # 배치를 확정할 시간 (초, 0/None이면 크기만)
+        self.stream = stream  # True면 응답을 청크로 받으며 완성된 줄부터 파싱 (구조화 출력 모드 제외)
+        self.stall_timeout = stall_timeout  # 스트리밍 중 청크 사이 최대 대기 (초)
+        self.max_stream_retries = max_stream_retries  # 형식 위반으로 중단한 스트림 재요청 횟수
+        self.plan_only = plan_only  # True면 실행 계획만 출력하고 모델은 호출하지 않음
+        self.metrics = metrics or MetricsRecorder()  # 경로 없이 만들면 실행 종료 요약용 집계만
+        self.shard = shard  # (i, N)이면 화물 리스트 중 i번째 샤드만 처리
+        self.structured_output = structured_output
+        self.prefix_cache = prefix_cache  # 고정 지시문을 system instruction으로 분리해 전송
+        self.prompt_stats = {'calls': 0, 'input_tokens': 0, 'static_tokens': 0, 'cached_tokens': 0}
+        self.prompt_stats_lock = threading.Lock()
+        self.pack_sizer = pack_sizer  # None이면 화물마다 단독 요청
+        self.packed_stage_data = {}  # (작업 단위 라벨, Stage) → 묶음 응답에서 잘라낸 조각
+        self.pack_stats = {'requests': 0, 'cargos': 0, 'missing': 0}
+        self.pack_lock = threading.Lock()
+        self.max_schema_retries = max_schema_retries
+        self.model = model or GeminiProvider()
+        self.cargo_list_path = cargo_list_path
+        # 호출 풀은 워커 수보다 여유 있게 - 멈춘 호출 몇 개로는 전체가 막히지 않음
+        self.supervisor = CallSupervisor(call_timeout=call_timeout, pool_size=max(1, int(max_workers)) * 2)
+        self.max_timeout_retries = max_timeout_retries
+        self.stall_restarts = 0  # 활동 없이 연속으로 호출 풀을 재시작한 횟수
+        self.response_cache = response_cache  # None이면 캐시 사용 안 함
+        self.refresh_cache = False  # True면 캐시를 읽지 않고 다시 요청 (새 응답은 저장)
+        self.ledger = ledger
+        self.writer_options = writer_options or {}
+        self.writer = None
+        self.written_stages = set()  # 이전 실행에서 이미 출력 파일에 확정된 (작업 단위 라벨, Stage)
+        self.max_workers = max(1, int(max_workers))  # 1이면 기존 직렬 모드
+        self.dedupe = dedupe
+        self.stage_policy = stage_policy or {}  # 비어 있으면 모든 단계를 물질별로 생성
+        self.cargo_guides = {}  # 작업 단위 라벨 → Guide_No
+        self.unit_members = {}  # 작업 단위 라벨 → 단위에 속한 화물 목록
+        self.resumed_stages = {}  # (작업 단위 라벨, Stage) → 이전 실행에서 저장된 결과 행
+        self.failed_stages = set()  # 이번 실행에서 오류 / 대체 데이터 / 빈 결과로 끝난 (작업 단위 라벨, Stage)
+        self.fallback_rows = None  # 단계별 대체 데이터 행 (stage_problem 비교용)
+        self.stage_fingerprints = {}  # (작업 단위 라벨, Stage) → 입력 행 + 단계 프롬프트 지문
+        self.guide_stage_cache = {}  # (Guide_No, Stage) → 원본 응답
+        self.guide_stage_locks = {}
+        self.guide_cache_lock = threading.Lock()
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.max_rate_limit_retries = max_rate_limit_retries
+        self.executor = None
         self.last_activity_time = time.time()
         self.activity_lock = threading.Lock()
         self.should_stop = False
@@ -73,7 +2261,11 @@ class AutoRestartAnalyzer:
             self.last_activity_time = time.time()
     
     def watchdog(self):
-        """5분 이상 활동 없으면 프로세스 중단"""
+        """5분 이상 활동 없으면 호출 풀을 프로세스 안에서 재시작
+        
+        재시작 후에도 계속 멈춰 있으면(3회 연속) 기존처럼 프로세스를 중단해
+        외부에서 다시 실행하게 한다.
+        """
         while not self.should_stop:
             time.sleep(30)  # 30초마다 체크
             
@@ -82,117 +2274,351 @@ class AutoRestartAnalyzer:
             
             if inactive_time > 300:  # 5분 = 300초
                 print(f"\n⚠️  5분 이상 비활성 감지 (비활성 시간: {inactive_time/60:.1f}분)")
+                self.stall_restarts += 1
+                if self.stall_restarts < 3:
+                    self.supervisor.restart_pool("워치독 비활성 감지")
+                    self.update_activity()
+                    continue
+                
                 print("🔄 프로세스 재시작을 위해 현재 작업을 중단합니다...")
-                self.should_stop = True
-                os.kill(os.getpid(), signal.SIGTERM)
+                self.request_stop()
                 break
     
+    def request_stop(self):
+        """정상 종료 요청 - 새 작업을 배정하지 않고, 진행 중인 단계가 끝나면 분석을 멈춤
+        
+        작업 스레드를 모두 기다린 뒤에 호출 풀을 닫으므로 종료 때문에 실패한 호출이 오류 결과로 기록되지 않는다.
+        """
+        self.should_stop = True
+    
     def start_watchdog(self):
         """워치독 시작"""
         self.watchdog_thread = threading.Thread(target=self.watchdog, daemon=True)
         self.watchdog_thread.start()
-        print("🐕 워치독 시작: 5분 이상 비활성 시 자동 재시작")
+        print("🐕 워치독 시작: 5분 이상 비활성 시 호출 풀 재시작")
     
-    def load_cargo_list(self):
-        """CSV 파일에서 화물 리스트 로드"""
+    def load_cargo_rows(self):
+        """CSV 파일에서 화물 행 로드 (ID_No, Guide_No, Name_of_Material, Cargo)"""
         try:
-            print("📄 cargolist.csv에서 화물 리스트 로드 중...")
-            with open('cargolist.csv', 'r', encoding='utf-8') as f:
+            print(f"📄 {self.cargo_list_path}에서 화물 리스트 로드 중...")
+            with open(self.cargo_list_path, 'r', encoding='utf-8') as f:
                 reader = csv.DictReader(f)
-                cargos = []
+                rows = []
                 for row in reader:
                     # ID_No, Guide_No, Name_of_Material 컬럼 사용
-                    cargo_id = row['ID_No']
-                    guide_no = row['Guide_No']
-                    name = row['Name_of_Material']
-                    
-                    # ID가 없거나 "— —"인 경우 처리
-                    if cargo_id and cargo_id != "— —":
-                        if guide_no:
-                            cargo_entry = f"{cargo_id}: {name} (Guide: {guide_no})"
-                        else:
-                            cargo_entry = f"{cargo_id}: {name}"
-                    else:
-                        # ID가 없는 경우 이름과 가이드만 사용
-                        if guide_no:
-                            cargo_entry = f"{name} (Guide: {guide_no})"
-                        else:
-                            cargo_entry = name
-                    cargos.append(cargo_entry)
-                print(f"📋 {len(cargos)}개 화물 로드됨")
-                return cargos
+                    rows.append({
+                        'ID_No': row['ID_No'],
+                        'Guide_No': row['Guide_No'],
+                        'Name_of_Material': row['Name_of_Material'],
+                        'Cargo': format_cargo_entry(row['ID_No'], row['Guide_No'], row['Name_of_Material']),
+                    })
+                print(f"📋 {len(rows)}개 화물 로드됨")
+                return rows
         except FileNotFoundError:
-            print("❌ cargolist.csv 파일을 찾을 수 없습니다.")
+            print(f"❌ {self.cargo_list_path} 파일을 찾을 수 없습니다.")
             return []
         except Exception as e:
             print(f"❌ CSV 로드 오류: {e}")
             return []
     
-    def find_last_batch_number(self):
-        """마지막 배치 번호 찾기"""
-        timestamp_pattern = datetime.now().strftime("%Y%m%d")
-        batch_files = list(Path('.').glob(f'maximum_data_batch_*_{timestamp_pattern}_*.csv'))
+    def load_cargo_list(self):
+        """CSV 파일에서 화물 리스트 로드"""
+        return [row['Cargo'] for row in self.load_cargo_rows()]
+    
+    def plan_work_units(self, rows):
+        """같은 물질명 + Guide_No 행들을 하나의 작업 단위로 묶기
         
-        if not batch_files:
-            return 0
+        모델은 작업 단위마다 한 번만 호출하고, 결과는 단위에 속한 모든 화물(ID_No/행)에 복제한다.
+        dedupe=False이면 화물 문자열마다 하나의 단위를 만든다.
+        """
+        units = {}
+        for row in rows:
+            if self.dedupe:
+                key = (normalize_material_name(row['Name_of_Material']), row['Guide_No'].strip())
+            else:
+                key = row['Cargo']
+            unit = units.get(key)
+            if unit is None:
+                unit = units[key] = {'key': key, 'rows': [], 'members': []}
+            unit['rows'].append(row)
+            if row['Cargo'] not in unit['members']:
+                unit['members'].append(row['Cargo'])
         
-        # 파일명에서 배치 번호 추출
-        batch_numbers = []
-        for file in batch_files:
-            try:
-                # 파일명 형식: maximum_data_batch_X_YYYYMMDD_HHMM.csv
-                parts = file.stem.split('_')
-                batch_num = int(parts[3])  # X 부분
-                batch_numbers.append(batch_num)
-            except (IndexError, ValueError):
+        for unit in units.values():
+            if len(unit['members']) == 1:
+                unit['label'] = unit['members'][0]
                 continue
+            # 여러 ID_No가 묶인 경우 모든 ID를 프롬프트 라벨에 표시
+            first = unit['rows'][0]
+            ids = []
+            for row in unit['rows']:
+                if row['ID_No'] and row['ID_No'] != "— —" and row['ID_No'] not in ids:
+                    ids.append(row['ID_No'])
+            unit['label'] = format_cargo_entry("/".join(ids), first['Guide_No'], first['Name_of_Material'])
         
-        return max(batch_numbers) if batch_numbers else 0
+        for unit in units.values():
+            self.unit_members[unit['label']] = unit['members']
+            guide_no = unit['rows'][0]['Guide_No'].strip()
+            if guide_no:
+                self.cargo_guides[unit['label']] = guide_no
+        
+        return list(units.values())
+    
+    def extract_prompt_stage(self, cargo, stage_name):
+        """단계 프롬프트 생성 후 추출 - 접두사 캐시 모드에서는 고정 지시문을 따로 보냄"""
+        stage_key = STAGE_KEYS[stage_name]
+        if self.prefix_cache:
+            header, instructions = STAGE_PROMPTS[stage_key]
+            return self.extract_stage_data(cargo, stage_name, header.format(cargo=cargo),
+                                           system_instruction=instructions)
+        return self.extract_stage_data(cargo, stage_name, build_stage_prompt(stage_key, cargo))
+    
+    def extract_stage_data(self, cargo, stage_name, prompt, system_instruction=None, pack_size=1):
+        """단계별 데이터 추출 (활동 시간 업데이트 포함) - 요청마다 call 지표 기록"""
+        call = {'rate_limit_retries': 0, 'timeout_retries': 0, 'schema_retries': 0, 'stream_retries': 0,
+                'medicine_retries': 0,
+                'wait_s': 0.0, 'first_row_s': None, 'input_tokens': 0, 'output_tokens': 0, 'cached_tokens': 0,
+                'finish_reason': None}
+        start = time.perf_counter()
+        text, outcome = self.request_stage_data(cargo, stage_name, prompt, system_instruction, call)
+        call['wait_s'] = round(call['wait_s'], 4)
+        self.metrics.record('call', cargo=cargo, stage=STAGE_KEYS.get(stage_name, stage_name), outcome=outcome,
+                            latency_s=round(time.perf_counter() - start, 4), pack_size=pack_size, **call)
+        return text
+    
+    def request_stage_data(self, cargo, stage_name, prompt, system_instruction, call):
+        """캐시 확인 → 모델 호출 → 응답 검증 → (텍스트, 결과 구분: cache/ok/partial/flagged/fallback/error/schema_error)"""
+        self.update_activity()
+        
+        # 구조화 출력 모드: 단계별 JSON 스키마로 요청하고 파이프 구분 텍스트로 변환
+        stage_key = STAGE_KEYS.get(stage_name)
+        generation_config = None
+        if self.structured_output and stage_key in STAGE_FIELDS:
+            if system_instruction is None:
+                prompt = prompt + structured_output_instruction(stage_key)
+            else:
+                system_instruction = system_instruction + structured_output_instruction(stage_key)
+            generation_config = structured_generation_config(stage_key)
+        
+        # 고정 지시문도 캐시 키에 포함 (단일 프롬프트 모드와 키가 겹치지 않게 구분자로 연결)
+        cache_key = prompt if system_instruction is None else f"{system_instruction}\0{prompt}"
+        if self.response_cache and not self.refresh_cache:
+            cached = self.response_cache.get(self.model.model_name, cache_key)
+            if cached is not None:
+                if generation_config is not None:
+                    cached = structured_to_pipe_text(cached, STAGE_FIELDS[stage_key])
+                if cached is not None and self.unlisted_medicine_rows(stage_key, cached):
+                    # 비치 목록 검사 전에 저장된 응답 - 캐시 미스로 보고 다시 요청
+                    print(f"    💊 {stage_name}: 캐시 응답에 비치 목록 밖 의약품 - 다시 요청")
+                elif cached is not None:
+                    print(f"    💾 캐시 응답 사용: {stage_name}")
+                    self.update_activity()
+                    return cached, 'cache'
+        
+        schema_attempt = 0
+        best = None  # (비치 목록 밖 의약품 행 수, 텍스트) - 재요청이 모두 실패했을 때 쓸 응답
+        while True:
+            response, error_text = self.call_model(stage_name, prompt, generation_config, system_instruction, call)
+            if error_text is not None:
+                return error_text, 'error'
+            
+            text, failure = self.response_text(cargo, stage_name, response)
+            if failure is not None:
+                return failure, ('error' if is_failed_stage_data(failure) else 'fallback')
+            if getattr(response, 'partial', False):
+                return text, 'partial'  # 형식 위반 전까지의 행만 사용 (캐시하지 않음)
+            
+            if generation_config is not None:
+                converted = structured_to_pipe_text(text, STAGE_FIELDS[stage_key])
+                if converted is None:
+                    # 스키마에 맞지 않는 응답만 다시 요청
+                    if schema_attempt < self.max_schema_retries:
+                        schema_attempt += 1
+                        call['schema_retries'] = schema_attempt
+                        print(f"    🧩 {stage_name}: JSON 스키마 불일치 - 재요청 ({schema_attempt}/{self.max_schema_retries})")
+                        continue
+                    print(f"    ⚠️ {stage_name}: JSON 스키마 불일치")
+                    return f"응답 형식 오류 - {stage_name} (JSON 스키마 불일치)", 'schema_error'
+            result = text if generation_config is None else converted
+            
+            # 선박 의약품 단계: 비치 목록 밖 의약품이 들어간 응답만 다시 요청 (스트리밍 재요청과 횟수 공유)
+            unlisted = self.unlisted_medicine_rows(stage_key, result)
+            if unlisted:
+                if best is None or unlisted < best[0]:
+                    best = (unlisted, result)
+                if call['medicine_retries'] < self.max_medicine_retries:
+                    call['medicine_retries'] += 1
+                    print(f"    💊 {stage_name}: 비치 목록 밖 의약품 {unlisted}행 - 재요청 "
+                          f"({call['medicine_retries']}/{self.max_medicine_retries})")
+                    continue
+                print(f"    ⚠️ {stage_name}: 비치 목록 밖 의약품 {best[0]}행 - 표시를 붙여 사용")
+                return flag_unlisted_medicine_rows(best[1], self.medicine_matcher), 'flagged'  # 캐시하지 않음
+            
+            # 정상 응답만 캐시 (오류/대체 데이터는 다음 실행에서 다시 호출)
+            if self.response_cache and text:
+                self.response_cache.put(self.model.model_name, cache_key, text)
+            return result, 'ok'
+    
+    def medicine_row_check(self, stage_key):
+        """선박 의약품 단계면 행 검사 함수 (MedicineMatcher.row_problem), 아니면 None"""
+        if self.medicine_matcher is not None and stage_key == MEDICINE_STAGE:
+            return self.medicine_matcher.row_problem
+        return None
+    
+    def unlisted_medicine_rows(self, stage_key, stage_data):
+        """응답 텍스트 중 비치 목록 밖 의약품이 들어간 행 수 (검사 대상 단계가 아니면 0)"""
+        if self.medicine_row_check(stage_key) is None or not stage_data:
+            return 0
+        return unlisted_medicine_rows(stage_data, self.medicine_matcher)
     
-    def load_processed_cargos(self):
-        """이미 처리된 화물들 로드"""
-        timestamp_pattern = datetime.now().strftime("%Y%m%d")
-        batch_files = list(Path('.').glob(f'maximum_data_batch_*_{timestamp_pattern}_*.csv'))
+    def call_model(self, stage_name, prompt, generation_config, system_instruction, call):
+        """모델 호출 (레이트 리밋 백오프, 호출별 타임아웃 재시도) → (응답, 오류 텍스트)
         
-        processed = set()
+        call dict에 재시도 횟수, 속도 제한 대기 시간, 첫 행까지 걸린 시간, 토큰, finish_reason을 채운다.
+        스트리밍 모드에서는 스트림이 멈추면 타임아웃과 같이, 형식을 벗어나면 max_stream_retries까지,
+        비치 목록 밖 의약품 행이 나오면 그 자리에서 끊고 max_medicine_retries까지 재요청한다
+        (마지막 요청은 끊지 않고 끝까지 받아 request_stage_data가 해당 행에 표시를 붙인다).
+        """
+        start = time.perf_counter()
+        stream = self.stream and generation_config is None
+        kwargs = {'request_options': {'timeout': self.supervisor.call_timeout}}
+        if generation_config is not None:
+            kwargs['generation_config'] = generation_config
+        if system_instruction is not None:
+            kwargs['system_instruction'] = system_instruction
         
-        for file in batch_files:
+        # 고정 지시문도 매 요청의 입력 토큰으로 집계됨 (캐시 적중분은 할인 과금)
+        static_tokens = estimate_tokens(system_instruction) if system_instruction else 0
+        estimated_tokens = estimate_tokens(prompt) + static_tokens
+        row_check = self.medicine_row_check(STAGE_KEYS.get(stage_name)) if stream else None
+        attempt = 0
+        timeout_attempt = 0
+        stream_attempt = 0
+        while True:
+            if self.should_stop:
+                # 종료 중에는 새 요청(재시도 포함)을 보내지 않음 - 오류 결과로 기록되지 않게 예외로 알림
+                raise CallShutdown("중단 요청")
             try:
-                df = pd.read_csv(file)
-                if not df.empty and 'Cargo' in df.columns:
-                    processed.update(df['Cargo'].unique())
+                wait_start = time.perf_counter()
+                self.rate_limiter.acquire(estimated_tokens)
+                call['wait_s'] += time.perf_counter() - wait_start
+                print(f"    API 호출: {stage_name}...")
+                if stream:
+                    medicine_check = row_check if call['medicine_retries'] < self.max_medicine_retries else None
+                    response = self.stream_model(prompt, kwargs, call, start, medicine_check)
+                else:
+                    response = self.supervisor.call(self.model.generate_content, prompt, **kwargs)
+                    call['first_row_s'] = round(time.perf_counter() - start, 4)
+                self.update_activity()
+                self.stall_restarts = 0
+                self.rate_limiter.record_success()
+                
+                usage = getattr(response, 'usage_metadata', None)
+                self.rate_limiter.settle(estimated_tokens, getattr(usage, 'total_token_count', 0))
+                self.record_prompt_usage(usage, estimated_tokens, static_tokens)
+                call['input_tokens'] += getattr(usage, 'prompt_token_count', 0) or 0
+                call['output_tokens'] += getattr(usage, 'candidates_token_count', 0) or 0
+                call['cached_tokens'] += getattr(usage, 'cached_content_token_count', 0) or 0
+                candidates = getattr(response, 'candidates', None)
+                if candidates:
+                    call['finish_reason'] = finish_reason_name(getattr(candidates[0], 'finish_reason', None))
+                return response, None
+            except StreamFormatError as e:
+                self.update_activity()
+                call['output_tokens'] += estimate_tokens(e.partial_text)
+                if e.reason == 'medicine':
+                    call['medicine_retries'] += 1
+                    print(f"    💊 {stage_name}: 비치 목록 밖 의약품 - {e.rows}행에서 중단, 재요청 "
+                          f"({call['medicine_retries']}/{self.max_medicine_retries})")
+                    continue
+                if stream_attempt < self.max_stream_retries:
+                    stream_attempt += 1
+                    call['stream_retries'] = stream_attempt
+                    print(f"    ✂️ {stage_name}: {e} - {e.rows}행에서 중단, 재요청 ({stream_attempt}/{self.max_stream_retries})")
+                    continue
+                if e.rows:
+                    print(f"    ⚠️ {stage_name}: {e} - 중단 전 {e.rows}행만 사용")
+                    return StreamedResponse(e.partial_text, partial=True), None
+                print(f"    ⚠️ {stage_name}: {e}")
+                return None, f"응답 형식 오류 - {stage_name} ({e})"
+            except ModelCallTimeout as e:
+                self.update_activity()
+                if timeout_attempt < self.max_timeout_retries:
+                    timeout_attempt += 1
+                    call['timeout_retries'] = timeout_attempt
+                    print(f"    ⏱️ {stage_name}: {e} - 멈춘 요청만 재시도 ({timeout_attempt}/{self.max_timeout_retries})")
+                    continue
+                print(f"    ⚠️ {stage_name} 오류: {e}")
+                return None, f"API 오류: 응답 시간 초과 ({e})"
+            except CallShutdown:
+                raise
             except Exception as e:
-                print(f"  ⚠️ 파일 읽기 오류 {file}: {e}")
-        
-        return processed
+                self.update_activity()
+                if is_rate_limit_error(e) and attempt < self.max_rate_limit_retries:
+                    delay = self.rate_limiter.backoff(attempt)
+                    attempt += 1
+                    call['rate_limit_retries'] = attempt
+                    print(f"    ⏳ {stage_name}: 레이트 리밋 - {delay:.1f}초 후 재시도 ({attempt}/{self.max_rate_limit_retries})")
+                    continue
+                print(f"    ⚠️ {stage_name} 오류: {e}")
+                return None, f"API 오류: {str(e)}"
     
-    def extract_stage_data(self, cargo, stage_name, prompt):
-        """단계별 데이터 추출 (활동 시간 업데이트 포함)"""
-        self.update_activity()
+    def stream_model(self, prompt, kwargs, call, start, row_check=None):
+        """스트리밍 호출 - 청크마다 활동 시간을 갱신하고 완성된 줄을 바로 파싱 → StreamedResponse
         
+        청크 사이가 stall_timeout초를 넘으면 ModelCallTimeout, 형식 위반(row_check에 걸린 행 포함)이면
+        StreamFormatError로 나머지 출력을 기다리지 않고 멈춘다.
+        """
+        call['first_row_s'] = None
+        parser = StreamingStageParser(row_check=row_check)
+        last_chunk = None
+        chunks = self.supervisor.stream(self.model.generate_content, prompt, stall_timeout=self.stall_timeout,
+                                        stream=True, **kwargs)
+        try:
+            for chunk in chunks:
+                self.update_activity()
+                last_chunk = chunk
+                if parser.feed(chunk_text(chunk)) and call['first_row_s'] is None:
+                    call['first_row_s'] = round(time.perf_counter() - start, 4)
+                if parser.violation:
+                    raise StreamFormatError(parser.violation, parser.partial_text(), len(parser.rows))
+        finally:
+            chunks.close()
+        if parser.finish() and call['first_row_s'] is None:
+            call['first_row_s'] = round(time.perf_counter() - start, 4)
+        if parser.violation:
+            raise StreamFormatError(parser.violation, parser.partial_text(), len(parser.rows))
+        return StreamedResponse(parser.text, last_chunk)
+    
+    def record_prompt_usage(self, usage, estimated_tokens, static_tokens):
+        """입력 토큰 / 고정 지시문 토큰 / 백엔드가 보고한 캐시 적중 토큰 집계"""
+        with self.prompt_stats_lock:
+            self.prompt_stats['calls'] += 1
+            self.prompt_stats['input_tokens'] += getattr(usage, 'prompt_token_count', 0) or estimated_tokens
+            self.prompt_stats['static_tokens'] += static_tokens
+            self.prompt_stats['cached_tokens'] += getattr(usage, 'cached_content_token_count', 0) or 0
+    
+    def response_text(self, cargo, stage_name, response):
+        """응답 객체에서 텍스트 추출 → (텍스트, 실패 시 대체/오류 텍스트)"""
         try:
-            print(f"    API 호출: {stage_name}...")
-            response = model.generate_content(prompt)
-            self.update_activity()
-            
             # API 응답 안전 처리
             if hasattr(response, 'text') and response.text:
-                return response.text
+                return response.text, None
             elif hasattr(response, 'candidates') and response.candidates:
                 if response.candidates[0].content.parts:
-                    return response.candidates[0].content.parts[0].text
+                    return response.candidates[0].content.parts[0].text, None
                 else:
                     print(f"    ⚠️ {stage_name}: 응답 내용이 비어있음 (finish_reason: {response.candidates[0].finish_reason})")
                     # 대체 데이터 생성
-                    return self.generate_fallback_data(cargo, stage_name)
+                    return None, self.generate_fallback_data(cargo, stage_name)
             else:
                 print(f"    ⚠️ {stage_name}: 예상치 못한 응답 형식")
-                return f"응답 형식 오류 - {stage_name}"
+                return None, f"응답 형식 오류 - {stage_name}"
                 
         except Exception as e:
             print(f"    ⚠️ {stage_name} 오류: {e}")
             self.update_activity()
-            return f"API 오류: {str(e)}"
+            return None, f"API 오류: {str(e)}"
     
     def generate_fallback_data(self, cargo, stage_name):
         """API 오류 시 대체 데이터 생성"""
@@ -234,292 +2660,562 @@ class AutoRestartAnalyzer:
             ]
         }
         
-        stage_data = fallback_data.get(stage_name, ["GENERAL|Basic safety information|STANDARD|NORMAL|NONE|Consult medical professional"])
-        return "\n".join(stage_data)
-    
-    def extract_maximum_data_stage1(self, cargo):
-        """1단계: 위험성 분석"""
-        prompt = f"""
-        Analyze {cargo} comprehensively for ALL POSSIBLE health risks.
-        
-        PROVIDE EXACTLY 28-47 DETAILED HEALTH RISKS covering:
-        1. ACUTE INHALATION (mild, moderate, severe, lethal concentrations)
-        2. ACUTE DERMAL (splash, vapor, prolonged contact, sensitization)
-        3. ACUTE OCULAR (direct contact, vapor, splash, permanent damage)
-        4. ACUTE ORAL (accidental ingestion, intentional, various doses)
-        5. CHRONIC INHALATION (occupational, environmental, long-term)
-        6. CHRONIC DERMAL (repeated contact, absorption, accumulation)
-        7. SYSTEMIC TOXICITY (liver, kidney, heart, lung, nervous system)
-        8. REPRODUCTIVE EFFECTS (male, female, fertility, hormonal)
-        9. DEVELOPMENTAL EFFECTS (pregnancy, fetal, pediatric, growth)
-        10. CARCINOGENIC EFFECTS (various cancer types, mechanisms)
-        11. RESPIRATORY SENSITIZATION (asthma, allergic reactions)
-        12. SKIN SENSITIZATION (contact dermatitis, allergies)
-        13. IMMUNOTOXICITY (immune suppression, autoimmune)
-        14. NEUROTOXICITY (CNS, PNS, cognitive, motor effects)
-        15. CARDIOVASCULAR EFFECTS (arrhythmia, hypertension, cardiac arrest)
-        16. HEMATOLOGICAL EFFECTS (anemia, bleeding, blood chemistry)
-        17. ENDOCRINE DISRUPTION (thyroid, adrenal, pancreatic)
-        18. GENETIC TOXICITY (mutagenic, DNA damage, chromosomal)
-        19. SPECIAL POPULATIONS (elderly, children, pregnant, diseased)
-        20. ENVIRONMENTAL EXPOSURE (air, water, food contamination)
-        
-        Format: RISK_TYPE|DETAILED_DESCRIPTION|SEVERITY_LEVEL|ONSET_TIME|DURATION|MECHANISM
-        MINIMUM 28 entries, MAXIMUM 47 entries. Be exhaustive and specific.
-        """
-        return self.extract_stage_data(cargo, "위험성 분석", prompt)
-    
-    def extract_maximum_data_stage2(self, cargo):
-        """2단계: 응급처치"""
-        prompt = f"""
-        Comprehensive emergency procedures for {cargo}:
-        
-        PROVIDE EXACTLY 24-38 EMERGENCY SCENARIOS covering:
-        1. MILD INHALATION (low concentration, brief exposure)
-        2. MODERATE INHALATION (significant symptoms, respiratory distress)
-        3. SEVERE INHALATION (life-threatening, pulmonary edema)
-        4. SKIN CONTACT (liquid splash, minimal area)
-        5. EXTENSIVE SKIN CONTACT (large area, prolonged exposure)
-        6. EYE CONTACT (splash, vapor exposure, chemical burns)
-        7. ORAL INGESTION (accidental small amounts)
-        8. LARGE ORAL INGESTION (intentional, life-threatening)
-        9. DERMAL ABSORPTION (chronic exposure through skin)
-        10. COMBINED EXPOSURES (multiple routes simultaneously)
-        11. PEDIATRIC EXPOSURES (children, dose adjustments)
-        12. PREGNANCY EXPOSURES (maternal and fetal considerations)
-        13. ELDERLY EXPOSURES (age-related complications)
-        14. PRE-EXISTING CONDITIONS (asthma, liver disease, etc.)
-        15. OCCUPATIONAL EXPOSURES (workplace accidents)
-        16. MASS CASUALTY INCIDENTS (multiple victims)
-        17. CONFINED SPACE EXPOSURES (enhanced toxicity)
-        18. FIRE/EXPLOSION SCENARIOS (thermal injury + chemical)
-        19. CONTAMINATED CLOTHING/PPE (decontamination procedures)
-        20. TRANSPORTATION ACCIDENTS (spill response)
-        21. HOME EXPOSURES (household accident management)
-        22. DELAYED ONSET TOXICITY (symptoms hours/days later)
-        23. ALLERGIC REACTIONS (sensitization responses)
-        24. CHEMICAL BURNS (acid/base tissue damage)
-        25. SYSTEMIC POISONING (organ failure management)
-        
-        Format: SCENARIO|IMMEDIATE_ACTION|MEDICAL_TREATMENT|MONITORING_REQUIREMENTS|PROGNOSIS|FOLLOW_UP
-        MINIMUM 24 entries, MAXIMUM 38 entries. Include specific protocols.
-        """
-        return self.extract_stage_data(cargo, "응급처치", prompt)
-    
-    def extract_maximum_data_stage3(self, cargo):
-        """3단계: 통계 데이터"""
-        prompt = f"""
-        Comprehensive statistical and epidemiological data for {cargo}:
-        
-        PROVIDE EXACTLY 19-33 DATA POINTS covering:
-        1. ACUTE TOXICITY VALUES (LD50 oral, dermal, inhalation LC50)
-        2. EXPOSURE LIMITS (PEL, TLV-TWA, TLV-STEL, TLV-C, IDLH)
-        3. CARCINOGENICITY DATA (cancer slope factors, unit risk)
-        4. DOSE-RESPONSE RELATIONSHIPS (NOAEL, LOAEL, BMD)
-        5. HUMAN EPIDEMIOLOGY (occupational studies, case reports)
-        6. MORTALITY STATISTICS (death rates, causes of death)
-        7. MORBIDITY DATA (hospitalization rates, ICU admissions)
-        8. RECOVERY STATISTICS (treatment success rates, disabilities)
-        9. EMERGENCY ROOM VISITS (annual cases, severity distribution)
-        10. LONG-TERM HEALTH OUTCOMES (chronic disease rates)
-        11. PEDIATRIC EXPOSURE DATA (children's vulnerability factors)
-        12. PREGNANCY OUTCOMES (birth defects, miscarriage rates)
-        13. OCCUPATIONAL ILLNESS RATES (by industry, job function)
-        14. ENVIRONMENTAL EXPOSURE LEVELS (air, water, soil concentrations)
-        15. BIOMONITORING DATA (blood, urine levels in populations)
-        16. PHARMACOKINETIC PARAMETERS (absorption, distribution, elimination)
-        17. BENCHMARK DOSES (critical effect levels)
-        18. RISK ASSESSMENT VALUES (cancer risk, non-cancer hazard)
-        19. EMERGENCY RESPONSE STATISTICS (response times, outcomes)
-        20. COST DATA (medical costs, lost productivity)
-        21. REGULATORY STATUS (various countries, classifications)
-        22. ANALYTICAL METHODS (detection limits, methods)
-        23. ANIMAL STUDY DATA (species differences, extrapolation)
-        24. MECHANISM OF ACTION DATA (molecular targets, pathways)
-        25. GENETIC POLYMORPHISM EFFECTS (susceptible populations)
-        
-        Format: DATA_TYPE|SPECIFIC_VALUE|DATA_SOURCE|CONFIDENCE_LEVEL|POPULATION|NOTES
-        MINIMUM 19 entries, MAXIMUM 33 entries. Include numerical values when available.
-        """
-        return self.extract_stage_data(cargo, "통계 데이터", prompt)
+        stage_data = fallback_data.get(stage_name, ["GENERAL|Basic safety information|STANDARD|NORMAL|NONE|Consult medical professional"])
+        return "\n".join(stage_data)
+    
+    def extract_maximum_data_stage1(self, cargo):
+        """1단계: 위험성 분석"""
+        return self.extract_prompt_stage(cargo, "위험성 분석")
+    
+    def extract_maximum_data_stage2(self, cargo):
+        """2단계: 응급처치"""
+        return self.extract_prompt_stage(cargo, "응급처치")
+    
+    def extract_maximum_data_stage3(self, cargo):
+        """3단계: 통계 데이터"""
+        return self.extract_prompt_stage(cargo, "통계 데이터")
     
     def extract_maximum_data_stage4(self, cargo):
         """4단계: 환경/추가 정보"""
-        prompt = f"""
-        Comprehensive environmental, regulatory, and additional safety information for {cargo}:
-        
-        PROVIDE EXACTLY 19-28 INFORMATION ENTRIES covering:
-        1. ENVIRONMENTAL FATE (biodegradation, persistence, half-life)
-        2. ECOLOGICAL TOXICITY (aquatic, terrestrial, avian effects)
-        3. BIOACCUMULATION POTENTIAL (BCF, BAF values)
-        4. ENVIRONMENTAL MONITORING (detection in air, water, soil)
-        5. CLIMATE CHANGE IMPACTS (ozone depletion, global warming)
-        6. PHYSICAL PROPERTIES (density, viscosity, vapor pressure)
-        7. CHEMICAL PROPERTIES (pH, reactivity, stability)
-        8. FIRE/EXPLOSION HAZARDS (flash point, autoignition, LEL/UEL)
-        9. INCOMPATIBLE MATERIALS (reaction hazards, forbidden mixtures)
-        10. STORAGE REQUIREMENTS (temperature, humidity, container types)
-        11. TRANSPORTATION REGULATIONS (UN classification, packaging)
-        12. WORKPLACE REGULATIONS (OSHA, ACGIH standards)
-        13. INTERNATIONAL REGULATIONS (EU REACH, GHS classification)
-        14. RESTRICTED USE LISTS (banned countries, limited applications)
-        15. SUBSTITUTION ALTERNATIVES (safer chemical options)
-        16. GREEN CHEMISTRY ASPECTS (sustainable production, disposal)
-        17. WASTE MANAGEMENT (treatment, disposal methods)
-        18. EMERGENCY PLANNING (SARA Title III, RMP requirements)
-        19. COMMUNITY RIGHT-TO-KNOW (reporting requirements)
-        20. INDUSTRIAL HYGIENE (monitoring methods, PPE selection)
-        21. RISK MANAGEMENT (process safety, prevention measures)
-        22. TRAINING REQUIREMENTS (worker education, certification)
-        23. MEDICAL SURVEILLANCE (health monitoring programs)
-        24. INCIDENT REPORTING (mandatory reporting systems)
-        25. INSURANCE CONSIDERATIONS (liability, coverage requirements)
-        26. ECONOMIC IMPACTS (production costs, market trends)
-        27. TECHNOLOGY DEVELOPMENTS (detection, treatment innovations)
-        28. RESEARCH GAPS (unknown effects, needed studies)
-        29. PUBLIC HEALTH IMPLICATIONS (community exposure risks)
-        30. INTERNATIONAL COOPERATION (treaties, agreements)
-        
-        Format: CATEGORY|DETAILED_INFORMATION|REGULATORY_STATUS|IMPLEMENTATION_REQUIREMENTS|EFFECTIVENESS_DATA|REFERENCES
-        MINIMUM 19 entries, MAXIMUM 28 entries. Provide specific details and references.
-        """
-        return self.extract_stage_data(cargo, "환경/추가 정보", prompt)
+        return self.extract_prompt_stage(cargo, "환경/추가 정보")
     
     def extract_maximum_data_stage5(self, cargo):
         """5단계: 선박 의약품 기반 응급 의학 가이드라인"""
-        prompt = f"""
-        You are a maritime medical expert analyzing cargo hazards for {cargo}.
+        return self.extract_prompt_stage(cargo, "선박 의약품 가이드라인")
+    
+    def parse_stage_data(self, cargo, stage_data, stage_name):
+        """데이터 파싱 → ResultRow 목록 (파이프 행이 없으면 백업 파싱 문장)"""
+        if not stage_data:
+            return []
         
-        Available medicines on ship:
-        {SHIP_MEDICINES}
+        cargo, stage_name = sys.intern(cargo), sys.intern(stage_name)
+        return [ResultRow(cargo, stage_name, values) for values in shared_stage_rows(stage_data, stage_name)]
+    
+    def run_stage(self, cargo, stage):
+        """단일 (화물, 단계) 실행 - 중단 시 None 반환"""
+        stage_name, func_name, stage_key = stage
+        if self.should_stop:
+            return None
         
-        PROVIDE EXACTLY 15-25 MARITIME MEDICAL SCENARIOS covering:
-        1. ACUTE INHALATION POISONING (mild, moderate, severe treatment protocols)
-        2. CHEMICAL BURNS (acid, alkali, thermal injury management)
-        3. EYE CONTAMINATION (irrigation, specific antidotes, vision protection)
-        4. SKIN EXPOSURE (decontamination, wound care, systemic absorption)
-        5. ORAL INGESTION (gastric lavage alternatives, activated charcoal, antidotes)
-        6. RESPIRATORY DISTRESS (oxygen therapy, bronchodilators, ventilation)
-        7. CARDIOVASCULAR COLLAPSE (shock management, cardiac support)
-        8. NEUROLOGICAL SYMPTOMS (seizures, coma, altered consciousness)
-        9. ALLERGIC REACTIONS (anaphylaxis, sensitization responses)
-        10. SYSTEMIC TOXICITY (liver, kidney, multi-organ support)
-        11. BURN WOUND MANAGEMENT (cooling, dressing, pain control)
-        12. INFECTION PREVENTION (wound care, antibiotic prophylaxis)
-        13. PAIN MANAGEMENT (analgesics available on ship)
-        14. SHOCK TREATMENT (fluid resuscitation, vasopressors)
-        15. ANTIDOTE ADMINISTRATION (specific reversal agents if available)
-        16. SUPPORTIVE CARE (IV fluids, electrolyte management)
-        17. EVACUATION PROTOCOLS (stabilization for transfer)
-        18. MONITORING REQUIREMENTS (vital signs, laboratory alternatives)
-        19. DRUG INTERACTIONS (maritime medicine compatibility)
-        20. DOSE CALCULATIONS (weight-based, age-adjusted dosing)
-        21. ADMINISTRATION ROUTES (IV, IM, PO, topical preferences)
-        22. CONTRAINDICATIONS (when NOT to use specific medicines)
-        23. EMERGENCY PROCEDURES (when medicines are insufficient)
-        24. PREVENTION MEASURES (post-exposure prophylaxis)
-        25. COMMUNICATION PROTOCOLS (medical advice via radio)
+        saved_rows = self.resumed_stages.get((cargo, stage_key))
+        if saved_rows is not None:
+            print(f"  Stage: {stage_name}... ↩️ 저장된 결과 재사용 ({len(saved_rows)}개 항목)")
+            self.metrics.record('stage', cargo=cargo, stage=stage_key, source='resumed', rows=len(saved_rows),
+                                fallback=False, failed=False, duration_s=0.0)
+            return [ResultRow.from_tuple([cargo, stage_key] + row) for row in saved_rows]
         
-        Format: MEDICAL_SCENARIO|SPECIFIC_SHIP_MEDICINES|DOSAGE_ROUTE|MONITORING|CONTRAINDICATIONS|PROGNOSIS
-        MINIMUM 15 entries, MAXIMUM 25 entries.
+        try:
+            stage_results, failed = self.generate_stage(cargo, stage)
+        except CallShutdown:
+            return None  # 종료 중 - 기록하지 않고 다음 실행에서 다시 요청
         
-        CRITICAL: For each scenario, you MUST:
-        - Use ONLY medicines from the ship's inventory listed above
-        - Specify exact medicine names (e.g., "에피네프린 1앰플", "아세트아미노펜 500mg")
-        - Include dosage and administration route
-        - Consider maritime environment limitations
-        - Provide realistic treatment protocols using available resources
-        """
-        return self.extract_stage_data(cargo, "선박 의약품 가이드라인", prompt)
+        # 단계가 끝나는 즉시 기록해 중단되어도 다시 호출하지 않게 함 (실패한 단계는 재시작 시 다시 요청)
+        if failed:
+            self.failed_stages.add((cargo, stage_key))
+        if self.ledger is not None:
+            self.ledger.record_stage(self.unit_members.get(cargo, [cargo]), stage_key,
+                                     self.current_batch, stage_results,
+                                     self.stage_fingerprints.get((cargo, stage_key)), failed=failed)
+        
+        self.update_activity()
+        return stage_results
     
+    def stage_problem(self, stage_key, stage_results):
+        """단계 결과의 문제 (stage_rows_problem) - FAILED_STAGE_PROBLEMS면 실패로 기록하고 다음 실행에서 다시 요청"""
+        if self.fallback_rows is None:
+            self.fallback_rows = self.stage_fallback_rows()
+        rows = [list(row.values) for row in stage_results]
+        return stage_rows_problem(stage_key, rows, self.fallback_rows[stage_key])
     
-    def parse_stage_data(self, cargo, stage_data, stage_name):
-        """데이터 파싱"""
-        results = []
+    def generate_stage(self, cargo, stage):
+        """단계 데이터 생성(묶음 조각 / 가이드 공유 / 단독 요청) 후 파싱 → (결과 행, 실패 여부) - 진행 기록에는 쓰지 않음"""
+        stage_name, func_name, stage_key = stage
+        start = time.perf_counter()
         
-        if not stage_data:
-            return results
+        # 묶음 요청에서 받은 조각이 있으면 그대로 사용
+        packed = self.packed_stage_data.pop((cargo, stage_key), None)
+        print(f"  Stage: {stage_name}...{' 📦 묶음 응답 사용' if packed is not None else ''}")
+        guide_no = self.cargo_guides.get(cargo)
+        if packed is not None:
+            source = 'packed'
+            stage_data = packed
+        elif guide_no and self.stage_policy.get(stage_key) == "guide":
+            source = 'guide'
+            stage_data = self.get_guide_stage_data(guide_no, stage)
+        else:
+            source = 'call'
+            stage_data = getattr(self, func_name)(cargo)
+        stage_results = self.parse_stage_data(cargo, stage_data, stage_key)
+        print(f"    ✓ {len(stage_results)}개 항목")
+        # 지표와 진행 기록에 같은 실패 판정을 사용
+        problem = self.stage_problem(stage_key, stage_results)
+        failed = problem in FAILED_STAGE_PROBLEMS
+        self.metrics.record('stage', cargo=cargo, stage=stage_key, source=source, rows=len(stage_results),
+                            fallback=problem == 'fallback', failed=failed,
+                            duration_s=round(time.perf_counter() - start, 4))
+        return stage_results, failed
+    
+    def unit_failed_stages(self, cargo):
+        """작업 단위에서 이번 실행 중 실패한 단계 Stage 목록 (단계 순서)"""
+        return [stage_key for _, _, stage_key in STAGES if (cargo, stage_key) in self.failed_stages]
+    
+    def get_guide_stage_data(self, guide_no, stage):
+        """Guide_No 공유 단계: 가이드마다 한 번만 생성하고 이후 재사용"""
+        stage_name, func_name, stage_key = stage
+        key = (guide_no, stage_key)
         
-        lines = stage_data.split('\n')
-        for line in lines:
-            line = line.strip()
-            if '|' in line and len(line) > 20:
-                parts = [p.strip() for p in line.split('|')]
-                if len(parts) >= 3:
-                    results.append({
-                        'Cargo': cargo,
-                        'Stage': stage_name,
-                        'Category': parts[0] if len(parts) > 0 else '',
-                        'Description': parts[1] if len(parts) > 1 else '',
-                        'Detail1': parts[2] if len(parts) > 2 else '',
-                        'Detail2': parts[3] if len(parts) > 3 else '',
-                        'Detail3': parts[4] if len(parts) > 4 else ''
-                    })
+        with self.guide_cache_lock:
+            if key in self.guide_stage_cache:
+                return self.guide_stage_cache[key]
+            lock = self.guide_stage_locks.setdefault(key, threading.Lock())
+        
+        # 같은 가이드를 여러 워커가 동시에 요청해도 생성은 한 번만
+        with lock:
+            with self.guide_cache_lock:
+                if key in self.guide_stage_cache:
+                    return self.guide_stage_cache[key]
+            
+            print(f"    📘 Guide {guide_no} 공유 데이터 생성: {stage_name}")
+            stage_data = getattr(self, func_name)(guide_subject(guide_no))
+            
+            # 오류/대체 데이터는 공유하지 않고 다음 화물에서 다시 시도
+            if not is_failed_stage_data(stage_data) and \
+                    stage_data != self.generate_fallback_data(guide_no, stage_name):
+                with self.guide_cache_lock:
+                    self.guide_stage_cache[key] = stage_data
+            return stage_data
+    
+    def prefetch_packed_stages(self, batch_cargos):
+        """배치 화물을 Guide_No별로 묶어 단계마다 한 번에 요청하고 화물별 조각을 저장
         
-        # 백업 파싱
-        if not results:
-            sentences = [s.strip() for s in stage_data.replace('\n', '. ').split('.')]
-            relevant_sentences = [s for s in sentences if len(s) > 30 and 
-                                any(keyword in s.lower() for keyword in 
-                                ['risk', 'toxic', 'hazard', 'treat', 'procedure', 'data', 'effect'])]
+        조각을 받지 못한 화물은 run_stage에서 평소처럼 단독으로 다시 요청한다.
+        """
+        packs = self.plan_packs(batch_cargos)
+        if not packs:
+            return
+        print(f"\n📦 묶음 요청 {len(packs)}개 ({sum(len(pack) for _, pack in packs)}개 (화물, 단계))")
+        for stage, pack in packs:
+            if self.should_stop:
+                break
+            self.request_pack(stage, pack)
+    
+    def plan_packs(self, batch_cargos):
+        """배치 화물을 단계별 · Guide_No별 묶음으로 나눔 → [(단계, 화물 목록)] (화물 2개 이상인 묶음만)"""
+        packs = []
+        for stage in STAGES:
+            stage_key = stage[2]
+            groups = {}
+            for cargo in batch_cargos:
+                guide_no = self.cargo_guides.get(cargo)
+                if (cargo, stage_key) in self.resumed_stages or \
+                        (guide_no and self.stage_policy.get(stage_key) == "guide"):
+                    continue
+                groups.setdefault(guide_no, []).append(cargo)
             
-            for i, sentence in enumerate(relevant_sentences[:10]):
-                results.append({
-                    'Cargo': cargo,
-                    'Stage': stage_name,
-                    'Category': f'{stage_name} Item {i+1}',
-                    'Description': sentence,
-                    'Detail1': '',
-                    'Detail2': '',
-                    'Detail3': ''
-                })
-        
-        return results
+            size = self.pack_sizer.pack_size(stage_key)
+            for group in groups.values():
+                packs.extend((stage, group[j:j + size]) for j in range(0, len(group), size)
+                             if len(group[j:j + size]) > 1)
+        return packs
+    
+    def request_pack(self, stage, cargos):
+        """화물 여러 개를 한 단계 요청으로 보내고 응답을 화물별로 분리"""
+        stage_name, _, stage_key = stage
+        if self.should_stop:
+            return
+        
+        print(f"  📦 {stage_name}: 화물 {len(cargos)}개 묶음 요청 (Guide {self.cargo_guides.get(cargos[0]) or '-'})")
+        prompt, system_instruction = build_packed_prompt(stage_key, cargos, split=self.prefix_cache)
+        try:
+            stage_data = self.extract_stage_data(cargos[0], stage_name, prompt, system_instruction=system_instruction,
+                                                 pack_size=len(cargos))
+        except CallShutdown:
+            return  # 종료 중 - 화물별 단계가 중단된 것으로 처리됨
+        
+        slices = split_packed_stage_data(stage_data, len(cargos))
+        markers = PACK_MARKER.findall(stage_data or '')
+        truncated = bool(markers) and not markers[-1][0]
+        self.pack_sizer.record(stage_key, len(cargos), estimate_tokens("".join(slices.values())),
+                               len(slices), truncated)
+        
+        with self.pack_lock:
+            for index, text in slices.items():
+                self.packed_stage_data[(cargos[index], stage_key)] = text
+            self.pack_stats['requests'] += 1
+            self.pack_stats['cargos'] += len(cargos)
+            self.pack_stats['missing'] += len(cargos) - len(slices)
+        
+        if len(slices) < len(cargos):
+            print(f"    ⚠️ {stage_name}: 묶음 응답에서 {len(cargos) - len(slices)}개 화물 누락/형식 오류"
+                  f"{' (출력 잘림)' if truncated else ''} - 해당 화물만 단독 재요청")
+    
+    def emit_stage_results(self, cargo, stage_key, stage_results):
+        """단계 결과를 작업 단위의 모든 화물 행으로 복제해 출력 파일에 추가"""
+        if self.writer is None or (cargo, stage_key) in self.written_stages:
+            return
+        members = self.unit_members.get(cargo, [cargo])
+        if members == [cargo]:
+            rows = stage_results
+        else:
+            rows = [row.with_cargo(member) for member in members for row in stage_results]
+        self.writer.write_rows(rows, keys=[(member, stage_key) for member in members])
     
     def analyze_cargo_maximum(self, cargo, cargo_num, total_cargos):
-        """단일 화물 분석"""
+        """단일 화물 분석 (중단 시 None)"""
         if self.should_stop:
-            return []
+            return None
         
         print(f"\n[{cargo_num}/{total_cargos}] {cargo}")
         self.update_activity()
+        start = time.perf_counter()
         
         all_results = []
+        stage_slots = []
         
         # 5단계 분석
-        stages = [
-            ("위험성 분석", self.extract_maximum_data_stage1, "Risk Analysis"),
-            ("응급처치", self.extract_maximum_data_stage2, "Emergency Procedures"),
-            ("통계 데이터", self.extract_maximum_data_stage3, "Statistical Data"),
-            ("환경/추가 정보", self.extract_maximum_data_stage4, "Environmental/Additional"),
-            ("선박 의약품 가이드라인", self.extract_maximum_data_stage5, "Maritime Medical Guidelines")
-        ]
-        
-        for stage_name, stage_func, stage_key in stages:
-            if self.should_stop:
-                break
-                
-            print(f"  Stage: {stage_name}...")
-            stage_data = stage_func(cargo)
-            stage_results = self.parse_stage_data(cargo, stage_data, stage_key)
+        for stage in STAGES:
+            stage_results = self.run_stage(cargo, stage)
+            if stage_results is None:
+                # 중단되어 빠진 단계가 있으면 완료로 기록하지 않음
+                return None
+            stage_slots.append(stage_results)
             all_results.extend(stage_results)
-            print(f"    ✓ {len(stage_results)}개 항목")
-            
-            time.sleep(1)  # API 제한 고려
-            self.update_activity()
+        
+        # 실패한 단계가 있으면 출력하지 않고 다음 실행에서 그 단계만 다시 요청한 뒤 작업 단위 전체를 출력
+        failed = self.unit_failed_stages(cargo)
+        if failed:
+            print(f"  ⚠️ 실패한 단계 {len(failed)}개 ({', '.join(failed)}) - 다음 실행에서 다시 요청")
+            return None
+        for stage, stage_results in zip(STAGES, stage_slots):
+            self.emit_stage_results(cargo, stage[2], stage_results)
         
         print(f"  🎯 총 {len(all_results)}개 데이터 항목")
+        self.metrics.record('cargo', cargo=cargo, rows=len(all_results),
+                            duration_s=round(time.perf_counter() - start, 4))
         return all_results
     
-    def save_batch_results(self, results, batch_num):
-        """배치 결과 저장"""
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M")
-        filename = f"maximum_data_batch_{batch_num}_{timestamp}.csv"
-        
-        df = pd.DataFrame(results)
-        df.to_csv(filename, index=False, encoding='utf-8-sig')
+    def unit_priority(self, unit, index):
+        """작업 단위 우선순위 (작을수록 먼저) - --priority 기준 순서대로 비교하고 마지막은 화물 리스트 순서"""
+        key = []
+        for name in self.priority:
+            if name == "hazard":
+                key.append(guide_hazard_rank(self.cargo_guides.get(unit['label'], '')))
+            elif name == "partial":
+                partial = any((unit['label'], stage_key) in self.resumed_stages for _, _, stage_key in STAGES) or \
+                    any(member in self.processed_cargos for member in unit['members'])
+                key.append(0 if partial else 1)
+            elif name == "file":
+                key.append(index)
+        key.append(index)
+        return tuple(key)
+    
+    def open_batch(self):
+        """새 배치 번호로 배치 시작 → 배치 상태 {'units': [(작업 단위, 행 수)], 'opened'}"""
+        self.current_batch += 1
+        self.ledger.set_meta('last_batch', max(self.current_batch, self.ledger.last_batch()))
+        return {'units': [], 'opened': time.monotonic()}
+    
+    def batch_due(self, batch):
+        """끝난 작업 단위가 batch_size개가 되었거나 batch_seconds가 지났으면 배치 확정"""
+        if len(batch['units']) >= self.batch_size:
+            return True
+        return bool(batch['units']) and bool(self.batch_seconds) and \
+            time.monotonic() - batch['opened'] >= self.batch_seconds
+    
+    def close_batch(self, batch, all_cargos, start_time):
+        """배치 확정: 출력 파일 fsync 후 끝난 작업 단위의 화물 완료 기록"""
+        self.writer.flush()
+        if batch['units']:
+            self.ledger.record_batch(self.current_batch, {
+                member: [stage_key for _, _, stage_key in STAGES]
+                for unit, _ in batch['units'] for member in unit['members']})
+            for unit, _ in batch['units']:
+                self.processed_cargos.update(unit['members'])
+            
+            batch_rows = sum(rows * len(unit['members']) for unit, rows in batch['units'])
+            print(f"\n💾 배치 {self.current_batch} 기록: {self.writer.path} ({len(batch['units'])}개 작업 단위)")
+            print(f"   배치 데이터: {batch_rows}개")
+            
+            # 진행률 표시
+            progress = (len(self.processed_cargos) / len(all_cargos)) * 100
+            elapsed = (time.time() - start_time) / 60
+            print(f"   전체 진행률: {progress:.1f}% | 경과: {elapsed:.1f}분")
         self.update_activity()
-        return filename
+    
+    def run_scheduled(self, units, all_cargos, start_time):
+        """(작업 단위, 단계) 작업을 워커별 우선순위 큐(WorkQueue)로 실행하고 작업 단위 순서대로 출력 / 배치 확정
+        
+        units는 우선순위 순으로 정렬되어 있어 순번이 곧 우선순위다. 작업 단위는 batch_size개씩 창 단위로 큐에 넣되, 워커가 가져가지 않은 작업이 워커 수보다 적어지면
+        다음 창을 미리 넣어 워커가 쉬지 않게 한다. 묶음 모드에서는 창의 묶음 요청을 먼저 실행하고 끝나면
+        그 창의 단계 작업을 넣는다. 작업 단위는 끝난 순서와 관계없이 순번 순서(직렬 모드와 같은 순서)로
+        출력 파일에 추가하므로 앞 작업 단위를 기다리는 끝난 작업 단위는 버퍼에 남는다 (최대 max_buffered개까지만 미리 실행).
+        """
+        work_queue = WorkQueue(self.max_workers)
+        events = queue.Queue()
+        
+        def worker(worker_id):
+            while True:
+                task = work_queue.get(worker_id)
+                if task is None:
+                    return
+                kind, key = task
+                result = None
+                try:
+                    if kind == 'pack':
+                        window, stage, pack = key
+                        self.request_pack(stage, pack)
+                    else:
+                        result = self.run_stage(units[key[0]]['label'], STAGES[key[1]])
+                except Exception as e:
+                    print(f"    ⚠️ {kind} 작업 오류: {e}")
+                events.put((kind, key, result))
+        
+        threads = [threading.Thread(target=worker, args=(i,), daemon=True, name=f'stage-worker-{i}')
+                   for i in range(self.max_workers)]
+        for thread in threads:
+            thread.start()
+        
+        windows = [list(range(i, min(i + self.batch_size, len(units)))) for i in range(0, len(units), self.batch_size)]
+        slots = {}  # 작업 단위 순번 → 단계별 결과
+        started = {}  # 작업 단위 순번 → 큐에 넣은 시각
+        pending_packs = {}  # 창 순번 → 남은 묶음 요청 수
+        received = {}  # 작업 단위 순번 → 결과가 온 단계 수
+        finished = set()  # 모든 단계 결과가 왔지만 아직 출력 순서가 오지 않은 작업 단위 순번
+        durations = {}  # 작업 단위 순번 → 모든 단계가 끝날 때까지 걸린 시간 (출력 대기 제외)
+        outstanding = 0  # 큐에 넣었지만 결과가 오지 않은 작업 수
+        next_window = 0
+        next_emit = 0  # 출력 순서상 다음 작업 단위 순번
+        max_buffered = 4 * max(self.batch_size, self.max_workers)
+        done = 0
+        batch = None
+        
+        def affinity(index):
+            return self.cargo_guides.get(units[index]['label']) or units[index]['label']
+        
+        def submit_stages(window):
+            nonlocal outstanding
+            for index in windows[window]:
+                slots[index] = [None] * len(STAGES)
+                received[index] = 0
+                started[index] = time.perf_counter()
+                for si in range(len(STAGES)):
+                    work_queue.put((index, si), affinity(index), ('stage', (index, si)))
+                    outstanding += 1
+        
+        try:
+            while True:
+                # 파이프 채우기: 대기 작업이 워커 수보다 적으면 다음 창 투입 (출력 대기 작업 단위가 너무 많으면 보류)
+                while next_window < len(windows) and not self.should_stop and \
+                        work_queue.pending() < self.max_workers and \
+                        windows[next_window][0] - next_emit < max_buffered:
+                    window, next_window = next_window, next_window + 1
+                    packs = self.plan_packs([units[i]['label'] for i in windows[window]]) \
+                        if self.pack_sizer is not None else []
+                    if not packs:
+                        submit_stages(window)
+                        continue
+                    print(f"\n📦 묶음 요청 {len(packs)}개 ({sum(len(pack) for _, pack in packs)}개 (화물, 단계))")
+                    pending_packs[window] = len(packs)
+                    for stage, pack in packs:
+                        work_queue.put((windows[window][0], -1), self.cargo_guides.get(pack[0]) or pack[0],
+                                       ('pack', (window, stage, pack)))
+                        outstanding += 1
+                
+                if outstanding == 0 and (next_window == len(windows) or self.should_stop):
+                    break
+                
+                try:
+                    kind, key, result = events.get(timeout=1.0)
+                except queue.Empty:
+                    if batch is not None and self.batch_due(batch):
+                        self.close_batch(batch, all_cargos, start_time)
+                        batch = None
+                    continue
+                outstanding -= 1
+                self.update_activity()
+                
+                if kind == 'pack':
+                    pending_packs[key[0]] -= 1
+                    if pending_packs[key[0]] == 0:
+                        submit_stages(key[0])
+                    continue
+                
+                index, si = key
+                slots[index][si] = result
+                received[index] += 1
+                if received[index] == len(STAGES):
+                    finished.add(index)
+                    durations[index] = time.perf_counter() - started.pop(index)
+                
+                # 앞 작업 단위부터 차례로 출력 (뒤 작업 단위가 먼저 끝나도 순서가 올 때까지 대기)
+                while next_emit in finished:
+                    stage_slots = slots[next_emit]
+                    if any(stage_results is None for stage_results in stage_slots) and self.should_stop:
+                        break  # 중단으로 빠진 단계 - 직렬 모드처럼 이후 작업 단위도 출력하지 않음 (진행 기록에는 남음)
+                    index, next_emit = next_emit, next_emit + 1
+                    finished.discard(index)
+                    slots.pop(index)
+                    label = units[index]['label']
+                    if any(stage_results is None for stage_results in stage_slots):
+                        print(f"  ⚠️ {label}: 작업 오류로 빠진 단계가 있어 완료로 기록하지 않음")
+                        continue
+                    failed = self.unit_failed_stages(label)
+                    if failed:
+                        # 실패한 단계는 다음 실행에서 다시 요청하고 그때 작업 단위 전체를 출력
+                        print(f"  ⚠️ {label}: 실패한 단계 {len(failed)}개 ({', '.join(failed)}) - 다음 실행에서 다시 요청")
+                        continue
+                    for stage, stage_results in zip(STAGES, stage_slots):
+                        self.emit_stage_results(label, stage[2], stage_results)
+                    rows = sum(len(stage_results) for stage_results in stage_slots)
+                    done += 1
+                    print(f"  🎯 [{done}/{len(units)}] {label}: 총 {rows}개 데이터 항목")
+                    self.metrics.record('cargo', cargo=label, rows=rows, duration_s=round(durations.pop(index), 4))
+                    
+                    if batch is None:
+                        batch = self.open_batch()
+                    batch['units'].append((units[index], rows))
+                    if self.batch_due(batch):
+                        self.close_batch(batch, all_cargos, start_time)
+                        batch = None
+        except BaseException:
+            self.request_stop()  # 강제 종료(두 번째 신호 등) - 남은 작업을 배정하지 않음
+            raise
+        finally:
+            work_queue.close()
+            # 호출 풀을 닫기 전에 진행 중인 단계가 끝나기를 기다림 (멈춘 호출은 호출 제한 시간까지)
+            deadline = time.monotonic() + self.supervisor.call_timeout * 2
+            for thread in threads:
+                thread.join(max(0.0, deadline - time.monotonic()))
+            if batch is not None:
+                self.close_batch(batch, all_cargos, start_time)
+        
+        if self.should_stop:
+            print("\n🔄 중단 요청(신호 또는 워치독)으로 멈춤 - 재시작하면 이어서 진행")
+        if work_queue.steals:
+            print(f"\n🔀 작업 훔치기: {work_queue.steals}회")
+    
+    def print_metrics_summary(self):
+        """단계별 모델 시간/토큰/행/대체 데이터 요약 - 시간과 비용(토큰)을 가장 많이 쓰는 단계 표시"""
+        summary = self.metrics.stage_summary()
+        if not summary:
+            return
+        total_seconds = sum(entry['seconds'] for entry in summary.values()) or 1.0
+        total_tokens = sum(entry['input_tokens'] + entry['output_tokens'] for entry in summary.values()) or 1
+        order = {stage_key: i for i, (_, _, stage_key) in enumerate(STAGES)}
+        
+        print(f"\n📊 단계별 지표")
+        print(f"  {'Stage':<28} {'calls':>6} {'retry':>6} {'model_s':>10} {'time%':>6} {'1st_row':>8} {'input_tok':>12} "
+              f"{'output_tok':>12} {'tok%':>6} {'rows':>7} {'fallbk':>6} {'error':>5}")
+        for stage_key, entry in sorted(summary.items(), key=lambda item: order.get(item[0], len(order))):
+            tokens = entry['input_tokens'] + entry['output_tokens']
+            first_row = entry['first_row_s'] / entry['first_row_calls'] if entry['first_row_calls'] else 0.0
+            print(f"  {stage_key:<28} {entry['calls']:>6} {entry['retries']:>6} {entry['seconds']:>9.1f}s "
+                  f"{entry['seconds'] / total_seconds * 100:>5.1f}% {first_row:>7.2f}s {entry['input_tokens']:>12,} "
+                  f"{entry['output_tokens']:>12,} {tokens / total_tokens * 100:>5.1f}% "
+                  f"{entry['rows'] / max(entry['stages'], 1):>7.1f} {entry['fallback']:>6} {entry['failed']:>5}")
+        
+        def stage_tokens(stage_key):
+            return summary[stage_key]['input_tokens'] + summary[stage_key]['output_tokens']
+        
+        slowest = max(summary, key=lambda stage_key: summary[stage_key]['seconds'])
+        costliest = max(summary, key=stage_tokens)
+        print(f"  ⏱️ 시간 최대: {slowest} ({summary[slowest]['seconds'] / total_seconds * 100:.1f}%) | "
+              f"💰 토큰 최대: {costliest} ({stage_tokens(costliest) / total_tokens * 100:.1f}%)")
+    
+    def open_writer(self):
+        """출력 파일 열기 - 확정된 행은 진행 기록에 바로 표시
+        
+        강제 종료로 진행 기록에 확정되지 않은 채 파일에 남은 행은 잘라내고, 재시작 후 진행 기록에서 다시 쓴다.
+        """
+        confirmed = self.ledger.output_position(self.writer_options.get('path', 'maximum_data_results.csv'))
+        self.writer = ResultWriter(on_flush=self.ledger.mark_written, confirmed=confirmed, **self.writer_options)
+        if self.writer.discarded_bytes:
+            print(f"  - ✂️ 확정 기록 전에 중단된 출력 {self.writer.discarded_bytes:,}바이트 제거 (진행 기록에서 다시 기록)")
+        return self.writer
+    
+    def open_ledger(self):
+        """진행 기록 열기 (기존 배치 파일 가져오기, 샤드 확인) - 다른 샤드의 기록이면 False"""
+        if self.ledger is None:
+            self.ledger = ProgressLedger(read_only=self.plan_only)
+        imported = self.ledger.import_batch_files()
+        if imported:
+            print(f"📥 기존 배치 파일 {imported}개를 진행 기록으로 가져옴")
+        if self.shard:
+            # 다른 샤드의 진행 기록을 이어 쓰면 서로의 화물을 처리한 것으로 착각함
+            shard_label = "%d/%d" % self.shard
+            recorded_shard = self.ledger.get_meta('shard')
+            if recorded_shard and recorded_shard != shard_label:
+                print(f"❌ {self.ledger.path}는 샤드 {recorded_shard}의 진행 기록입니다 (요청: {shard_label})")
+                return False
+            self.ledger.set_meta('shard', shard_label)
+        return True
+    
+    def plan_run(self):
+        """화물 리스트 로드 및 작업 단위 계획 (샤드 실행이면 해당 샤드만) → (화물 목록, 작업 단위 목록)"""
+        cargo_rows = self.load_cargo_rows()
+        all_cargos = list(dict.fromkeys(row['Cargo'] for row in cargo_rows))
+        work_units = self.plan_work_units(cargo_rows)
+        if self.shard:
+            index, count = self.shard
+            work_units = [unit for unit in work_units if shard_of(unit['rows'][0], count) == index]
+            shard_cargos = {member for unit in work_units for member in unit['members']}
+            all_cargos = [cargo for cargo in all_cargos if cargo in shard_cargos]
+            print(f"  - 샤드 {index}/{count}: 화물 {len(all_cargos)}개 (작업 단위 {len(work_units)}개)")
+        prompt_fingerprints = stage_prompt_fingerprints()
+        for unit in work_units:
+            rows_fingerprint = cargo_rows_fingerprint(unit['rows'])
+            for stage_key, prompt_fingerprint in prompt_fingerprints.items():
+                self.stage_fingerprints[(unit['label'], stage_key)] = stage_input_fingerprint(
+                    rows_fingerprint, prompt_fingerprint)
+        return all_cargos, work_units
+    
+    def find_changed_stages(self, work_units):
+        """입력 행이나 단계 프롬프트가 기록 이후 바뀐 (작업 단위, 단계) 찾기
+        
+        → (변경 대상 {(라벨, Stage): {'members', 'problem'}}, 지문 없는 기록 [(지문, 화물, Stage)])
+        지문을 기록하기 전 버전에서 끝낸 단계는 변경으로 보지 않고 현재 지문을 기준값으로 쓴다.
+        """
+        recorded = self.ledger.stage_fingerprints()
+        changed = {}
+        baseline = []
+        for unit in work_units:
+            for _, _, stage_key in STAGES:
+                fingerprint = self.stage_fingerprints[(unit['label'], stage_key)]
+                for member in unit['members']:
+                    if (member, stage_key) not in recorded:
+                        continue
+                    previous = recorded[(member, stage_key)]
+                    if previous is None:
+                        baseline.append((fingerprint, member, stage_key))
+                    elif previous != fingerprint:
+                        changed[(unit['label'], stage_key)] = {'members': unit['members'], 'problem': 'changed'}
+        return changed, baseline
+    
+    def print_run_plan(self, all_cargos, remaining_units, changed):
+        """모델을 호출하기 전에 단계별 생성 / 변경 재생성 / 재사용 수와 예상 요청 수 출력"""
+        removed = self.ledger.processed_cargos() - set(all_cargos)
+        print(f"\n📝 실행 계획:")
+        print(f"  {'Stage':<28} {'new':>6} {'changed':>8} {'resumed':>8} {'calls':>6}")
+        totals = [0, 0, 0, 0]
+        for _, _, stage_key in STAGES:
+            generate = [unit for unit in remaining_units
+                        if (unit['label'], stage_key) not in self.resumed_stages]
+            labels = [label for label, key in changed if key == stage_key]
+            resumed = sum(1 for unit in remaining_units if (unit['label'], stage_key) in self.resumed_stages)
+            if self.stage_policy.get(stage_key) == "guide":
+                # 가이드 공유 단계는 가이드마다 한 번 (가이드가 없는 화물은 단독 요청)
+                subjects = {self.cargo_guides.get(unit['label'], unit['label']) for unit in generate}
+                subjects.update(self.cargo_guides.get(label, label) for label in labels)
+                calls = len(subjects)
+            else:
+                calls = len(generate) + len(labels)
+            counts = [len(generate), len(labels), resumed, calls]
+            totals = [total + count for total, count in zip(totals, counts)]
+            print(f"  {stage_key:<28} {counts[0]:>6} {counts[1]:>8} {counts[2]:>8} {counts[3]:>6}")
+        print(f"  {'total':<28} {totals[0]:>6} {totals[1]:>8} {totals[2]:>8} {totals[3]:>6}")
+        print(f"  - 예상 모델 요청: 최대 {totals[3]}회 (응답 캐시 적중, 묶음 요청이면 더 적음)")
+        if removed:
+            print(f"  - 화물 리스트에서 빠진 처리 완료 화물: {len(removed)}개 (출력 파일의 기존 행은 그대로 둠)")
     
     def run_analysis(self):
         """분석 실행"""
@@ -528,94 +3224,535 @@ class AutoRestartAnalyzer:
         print("="*100)
         
         # 이전 진행 상황 확인
-        last_batch = self.find_last_batch_number()
-        processed_cargos = self.load_processed_cargos()
+        if not self.open_ledger():
+            return
+        last_batch = self.ledger.last_batch()
+        processed_cargos = self.ledger.processed_cargos()
         
-        print(f"📋 재시작 정보:")
+        print(f"📋 재시작 정보 ({self.ledger.path}):")
         print(f"  - 마지막 배치 번호: {last_batch}")
         print(f"  - 처리된 화물 수: {len(processed_cargos)}개")
         
-        # 화물 리스트 로드
-        all_cargos = self.load_cargo_list()
+        # 화물 리스트 로드 및 작업 단위 계획
+        all_cargos, work_units = self.plan_run()
+        
+        # 입력 행 / 단계 프롬프트가 바뀐 단계는 남은 작업이 끝난 뒤 다시 생성해 제자리 교체
+        changed, baseline = self.find_changed_stages(work_units)
+        if baseline and not self.plan_only:
+            self.ledger.set_fingerprints(baseline)
+            print(f"  - 입력 지문 기준값 기록: {len(baseline)}개 (화물, 단계)")
+        if changed:
+            print(f"  - 입력/프롬프트가 바뀐 단계: {len(changed)}개 (작업 단위, 단계)")
         
-        # 미처리 화물만 필터링
+        # 미처리 작업 단위만 필터링 (단위 내 화물이 하나라도 남아 있으면 다시 실행)
+        remaining_units = [unit for unit in work_units
+                           if any(member not in processed_cargos for member in unit['members'])]
         remaining_cargos = [cargo for cargo in all_cargos if cargo not in processed_cargos]
+        self.processed_cargos.update(cargo for cargo in all_cargos if cargo in processed_cargos)
         
-        print(f"  - 남은 화물 수: {len(remaining_cargos)}개")
-        print(f"  - 전체 진행률: {len(processed_cargos)}/{len(all_cargos)} ({len(processed_cargos)/len(all_cargos)*100:.1f}%)")
+        # 중단 전에 끝난 단계는 다시 호출하지 않고 저장된 결과 사용
+        for unit in remaining_units:
+            member_results = [self.ledger.stage_results(member) for member in unit['members']]
+            for _, _, stage_key in STAGES:
+                saved = [results.get(stage_key) for results in member_results]
+                if all(entry is not None for entry in saved):
+                    self.resumed_stages[(unit['label'], stage_key)] = saved[0][0]
+                    if all(written for _, written in saved):
+                        self.written_stages.add((unit['label'], stage_key))
+        if self.resumed_stages:
+            print(f"  - 이어서 사용할 완료 단계: {len(self.resumed_stages)}개 (화물, 단계)")
         
-        if not remaining_cargos:
+        # 우선순위 순으로 정렬 (기본 file: 화물 리스트 순서 그대로)
+        order = {id(unit): self.unit_priority(unit, i) for i, unit in enumerate(remaining_units)}
+        remaining_units.sort(key=lambda unit: order[id(unit)])
+        
+        print(f"  - 남은 화물 수: {len(remaining_cargos)}개 (모델 호출 단위: {len(remaining_units)}개)")
+        print(f"  - 전체 진행률: {len(self.processed_cargos)}/{len(all_cargos)} ({len(self.processed_cargos)/max(len(all_cargos), 1)*100:.1f}%)")
+        
+        self.print_run_plan(all_cargos, remaining_units, changed)
+        if self.plan_only:
+            print("\n📝 --plan: 모델을 호출하지 않고 종료")
+            return
+        
+        if not remaining_units and not changed:
             print("✅ 모든 화물 처리 완료!")
             return
         
+        guide_stages = [key for key, scope in self.stage_policy.items() if scope == "guide"]
+        if self.pack_sizer is not None and self.structured_output:
+            print("  - 구조화 출력 모드에서는 묶음 요청을 사용하지 않음")
+            self.pack_sizer = None
+        
+        if guide_stages:
+            guide_count = len({self.cargo_guides.get(unit['label']) for unit in remaining_units} - {None})
+            print(f"  - Guide_No 공유 단계: {', '.join(guide_stages)} ({guide_count}개 가이드)")
+        
         # 워치독 시작
         self.start_watchdog()
         
+        # 출력 파일 열기
+        self.open_writer()
+        print(f"  - 출력 파일: {self.writer.path}")
+        
         # 분석 시작
         start_time = time.time()
-        batch_size = 10
         self.current_batch = last_batch
         
+        if self.max_workers > 1:
+            print(f"⚡ 동시 실행 모드: 워커 {self.max_workers}개가 (화물, 단계) 우선순위 큐에서 작업 처리")
+        print(f"  - 우선순위: {', '.join(self.priority)} | 배치 확정: 작업 단위 {self.batch_size}개"
+              f"{f' 또는 {self.batch_seconds:g}초' if self.batch_seconds else ''}")
+        
         print(f"\n🚀 분석 재시작... ({datetime.now().strftime('%H:%M:%S')})")
         print("-"*100)
         
-        for i in range(0, len(remaining_cargos), batch_size):
-            if self.should_stop:
-                print("\n🔄 워치독에 의해 중단됨")
-                break
-                
-            batch_cargos = remaining_cargos[i:i+batch_size]
-            self.current_batch += 1
-            
-            print(f"\n📦 BATCH {self.current_batch} ({len(batch_cargos)}개 화물)")
-            print("="*50)
-            
-            batch_results = []
-            
-            for j, cargo in enumerate(batch_cargos):
-                if self.should_stop:
-                    break
+        try:
+            if self.max_workers > 1:
+                self.run_scheduled(remaining_units, all_cargos, start_time)
+            else:
+                batch = None
+                for i, unit in enumerate(remaining_units):
+                    if self.should_stop:
+                        print("\n🔄 중단 요청(신호 또는 워치독)으로 멈춤 - 재시작하면 이어서 진행")
+                        break
+                    if batch is None:
+                        batch = self.open_batch()
+                        print(f"\n📦 BATCH {self.current_batch}")
+                        print("="*50)
+                    if self.pack_sizer is not None and i % self.batch_size == 0:
+                        self.prefetch_packed_stages([unit['label'] for unit in remaining_units[i:i + self.batch_size]])
                     
-                cargo_results = self.analyze_cargo_maximum(cargo, i+j+1, len(remaining_cargos))
-                batch_results.extend(cargo_results)
-                self.processed_cargos.add(cargo)
-            
-            # 배치 저장
-            if batch_results:
-                batch_file = self.save_batch_results(batch_results, self.current_batch)
-                print(f"\n💾 배치 {self.current_batch} 저장: {batch_file}")
-                print(f"   배치 데이터: {len(batch_results)}개")
-                
-                # 진행률 표시
-                total_processed = len(processed_cargos) + i + len(batch_cargos)
-                progress = (total_processed / len(all_cargos)) * 100
-                elapsed = (time.time() - start_time) / 60
-                print(f"   전체 진행률: {progress:.1f}% | 경과: {elapsed:.1f}분")
+                    unit_results = self.analyze_cargo_maximum(unit['label'], i + 1, len(remaining_units))
+                    if unit_results is not None:
+                        batch['units'].append((unit, len(unit_results)))
+                    if self.batch_due(batch):
+                        self.close_batch(batch, all_cargos, start_time)
+                        batch = None
+                if batch is not None:
+                    self.close_batch(batch, all_cargos, start_time)
         
-        self.should_stop = True
+        finally:
+            # 중단되더라도 버퍼에 남은 행을 확정
+            self.writer.close()
+        
+        # 끝난 작업 단위의 바뀐 단계만 다시 생성 (실패하면 기존 결과와 지문을 남겨 다음 실행에서 재시도)
+        # 이번 실행에서 새 프롬프트로 생성된 단계는 지문이 이미 갱신되어 있음
+        recorded = self.ledger.stage_fingerprints()
+        changed = {key: target for key, target in changed.items()
+                   if all(member in self.processed_cargos for member in target['members'])
+                   and any(recorded.get((member, key[1])) != self.stage_fingerprints[key]
+                           for member in target['members'])}
+        if changed and not self.should_stop:
+            print(f"\n♻️ 입력/프롬프트가 바뀐 {len(changed)}개 (작업 단위, 단계) 다시 생성")
+            fallback_rows = self.stage_fallback_rows()
+            replaced, kept = self.regenerate_stages(changed, lambda target, rows: stage_rows_problem(
+                target['stage'], rows, fallback_rows[target['stage']], self.medicine_matcher) in (None, 'short'))
+            print(f"♻️ 교체 {replaced}개 (화물, 단계)" + (f" | 실패로 기존 결과 유지 {kept}개" if kept else ""))
+        
+        self.supervisor.shutdown()
+        latency = self.supervisor.latency_stats()
+        if latency['count']:
+            print(f"\n⏱️ 모델 호출 지연: {latency['count']}회 | p50 {latency['p50']:.1f}초 | "
+                  f"p90 {latency['p90']:.1f}초 | p99 {latency['p99']:.1f}초 | 최대 {latency['max']:.1f}초 | "
+                  f"타임아웃 {latency['timeouts']}회 | 호출 풀 재시작 {latency['restarts']}회")
         
-        if not self.should_stop:
+        self.print_metrics_summary()
+        
+        if self.pack_stats['requests']:
+            print(f"\n📦 묶음 요청: {self.pack_stats['requests']}회 ({self.pack_stats['cargos']}개 (화물, 단계)) | "
+                  f"단독 재요청 {self.pack_stats['missing']}개")
+        
+        prompt_stats = self.prompt_stats
+        if prompt_stats['calls']:
+            line = f"\n🧱 입력 토큰: {prompt_stats['calls']}회 호출 | 입력 {prompt_stats['input_tokens']:,} 토큰 | " \
+                   f"캐시된 입력 {prompt_stats['cached_tokens']:,} 토큰 절약"
+            if self.prefix_cache:
+                line += f" | 고정 지시문 {prompt_stats['static_tokens']:,} 토큰 (추정)"
+            print(line)
+        
+        if self.response_cache:
+            stats = self.response_cache.stats()
+            print(f"\n💾 응답 캐시: 적중 {stats['hits']}회 / 미스 {stats['misses']}회 "
+                  f"(적중률 {stats['hit_rate']*100:.1f}%, 삭제 {stats['evictions']}건, "
+                  f"{stats['bytes']/1024**2:.1f}MB)")
+        
+        self.should_stop = True  # 워치독 종료
+        
+        # 완료 여부는 진행 기록 기준 (중단되었거나 실패한 단계가 남은 화물은 다음 실행에서 이어서 처리)
+        processed_cargos = self.ledger.processed_cargos()
+        remaining_cargos = [cargo for cargo in all_cargos if cargo not in processed_cargos]
+        if not remaining_cargos:
             print(f"\n🎉 분석 완료!")
         else:
-            print(f"\n⏸️  분석 일시 중단 (재시작 가능)")
+            print(f"\n⏸️  분석 일시 중단 (재시작 가능) - 남은 화물 {len(remaining_cargos)}개")
+
+    def run_repair(self):
+        """진행 기록에서 오류 / 대체 데이터 / 비치 목록 밖 의약품 / 최소 항목 수 미달 (화물, 단계)만 다시 요청해 제자리 교체"""
+        print("="*100)
+        print("🩹 REPAIR: 오류/대체 데이터/항목 부족 단계만 다시 요청")
+        print("="*100)
+        
+        if not self.open_ledger():
+            return
+        all_cargos, work_units = self.plan_run()
+        member_labels = {member: unit['label'] for unit in work_units for member in unit['members']}
+        stages = {stage[2]: stage for stage in STAGES}
+        fallback_rows = self.stage_fallback_rows()
+        
+        # 복구 대상 찾기: (작업 단위 라벨, Stage) → 문제, 기존 행 수, 해당 화물
+        targets = {}
+        
+        def add_target(cargo, stage_key, problem, row_count):
+            target = targets.setdefault((member_labels[cargo], stage_key),
+                                        {'members': [], 'problem': problem, 'rows': row_count})
+            target['members'].append(cargo)
+        
+        recorded = {}
+        unchecked = 0
+        for cargo, stage_key, rows in self.ledger.stage_rows():
+            if cargo not in member_labels or stage_key not in stages:
+                continue
+            recorded.setdefault(cargo, set()).add(stage_key)
+            if rows is None:
+                unchecked += 1  # 배치 CSV에서 가져와 행 내용이 없는 단계
+                continue
+            problem = stage_rows_problem(stage_key, rows, fallback_rows[stage_key], self.medicine_matcher)
+            if problem:
+                add_target(cargo, stage_key, problem, len(rows))
+        
+        # 완료로 기록됐지만 단계 결과가 없는 경우 (배치 CSV에 행이 하나도 없던 단계)
+        for cargo in self.ledger.processed_cargos():
+            if cargo in member_labels:
+                for stage_key in stages:
+                    if stage_key not in recorded.get(cargo, ()):
+                        add_target(cargo, stage_key, 'missing', 0)
+        
+        problem_counts = {}
+        for (_, stage_key), target in targets.items():
+            problem_counts[target['problem']] = problem_counts.get(target['problem'], 0) + 1
+        print(f"📋 복구 대상: {len(targets)}개 (작업 단위, 단계) / 화물 행 {sum(len(t['members']) for t in targets.values())}개")
+        for problem, count in sorted(problem_counts.items()):
+            print(f"  - {problem}: {count}개")
+        if unchecked:
+            print(f"  - 행 내용 없이 가져온 단계 {unchecked}개는 검사하지 못함")
+        if not targets:
+            print("✅ 복구할 단계 없음")
+            return
+        
+        # 캐시에 남은 짧은 응답을 그대로 재생하지 않도록 모두 새로 요청
+        self.refresh_cache = True
+        self.current_batch = self.ledger.last_batch()
+        self.start_watchdog()
+        
+        def improved(target, rows):
+            problem = stage_rows_problem(target['stage'], rows, fallback_rows[target['stage']], self.medicine_matcher)
+            return problem is None or (problem == 'short' and
+                                       (target['problem'] != 'short' or len(rows) > target['rows']))
+        
+        replaced, still_failing = self.regenerate_stages(targets, improved)
+        
+        self.supervisor.shutdown()
+        self.print_metrics_summary()
+        print(f"\n🩹 복구 완료: {replaced}개 (화물, 단계) 교체 → "
+              f"{self.writer_options.get('path', 'maximum_data_results.csv')}")
+        if still_failing:
+            print(f"⚠️ 아직 문제 있는 단계 {still_failing}개 - 다시 --repair로 재시도")
+    
+    def stage_fallback_rows(self):
+        """단계별 대체 데이터 행 {Stage: [[Category, Description, Detail1-3], ...]} (stage_rows_problem 비교용)"""
+        return {stage_key: [list(row) for row in parse_stage_rows(
+                    self.generate_fallback_data(None, stage_name), stage_key)]
+                for stage_name, _, stage_key in STAGES}
+    
+    def regenerate_stages(self, targets, accept):
+        """(작업 단위 라벨, Stage) 대상을 다시 생성해 진행 기록과 출력 파일(제자리 교체)에 반영
+        
+        targets: {(라벨, Stage): {'members': [...], 'problem': ..., ...}}
+        accept(대상, 행 목록)가 참인 결과만 반영한다. → (교체한 (화물, 단계) 수, 반영하지 못한 대상 수)
+        """
+        stages = {stage[2]: stage for stage in STAGES}
+        results = {}
+        if self.max_workers > 1:
+            self.executor = ThreadPoolExecutor(max_workers=self.max_workers)
+            futures = {self.executor.submit(self.generate_stage, label, stages[stage_key]): (label, stage_key)
+                       for label, stage_key in targets}
+            for future in as_completed(futures):
+                try:
+                    results[futures[future]], _ = future.result()
+                except CallShutdown:
+                    pass  # 종료 중 - 기존 결과 유지
+                except Exception as e:
+                    print(f"    ⚠️ {futures[future][0]} / {futures[future][1]} 작업 오류: {e}")
+                self.update_activity()
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+        else:
+            for i, (label, stage_key) in enumerate(targets, 1):
+                if self.should_stop:
+                    break
+                print(f"\n[{i}/{len(targets)}] {label} ({targets[(label, stage_key)]['problem']})")
+                try:
+                    results[(label, stage_key)], _ = self.generate_stage(label, stages[stage_key])
+                except CallShutdown:
+                    break
+        
+        replacements = {}
+        rejected = 0
+        for (label, stage_key), stage_results in results.items():
+            target = dict(targets[(label, stage_key)], stage=stage_key)
+            rows = [list(row.values) for row in stage_results]
+            if not accept(target, rows):
+                rejected += 1
+                continue
+            self.ledger.record_stage(target['members'], stage_key, self.current_batch, stage_results,
+                                     self.stage_fingerprints.get((label, stage_key)))
+            for member in target['members']:
+                replacements[(member, stage_key)] = [row.with_cargo(member) for row in stage_results]
+        
+        if replacements:
+            path = self.writer_options.get('path', 'maximum_data_results.csv')
+            written = replace_result_blocks(path, replacements, self.writer_options.get('output_format'))
+            # 파일을 다시 썼으므로 확정 위치도 새 끝으로 갱신
+            self.ledger.mark_written(written, (path, *output_end_position(path)))
+            return len(written), rejected + len(targets) - len(results)
+        return 0, rejected + len(targets) - len(results)
+
+def parse_args():
+    """명령행 옵션 파싱"""
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="AUTO-RESTART MAXIMUM DATA EXTRACTION")
+    parser.add_argument("--cargo-list", default="cargolist.csv",
+                        help="화물 리스트 CSV 경로 (기본 cargolist.csv)")
+    parser.add_argument("--backend", choices=["gemini", "fake"], default="gemini",
+                        help="모델 백엔드 (fake = API 호출 없는 오프라인 가짜 모델)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="동시에 실행할 최대 API 요청 수 (기본 1 = 직렬 모드)")
+    parser.add_argument("--rpm", type=float, default=60,
+                        help="분당 최대 요청 수 (기본 60, 0 = 제한 없음)")
+    parser.add_argument("--tpm", type=float, default=None,
+                        help="분당 최대 토큰 수 (기본: 제한 없음)")
+    parser.add_argument("--no-dedup", action="store_true",
+                        help="같은 물질명 + Guide_No 화물을 묶지 않고 행마다 모델 호출")
+    parser.add_argument("--guide-shared", action="store_true",
+                        help="Guide_No 공유 단계(기본: 선박 의약품 가이드라인)를 가이드마다 한 번만 생성")
+    parser.add_argument("--guide-stages", default=None,
+                        help="Guide_No마다 생성할 단계 Stage 값 목록 (쉼표 구분, --guide-shared 기본 정책 대체)")
+    parser.add_argument("--cache-path", default="response_cache.sqlite3",
+                        help="모델 응답 디스크 캐시 경로 (기본 response_cache.sqlite3)")
+    parser.add_argument("--cache-max-mb", type=float, default=2048,
+                        help="응답 캐시 최대 크기 MB, 초과 시 오래된 응답부터 삭제 (기본 2048)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="응답 캐시 사용 안 함")
+    parser.add_argument("--structured-output", action="store_true",
+                        help="단계별 JSON 응답 스키마로 요청하고 검증 (스키마 불일치 응답만 재요청)")
+    parser.add_argument("--prefix-cache", action="store_true",
+                        help="단계별 고정 지시문을 system instruction(Gemini 컨텍스트 캐시)으로 분리해 화물별 입력만 전송")
+    parser.add_argument("--context-cache-ttl", type=int, default=3600,
+                        help="Gemini 컨텍스트 캐시 유지 시간 (초, 기본 3600)")
+    parser.add_argument("--pack", type=int, default=1,
+                        help="단계 요청 하나에 묶을 최대 화물 수 (같은 Guide_No끼리, 기본 1 = 묶지 않음)")
+    parser.add_argument("--max-output-tokens", type=int, default=65536,
+                        help="모델 출력 토큰 한도 (묶음 크기 계산용, 기본 65536)")
+    parser.add_argument("--stream", action="store_true",
+                        help="응답을 스트리밍으로 받아 완성된 줄부터 파싱하고 멈춘/형식이 깨진 생성을 일찍 중단 후 재요청")
+    parser.add_argument("--stall-timeout", type=float, default=30.0,
+                        help="스트리밍 중 청크 사이 최대 대기 시간 (초, 기본 30)")
+    parser.add_argument("--priority", default="file",
+                        help="작업 단위 처리 순서 기준 (쉼표 구분, 앞 기준 우선): hazard = 가이드 위험 등급, "
+                             "partial = 이어서 할 단계가 있는 화물, file = 화물 리스트 순서 (기본 file)")
+    parser.add_argument("--batch-size", type=int, default=10,
+                        help="끝난 작업 단위가 이 개수가 되면 배치 확정 (기본 10)")
+    parser.add_argument("--batch-seconds", type=float, default=60.0,
+                        help="배치를 연 뒤 이 시간(초)이 지나면 크기와 관계없이 확정 (기본 60, 0 = 크기만)")
+    parser.add_argument("--call-timeout", type=float, default=120.0,
+                        help="모델 호출별 제한 시간 (초, 기본 120) - 초과한 요청만 포기하고 재시도")
+    parser.add_argument("--output", default="maximum_data_results.csv",
+                        help="결과 출력 파일 (.csv, .jsonl 또는 사전 인코딩 .djsonl, 실행마다 이어 씀)")
+    parser.add_argument("--flush-interval", type=float, default=5.0,
+                        help="출력 파일 fsync 간격 (초, 기본 5)")
+    parser.add_argument("--output-max-mb", type=float, default=None,
+                        help="출력 파일이 이 크기를 넘으면 다음 파트 파일로 넘어감 (기본: 단일 파일)")
+    parser.add_argument("--shard", default=None,
+                        help="i/N: 화물 리스트를 N개로 나눈 i번째 샤드만 처리 (출력/진행 기록/캐시 파일에 샤드 접미사)")
+    parser.add_argument("--merge-shards", action="store_true",
+                        help="--output 기준 샤드 출력 파일들을 하나의 중복 없는 결과로 병합하고 종료")
+    parser.add_argument("--metrics-file", default=None,
+                        help="호출/단계/화물 지표를 JSONL로 기록할 경로")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="Prometheus 형식 지표 HTTP 포트 (127.0.0.1:PORT/metrics)")
+    parser.add_argument("--repair", action="store_true",
+                        help="진행 기록에서 오류/대체 데이터/최소 항목 수 미달 단계만 다시 요청해 출력 파일에서 교체")
+    parser.add_argument("--plan", action="store_true",
+                        help="모델을 호출하지 않고 새로 생성 / 입력·프롬프트 변경으로 재생성할 단계와 예상 요청 수만 출력")
+    parser.add_argument("--medicine-file", default=str(DEFAULT_MEDICINE_PATH),
+                        help="선박 의약품 비치 기준 파일 (기본: 스크립트 폴더의 medi_inventory.json)")
+    parser.add_argument("--medicine-check", action="store_true",
+                        help="선박 의약품 가이드라인 행을 비치 목록과 대조 (목록 밖 의약품은 재요청 후 표시)")
+    parser.add_argument("--max-medicine-retries", type=int, default=2,
+                        help="비치 목록 밖 의약품이 나온 응답 재요청 횟수 (기본 2)")
+    parser.add_argument("--show-medicines", action="store_true",
+                        help="비치 기준 파일에서 읽은 의약품 목록을 출력하고 종료")
+    parser.add_argument("--ledger-path", default=str(DEFAULT_LEDGER_PATH),
+                        help="진행 기록 SQLite 경로 (기본: 스크립트 폴더의 analysis_progress.sqlite3)")
+    return parser.parse_args()
 
 def main():
+    args = parse_args()
+    analyzer = None
+    
     def signal_handler(signum, frame):
-        print(f"\n💡 신호 {signum} 받음 - 정상 종료 중...")
-        exit(0)
+        # 분석 중이면 새 작업 배정만 멈추고 진행 중인 단계와 작업 스레드가 끝난 뒤 종료 (두 번째 신호는 즉시 중단)
+        if analyzer is None:
+            print(f"\n💡 신호 {signum} 받음 - 정상 종료 중...")
+            exit(0)
+        if analyzer.should_stop:
+            raise KeyboardInterrupt
+        print(f"\n💡 신호 {signum} 받음 - 진행 중인 단계를 마치고 종료합니다 (한 번 더 보내면 즉시 중단)")
+        analyzer.request_stop()
     
     signal.signal(signal.SIGTERM, signal_handler)
     signal.signal(signal.SIGINT, signal_handler)
     
-    analyzer = AutoRestartAnalyzer()
+    if args.merge_shards:
+        cargo_order = AutoRestartAnalyzer(cargo_list_path=args.cargo_list).load_cargo_list()
+        try:
+            summary = merge_shard_outputs(args.output, cargo_order)
+        except (FileNotFoundError, ValueError) as e:
+            print(f"❌ {e}")
+            exit(1)
+        print(f"🧩 샤드 {summary['shards']}개 ({summary['files']}개 파일) 병합 → {args.output}: "
+              f"{summary['rows']}행, 화물 {summary['cargos']}개, 중복 블록 {summary['duplicates']}개 제외")
+        if summary['missing_shards']:
+            print(f"⚠️ 출력 파일이 없는 샤드: {', '.join(map(str, summary['missing_shards']))}")
+        if summary['missing_cargos']:
+            print(f"⚠️ 결과가 없는 화물: {len(summary['missing_cargos'])}개")
+        return
+    
+    if args.show_medicines:
+        try:
+            inventory = load_medicine_inventory(args.medicine_file)
+        except (OSError, ValueError) as e:
+            print(f"❌ 비치 기준 파일을 읽지 못함: {e}")
+            exit(1)
+        for entry in inventory:
+            quantity = ""
+            if entry['international']:
+                quantity = f"국제선 {entry['international']}" + (
+                    f", 국내선 {entry['domestic']}" if entry['domestic'] else "")
+                quantity += f" × {'⋆' if entry['minimal'] else ''}{entry['unit']}"
+            print(f"{entry['section']} | {entry['category']} | {', '.join(entry['generic'])} | "
+                  f"{', '.join(entry['brands'])} | {quantity}")
+        print(f"💊 {len(inventory)}개 항목")
+        return
+    
+    medicine_matcher = None
+    if args.medicine_check:
+        try:
+            medicine_matcher = build_medicine_matcher(args.medicine_file)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ 비치 기준 파일을 읽지 못해 의약품 검사 없이 진행: {e}")
+    
+    shard = None
+    if args.shard:
+        try:
+            shard = parse_shard(args.shard)
+        except ValueError as e:
+            print(f"❌ {e}")
+            exit(1)
+        # 샤드마다 출력, 진행 기록, 응답 캐시를 따로 써서 프로세스/호스트끼리 경합하지 않게 함
+        args.output = str(shard_path(args.output, shard))
+        args.ledger_path = str(shard_path(args.ledger_path, shard))
+        args.cache_path = str(shard_path(args.cache_path, shard))
+        if args.metrics_file:
+            args.metrics_file = str(shard_path(args.metrics_file, shard))
+    
+    try:
+        priority = parse_priority(args.priority)
+    except ValueError as e:
+        print(f"❌ {e}")
+        exit(1)
+    
+    stage_policy = None
+    if args.guide_stages:
+        guide_stages = {name.strip() for name in args.guide_stages.split(",") if name.strip()}
+        unknown = guide_stages - set(DEFAULT_STAGE_POLICY)
+        if unknown:
+            print(f"❌ 알 수 없는 단계: {', '.join(sorted(unknown))}")
+            exit(1)
+        stage_policy = {key: ("guide" if key in guide_stages else "material") for key in DEFAULT_STAGE_POLICY}
+    elif args.guide_shared:
+        stage_policy = dict(DEFAULT_STAGE_POLICY)
+    
+    response_cache = None
+    if not args.no_cache:
+        response_cache = ResponseCache(args.cache_path, max_bytes=int(args.cache_max_mb * 1024**2))
+    
+    if args.backend == "fake":
+        from fake_backend import FakeModelProvider
+        
+        model = FakeModelProvider()
+    else:
+        model = GeminiProvider(context_cache=args.prefix_cache, cache_ttl=args.context_cache_ttl)
+        try:
+            if not args.plan:  # 계획만 출력할 때는 API 키가 필요 없음
+                model.check_api_key()
+        except MissingApiKeyError as e:
+            print(e)
+            exit(1)
+    
+    metrics = MetricsRecorder(args.metrics_file)
+    if args.metrics_port:
+        host, port = metrics.start_server(args.metrics_port)
+        print(f"📈 지표 엔드포인트: http://{host}:{port}/metrics")
+    
+    analyzer = AutoRestartAnalyzer(
+        model=model,
+        metrics=metrics,
+        max_workers=args.workers,
+        rate_limiter=RateLimiter(rpm=args.rpm, tpm=args.tpm),
+        dedupe=not args.no_dedup,
+        stage_policy=stage_policy,
+        response_cache=response_cache,
+        ledger=ProgressLedger(args.ledger_path, read_only=args.plan),  # --plan은 기록 파일을 바꾸지 않음
+        call_timeout=args.call_timeout,
+        cargo_list_path=args.cargo_list,
+        structured_output=args.structured_output,
+        prefix_cache=args.prefix_cache,
+        pack_sizer=PackSizer(args.pack, args.max_output_tokens) if args.pack > 1 else None,
+        shard=shard,
+        plan_only=args.plan,
+        stream=args.stream,
+        stall_timeout=args.stall_timeout,
+        priority=priority,
+        batch_size=args.batch_size,
+        batch_seconds=args.batch_seconds,
+        medicine_matcher=medicine_matcher,
+        max_medicine_retries=args.max_medicine_retries,
+        writer_options={
+            'path': args.output,
+            'flush_interval': args.flush_interval,
+            'rollover_bytes': int(args.output_max_mb * 1024**2) if args.output_max_mb else None,
+        },
+    )
     
     try:
-        analyzer.run_analysis()
+        if args.repair:
+            analyzer.run_repair()
+        else:
+            analyzer.run_analysis()
     except KeyboardInterrupt:
         print("\n⚠️ 사용자에 의해 중단됨")
     except Exception as e:
         print(f"\n❌ 오류 발생: {e}")
         print("🔄 재시작하면 중단된 지점부터 계속됩니다")
+    finally:
+        model.close()
+        metrics.close()
+        if analyzer.ledger is not None:
+            analyzer.ledger.close()
+        if response_cache is not None:
+            response_cache.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
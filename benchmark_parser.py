@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+
+"""
+PARSER MICRO-BENCHMARK
+parse_stage_data / parse_stage_rows와 이전 파서의 결과 일치 여부와 속도 비교
+
+응답 코퍼스는 가짜 모델 응답 + 형식이 깨진 변형으로 만들고, --cache를 주면
+응답 캐시(response_cache.sqlite3)에 저장된 실제 응답도 함께 사용한다.
+
+예:
+    python benchmark_parser.py --cargos 200 --repeat 5
+    python benchmark_parser.py --cache response_cache.sqlite3
+"""
+
+import sys
+import time
+import random
+import sqlite3
+import argparse
+from pathlib import Path
+
+from auto_restart_analysis import AutoRestartAnalyzer, STAGES, RESULT_FIELDS, parse_stage_rows, shared_stage_rows
+from fake_backend import FakeModelProvider
+
+BASE_DIR = Path(__file__).resolve().parent
+
+def legacy_parse_stage_data(cargo, stage_data, stage_name):
+    """이전 버전 parse_stage_data (비교 기준)"""
+    results = []
+
+    if not stage_data:
+        return results
+
+    lines = stage_data.split('\n')
+    for line in lines:
+        line = line.strip()
+        if '|' in line and len(line) > 20:
+            parts = [p.strip() for p in line.split('|')]
+            if len(parts) >= 3:
+                results.append({
+                    'Cargo': cargo,
+                    'Stage': stage_name,
+                    'Category': parts[0] if len(parts) > 0 else '',
+                    'Description': parts[1] if len(parts) > 1 else '',
+                    'Detail1': parts[2] if len(parts) > 2 else '',
+                    'Detail2': parts[3] if len(parts) > 3 else '',
+                    'Detail3': parts[4] if len(parts) > 4 else ''
+                })
+
+    # 백업 파싱
+    if not results:
+        sentences = [s.strip() for s in stage_data.replace('\n', '. ').split('.')]
+        relevant_sentences = [s for s in sentences if len(s) > 30 and
+                            any(keyword in s.lower() for keyword in
+                            ['risk', 'toxic', 'hazard', 'treat', 'procedure', 'data', 'effect'])]
+
+        for i, sentence in enumerate(relevant_sentences[:10]):
+            results.append({
+                'Cargo': cargo,
+                'Stage': stage_name,
+                'Category': f'{stage_name} Item {i+1}',
+                'Description': sentence,
+                'Detail1': '',
+                'Detail2': '',
+                'Detail3': ''
+            })
+
+    return results
+
+def mutate(text, rng):
+    """형식이 깨진 응답 변형 (공백/줄바꿈/구분자/문장형 응답)"""
+    kind = rng.randrange(7)
+    if kind == 0:
+        return text.replace('\n', '\r\n')
+    if kind == 1:
+        return text.replace('|', ' | ').replace('\n', '  \n\t')
+    if kind == 2:
+        return text.replace('|', ' |　')
+    if kind == 3:
+        # 파이프 없이 문장으로만 답한 경우 (백업 파싱 경로)
+        return text.replace('|', ', ').replace('\n', '. ')
+    if kind == 4:
+        return "\n".join(line[:25] for line in text.split('\n'))
+    if kind == 5:
+        return text.replace('|', '||', 3)
+    return "|a|b|\n" + text + "\n| | | | | | | | |\n"
+
+def build_corpus(cargos, cache_path, seed):
+    """(stage_name, 응답 텍스트) 코퍼스 생성"""
+    rng = random.Random(seed)
+    analyzer = AutoRestartAnalyzer(model=FakeModelProvider(seed=seed))
+    model = analyzer.model
+
+    # 실제 단계 프롬프트로 가짜 응답 생성 (API 호출 없음)
+    captured = []
+    analyzer.extract_stage_data = lambda cargo, stage_name, prompt: captured.append(prompt) or ""
+    with open(BASE_DIR / 'cargolist.csv', 'r', encoding='utf-8') as f:
+        names = [line.split(',', 2)[-1].strip() for line in f][1:cargos + 1]
+    corpus = []
+    for name in names:
+        for _, func_name, stage_key in STAGES:
+            getattr(analyzer, func_name)(name)
+            text = model.render(captured.pop())
+            corpus.append((stage_key, text))
+            corpus.append((stage_key, mutate(text, rng)))
+
+    if cache_path:
+        conn = sqlite3.connect(cache_path)
+        for (text,) in conn.execute("SELECT text FROM responses"):
+            corpus.append(("Cached", text))
+        conn.close()
+    return corpus
+
+def time_parser(parse, corpus, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for stage_key, text in corpus:
+            parse("Cargo", text, stage_key)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description="parse_stage_data 마이크로 벤치마크")
+    parser.add_argument("--cargos", type=int, default=200, help="코퍼스에 쓸 화물 수")
+    parser.add_argument("--cache", default=None, help="응답 캐시 SQLite 경로 (실제 응답 포함)")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    corpus = build_corpus(args.cargos, args.cache, args.seed)
+    analyzer = AutoRestartAnalyzer(model=FakeModelProvider())
+
+    # 행 단위 일치 확인
+    mismatches = 0
+    total_rows = 0
+    for stage_key, text in corpus:
+        expected = legacy_parse_stage_data("Cargo", text, stage_key)
+        actual = [dict(row) for row in analyzer.parse_stage_data("Cargo", text, stage_key)]
+        compact = [{'Cargo': "Cargo", 'Stage': stage_key, **dict(zip(RESULT_FIELDS, row))}
+                   for row in parse_stage_rows(text, stage_key)]
+        total_rows += len(expected)
+        if expected != actual or expected != compact:
+            mismatches += 1
+            if mismatches <= 3:
+                print(f"❌ 불일치 ({stage_key}): {text[:80]!r}")
+
+    megabytes = sum(len(text.encode('utf-8')) for _, text in corpus) / 1024**2
+    legacy = time_parser(legacy_parse_stage_data, corpus, args.repeat)
+    def uncached_parse_stage_data(cargo, text, stage_key):
+        shared_stage_rows.cache_clear()  # 같은 텍스트 재파싱 캐시 없이 파싱 비용만 측정
+        return analyzer.parse_stage_data(cargo, text, stage_key)
+
+    current = time_parser(uncached_parse_stage_data, corpus, args.repeat)
+    compact = time_parser(lambda cargo, text, stage_key: parse_stage_rows(text, stage_key), corpus, args.repeat)
+
+    print(f"📄 응답 {len(corpus)}개 ({megabytes:.1f}MB), 행 {total_rows}개")
+    print(f"{'일치' if not mismatches else '불일치'}: {len(corpus) - mismatches}/{len(corpus)}")
+    print(f"이전 파서: {legacy*1000:8.1f}ms ({megabytes / legacy:6.1f}MB/s)")
+    print(f"현재 파서: {current*1000:8.1f}ms ({megabytes / current:6.1f}MB/s)  x{legacy / current:.2f}")
+    print(f"튜플 행:   {compact*1000:8.1f}ms ({megabytes / compact:6.1f}MB/s)  x{legacy / compact:.2f}")
+    sys.exit(1 if mismatches else 0)
+
+if __name__ == "__main__":
+    main()
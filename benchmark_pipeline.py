@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+
+"""
+PIPELINE THROUGHPUT BENCHMARK
+가짜 모델 백엔드(fake_backend)로 API 호출 없이 전체 cargolist.csv 처리 성능 측정
+
+측정 항목: 화물/분, 단계/초, 단계 지연 p50/p99, 첫 행까지 평균 시간, 최대 RSS
+설정마다 별도 프로세스에서 실행해 RSS가 서로 섞이지 않게 한다.
+
+예:
+    python benchmark_pipeline.py --workers 1,8,32 --latency 0.02
+    python benchmark_pipeline.py --rows 500 --error-rate 0.02 --empty-rate 0.01 --hang-rate 0.001 --call-timeout 2
+    python benchmark_pipeline.py --rows 200 --stream --repeat-rate 0.05 --stall-rate 0.02 --hang-seconds 5
+    python benchmark_pipeline.py --rows 200 --medicine-check --unlisted-medicine-rate 0.1
+"""
+
+import io
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+import threading
+import subprocess
+import contextlib
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+def peak_rss_mb():
+    """현재 프로세스 최대 RSS (MB, Linux는 KB 단위 / macOS는 바이트 단위)"""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024**2 if sys.platform == 'darwin' else rss / 1024
+
+def run_single(config):
+    """설정 하나를 현재 프로세스에서 실행하고 결과 dict 반환"""
+    from auto_restart_analysis import AutoRestartAnalyzer, RateLimiter, ProgressLedger, PackSizer, build_medicine_matcher
+    from fake_backend import FakeModelProvider
+
+    work_dir = Path(tempfile.mkdtemp(prefix='pipeline_bench_'))
+    try:
+        cargo_list = work_dir / 'cargolist.csv'
+        with open(config['cargo_list'], 'r', encoding='utf-8') as src, open(cargo_list, 'w', encoding='utf-8') as dst:
+            for i, line in enumerate(src):
+                if config['rows'] and i > config['rows']:
+                    break
+                dst.write(line)
+
+        model = FakeModelProvider(
+            latency=config['latency'],
+            error_rate=config['error_rate'],
+            rate_limit_rate=config['rate_limit_rate'],
+            empty_rate=config['empty_rate'],
+            hang_rate=config['hang_rate'],
+            hang_seconds=config['hang_seconds'],
+            invalid_json_rate=config['invalid_json_rate'],
+            pack_drop_rate=config['pack_drop_rate'],
+            repeat_rate=config['repeat_rate'],
+            stall_rate=config['stall_rate'],
+            unlisted_medicine_rate=config['unlisted_medicine_rate'],
+            seed=config['seed'],
+        )
+        analyzer = AutoRestartAnalyzer(
+            model=model,
+            max_workers=config['workers'],
+            rate_limiter=RateLimiter(rpm=config['rpm'], tpm=config['tpm'], base_backoff=0.05, max_backoff=1.0),
+            dedupe=not config['no_dedup'],
+            ledger=ProgressLedger(work_dir / 'progress.sqlite3'),
+            call_timeout=config['call_timeout'],
+            cargo_list_path=str(cargo_list),
+            structured_output=config['structured_output'],
+            prefix_cache=config['prefix_cache'],
+            pack_sizer=PackSizer(config['pack']) if config['pack'] > 1 else None,
+            stream=config['stream'],
+            stall_timeout=config['stall_timeout'],
+            medicine_matcher=build_medicine_matcher() if config['medicine_check'] else None,
+            writer_options={'path': str(work_dir / 'results.csv')},
+        )
+
+        # 단계별 지연 측정
+        stage_latencies = []
+        latency_lock = threading.Lock()
+        run_stage = analyzer.run_stage
+
+        def timed_run_stage(cargo, stage):
+            start = time.perf_counter()
+            result = run_stage(cargo, stage)
+            with latency_lock:
+                stage_latencies.append(time.perf_counter() - start)
+            return result
+
+        analyzer.run_stage = timed_run_stage
+
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            analyzer.run_analysis()
+        elapsed = time.perf_counter() - start
+
+        cargos = len(analyzer.processed_cargos)
+        summary = analyzer.metrics.stage_summary().values()
+        first_row_calls = sum(entry['first_row_calls'] for entry in summary)
+        output_rows = sum(1 for _ in open(work_dir / 'results.csv', encoding='utf-8-sig')) - 1
+        return {
+            'workers': config['workers'],
+            'rows': config['rows'] or 'all',
+            'cargos': cargos,
+            'stages': len(stage_latencies),
+            'model_calls': model.calls,
+            'injected': model.injected,
+            'output_rows': output_rows,
+            'input_tokens': analyzer.prompt_stats['input_tokens'],
+            'cached_tokens': analyzer.prompt_stats['cached_tokens'],
+            'elapsed_s': elapsed,
+            'cargos_per_min': cargos / elapsed * 60 if elapsed else 0.0,
+            'stages_per_s': len(stage_latencies) / elapsed if elapsed else 0.0,
+            'stage_p50_s': percentile(stage_latencies, 0.50),
+            'stage_p99_s': percentile(stage_latencies, 0.99),
+            'first_row_s': sum(entry['first_row_s'] for entry in summary) / first_row_calls if first_row_calls else 0.0,
+            'peak_rss_mb': peak_rss_mb(),
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def print_table(results):
+    header = f"{'workers':>7} {'cargos':>7} {'stages':>7} {'calls':>7} {'elapsed':>9} {'cargo/min':>10} " \
+             f"{'stage/s':>8} {'p50(ms)':>8} {'p99(ms)':>8} {'1st(ms)':>8} {'RSS(MB)':>8}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(f"{r['workers']:>7} {r['cargos']:>7} {r['stages']:>7} {r['model_calls']:>7} "
+              f"{r['elapsed_s']:>8.1f}s {r['cargos_per_min']:>10.0f} {r['stages_per_s']:>8.1f} "
+              f"{r['stage_p50_s']*1000:>8.1f} {r['stage_p99_s']*1000:>8.1f} {r['first_row_s']*1000:>8.1f} "
+              f"{r['peak_rss_mb']:>8.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="가짜 모델 백엔드 기반 파이프라인 처리량 벤치마크")
+    parser.add_argument("--cargo-list", default=str(BASE_DIR / 'cargolist.csv'))
+    parser.add_argument("--rows", type=int, default=0, help="사용할 화물 행 수 (기본 0 = 전체)")
+    parser.add_argument("--workers", default="1,8,32", help="비교할 워커 수 목록 (쉼표 구분)")
+    parser.add_argument("--latency", type=float, default=0.02, help="가짜 모델 지연 중앙값 (초)")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--empty-rate", type=float, default=0.0)
+    parser.add_argument("--hang-rate", type=float, default=0.0)
+    parser.add_argument("--hang-seconds", type=float, default=30.0)
+    parser.add_argument("--invalid-json-rate", type=float, default=0.0)
+    parser.add_argument("--repeat-rate", type=float, default=0.0, help="같은 행을 반복하는 응답 확률")
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="스트리밍 응답이 중간에 멈출 확률")
+    parser.add_argument("--unlisted-medicine-rate", type=float, default=0.0,
+                        help="선박 의약품 응답 한 행에 비치 목록 밖 약을 넣을 확률")
+    parser.add_argument("--medicine-check", action="store_true", help="선박 의약품 행 비치 목록 검사 + 재요청")
+    parser.add_argument("--call-timeout", type=float, default=5.0)
+    parser.add_argument("--stream", action="store_true", help="스트리밍 응답 + 증분 파싱 모드로 실행")
+    parser.add_argument("--stall-timeout", type=float, default=1.0, help="스트리밍 청크 사이 최대 대기 (초)")
+    parser.add_argument("--structured-output", action="store_true", help="JSON 스키마 응답 모드로 실행")
+    parser.add_argument("--prefix-cache", action="store_true", help="고정 지시문을 system instruction으로 분리")
+    parser.add_argument("--pack", type=int, default=1, help="단계 요청 하나에 묶을 최대 화물 수")
+    parser.add_argument("--pack-drop-rate", type=float, default=0.0, help="묶음 응답에서 화물 조각이 빠질 확률")
+    parser.add_argument("--rpm", type=float, default=None, help="분당 요청 제한 (기본: 제한 없음)")
+    parser.add_argument("--tpm", type=float, default=None)
+    parser.add_argument("--no-dedup", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="결과를 JSON으로 출력")
+    parser.add_argument("--single", default=None, help=argparse.SUPPRESS)  # 하위 프로세스용
+    args = parser.parse_args()
+
+    if args.single:
+        print(json.dumps(run_single(json.loads(args.single)), ensure_ascii=False))
+        return
+
+    base_config = {
+        'cargo_list': args.cargo_list,
+        'rows': args.rows,
+        'latency': args.latency,
+        'error_rate': args.error_rate,
+        'rate_limit_rate': args.rate_limit_rate,
+        'empty_rate': args.empty_rate,
+        'hang_rate': args.hang_rate,
+        'hang_seconds': args.hang_seconds,
+        'invalid_json_rate': args.invalid_json_rate,
+        'structured_output': args.structured_output,
+        'prefix_cache': args.prefix_cache,
+        'pack': args.pack,
+        'pack_drop_rate': args.pack_drop_rate,
+        'repeat_rate': args.repeat_rate,
+        'stall_rate': args.stall_rate,
+        'unlisted_medicine_rate': args.unlisted_medicine_rate,
+        'medicine_check': args.medicine_check,
+        'stream': args.stream,
+        'stall_timeout': args.stall_timeout,
+        'call_timeout': args.call_timeout,
+        'rpm': args.rpm,
+        'tpm': args.tpm,
+        'no_dedup': args.no_dedup,
+        'seed': args.seed,
+    }
+
+    results = []
+    for workers in [int(w) for w in args.workers.split(',') if w.strip()]:
+        config = dict(base_config, workers=workers)
+        if not args.json:
+            print(f"⏱️ workers={workers} 실행 중...", file=sys.stderr)
+        output = subprocess.run(
+            [sys.executable, __file__, '--single', json.dumps(config)],
+            cwd=BASE_DIR, capture_output=True, text=True, check=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+    else:
+        print_table(results)
+
+if __name__ == "__main__":
+    main()
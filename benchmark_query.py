@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+
+"""
+OFFLINE QUERY BENCHMARK
+query_results 색인의 생성 시간, 크기, 콜드 스타트, 조회 지연(p50/p99)을 결과 파일 전체 스캔과 비교
+
+--results를 주지 않으면 가짜 모델 백엔드(fake_backend)로 결과 파일을 먼저 만든다.
+콜드 스타트는 매번 새 프로세스에서 모듈 import + 색인 열기 + 첫 조회까지 측정한다 (OS 페이지 캐시는 유지됨).
+
+예:
+    python benchmark_query.py --rows 500
+    python benchmark_query.py --results maximum_data_results*.csv --repeat 100
+"""
+
+import io
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import subprocess
+import contextlib
+from pathlib import Path
+
+from auto_restart_analysis import read_result_rows
+from query_results import ResultStore, build_store
+
+BASE_DIR = Path(__file__).resolve().parent
+
+COLD_START_SNIPPET = """
+import sys, time
+start = time.perf_counter()
+sys.path.insert(0, {base_dir!r})
+from query_results import ResultStore
+store = ResultStore({store!r})
+store.rows([cargo['cargo_id'] for cargo in store.by_id({id_no!r})], stage='2')
+print(time.perf_counter() - start)
+"""
+
+SEARCH_TERMS = ["에피네프린", "decontamination", "respiratory", "아목시실린", "vapor irritation"]
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+def generate_results(work_dir, cargo_list, rows, seed):
+    """가짜 모델로 결과 파일 생성 (API 호출 없음)"""
+    from auto_restart_analysis import AutoRestartAnalyzer, RateLimiter, ProgressLedger
+    from fake_backend import FakeModelProvider
+
+    subset = work_dir / 'cargolist.csv'
+    with open(cargo_list, 'r', encoding='utf-8') as src, open(subset, 'w', encoding='utf-8') as dst:
+        for i, line in enumerate(src):
+            if rows and i > rows:
+                break
+            dst.write(line)
+    analyzer = AutoRestartAnalyzer(
+        model=FakeModelProvider(latency=0, seed=seed),
+        max_workers=8,
+        rate_limiter=RateLimiter(rpm=None),
+        ledger=ProgressLedger(work_dir / 'progress.sqlite3'),
+        cargo_list_path=str(subset),
+        writer_options={'path': str(work_dir / 'maximum_data_results.csv')},
+    )
+    with contextlib.redirect_stdout(io.StringIO()):
+        analyzer.run_analysis()
+    return [work_dir / 'maximum_data_results.csv']
+
+def scan_lookup(paths, cargo_strings, stage):
+    """색인 없이 결과 파일 전체를 읽어 조회 (비교 기준)"""
+    return [row for path in paths for row in read_result_rows(path)
+            if row[0] in cargo_strings and row[1] == stage]
+
+def typo(name, rng):
+    """철자 오류 한 글자 (유사 검색 측정용)"""
+    if len(name) < 4:
+        return name
+    i = rng.randrange(1, len(name) - 1)
+    return name[:i] + name[i + 1:]
+
+def time_queries(queries, repeat):
+    """조회 종류별 [지연 목록]"""
+    timings = {}
+    for kind, query in queries:
+        samples = timings.setdefault(kind, [])
+        for _ in range(repeat):
+            start = time.perf_counter()
+            query()
+            samples.append(time.perf_counter() - start)
+    return timings
+
+def main():
+    parser = argparse.ArgumentParser(description="오프라인 결과 조회 색인 벤치마크")
+    parser.add_argument("--results", nargs="*", default=None, help="색인할 결과 파일들 (기본: 가짜 모델로 생성)")
+    parser.add_argument("--cargo-list", default=str(BASE_DIR / 'cargolist.csv'))
+    parser.add_argument("--rows", type=int, default=500, help="가짜 결과 생성에 쓸 화물 행 수 (0 = 전체)")
+    parser.add_argument("--queries", type=int, default=50, help="종류별 조회 대상 수")
+    parser.add_argument("--repeat", type=int, default=20, help="조회마다 반복 횟수")
+    parser.add_argument("--cold-runs", type=int, default=10, help="콜드 스타트 측정 프로세스 수")
+    parser.add_argument("--scan-runs", type=int, default=3, help="전체 스캔 기준 측정 횟수")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="결과를 JSON으로 출력")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    work_dir = Path(tempfile.mkdtemp(prefix='query_bench_'))
+    try:
+        if args.results:
+            paths = [Path(path) for path in args.results]
+        else:
+            print(f"⏱️ 가짜 결과 생성 중 (화물 {args.rows or '전체'}개)...", file=sys.stderr)
+            paths = generate_results(work_dir, args.cargo_list, args.rows, args.seed)
+        source_bytes = sum(path.stat().st_size for path in paths)
+
+        store_path = work_dir / 'results_index.sqlite3'
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            summary = build_store(store_path, paths, args.cargo_list)
+        build_s = time.perf_counter() - start
+
+        store = ResultStore(store_path)
+        indexed = store.conn.execute("SELECT cargo_id, cargo, id_no, guide_no, name FROM cargos "
+                                     "WHERE cargo_id IN (SELECT DISTINCT cargo_id FROM results)").fetchall()
+        sample = rng.sample(indexed, min(args.queries, len(indexed)))
+        with_id = [cargo for cargo in sample if cargo['id_no']] or sample
+
+        # 콜드 스타트: 새 프로세스 (인터프리터 시작 제외 / 포함)
+        id_no = with_id[0]['id_no']
+        snippet = COLD_START_SNIPPET.format(base_dir=str(BASE_DIR), store=str(store_path), id_no=id_no)
+        cold_inner, cold_wall, bare_wall = [], [], []
+        for _ in range(args.cold_runs):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, '-c', 'pass'], check=True)
+            bare_wall.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            output = subprocess.run([sys.executable, '-c', snippet], capture_output=True, text=True, check=True)
+            cold_wall.append(time.perf_counter() - start)
+            cold_inner.append(float(output.stdout.strip()))
+
+        queries = []
+        for cargo in with_id:
+            queries.append(("id", lambda c=cargo: store.rows([m['cargo_id'] for m in store.by_id(c['id_no'])])))
+            queries.append(("id+stage", lambda c=cargo: store.rows(
+                [m['cargo_id'] for m in store.by_id(c['id_no'])], stage='5')))
+        for cargo in sample:
+            queries.append(("name", lambda c=cargo: store.lookup(name=c['name'])))
+            misspelled = typo(cargo['name'], rng)
+            queries.append(("name~typo", lambda n=misspelled: store.lookup(name=n)))
+            queries.append(("guide+stage", lambda c=cargo: store.lookup(guide_no=c['guide_no'], stage='1')))
+        for term in SEARCH_TERMS:
+            queries.append(("search", lambda t=term: store.search(t, limit=50)))
+        queries.append(("search<3", lambda: store.search("에피", limit=50)))
+        timings = time_queries(queries, args.repeat)
+
+        # 색인 없는 전체 스캔 기준 (결과 파일 CSV 읽기 + 필터)
+        scan = []
+        for cargo in sample[:args.scan_runs]:
+            start = time.perf_counter()
+            scan_lookup(paths, {cargo['cargo']}, 'Emergency Procedures')
+            scan.append(time.perf_counter() - start)
+        pandas_s = None
+        try:
+            import pandas as pd
+        except ImportError:
+            pd = None
+        if pd is not None and all(path.suffix == '.csv' for path in paths):
+            start = time.perf_counter()
+            frame = pd.concat([pd.read_csv(path, encoding='utf-8-sig') for path in paths])
+            frame[(frame['Cargo'] == sample[0]['cargo']) & (frame['Stage'] == 'Emergency Procedures')]
+            pandas_s = time.perf_counter() - start
+        store.close()
+
+        result = {
+            'files': len(paths),
+            'source_mb': source_bytes / 1024**2,
+            'store_mb': summary['bytes'] / 1024**2,
+            'rows': summary['rows'],
+            'cargos': summary['cargos'],
+            'fts_tokenizer': summary['fts_tokenizer'],
+            'build_s': build_s,
+            'python_start_ms': percentile(bare_wall, 0.50) * 1000,
+            'cold_start_ms': percentile(cold_inner, 0.50) * 1000,
+            'cold_process_ms': percentile(cold_wall, 0.50) * 1000,
+            'lookups': {kind: {'p50_ms': percentile(samples, 0.50) * 1000,
+                               'p99_ms': percentile(samples, 0.99) * 1000,
+                               'count': len(samples)}
+                        for kind, samples in timings.items()},
+            'scan_csv_ms': percentile(scan, 0.50) * 1000,
+            'scan_pandas_ms': pandas_s * 1000 if pandas_s is not None else None,
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+        return
+
+    print(f"📄 결과 파일 {result['files']}개 ({result['source_mb']:.1f}MB), 화물 {result['cargos']}개, "
+          f"행 {result['rows']}개")
+    print(f"🏗️ 색인 생성: {result['build_s']:.2f}초, {result['store_mb']:.1f}MB "
+          f"(전문 검색: {result['fts_tokenizer'] or '없음'})")
+    print(f"🧊 콜드 스타트: import + 열기 + 첫 조회 {result['cold_start_ms']:.1f}ms, "
+          f"프로세스 전체 {result['cold_process_ms']:.1f}ms (python 시작만 {result['python_start_ms']:.1f}ms)")
+    print(f"{'query':<12} {'count':>7} {'p50(ms)':>9} {'p99(ms)':>9}")
+    print("-" * 40)
+    for kind, entry in result['lookups'].items():
+        print(f"{kind:<12} {entry['count']:>7} {entry['p50_ms']:>9.2f} {entry['p99_ms']:>9.2f}")
+    print(f"{'scan(csv)':<12} {args.scan_runs:>7} {result['scan_csv_ms']:>9.1f}")
+    if result['scan_pandas_ms'] is not None:
+        print(f"{'scan(pandas)':<12} {1:>7} {result['scan_pandas_ms']:>9.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+
+"""
+RESULT REPRESENTATION BENCHMARK
+결과 행 표현의 메모리 / 파일 크기 / 쓰기·읽기 시간 비교
+    - 이전 경로: 행 dict (legacy parse_stage_data) + pandas DataFrame → CSV
+    - 현재 경로: ResultRow (인턴한 화물/Stage/Category, 같은 응답·작업 단위끼리 내용 튜플 공유)
+      → CSV / JSONL / 사전 인코딩 JSONL(.djsonl)
+
+가짜 모델 백엔드(fake_backend)로 파이프라인을 한 번 실행하면서 단계 응답 텍스트를 모은 뒤,
+같은 응답을 두 경로로 파싱해 tracemalloc으로 결과 행이 차지하는 메모리를 잰다.
+
+예:
+    python benchmark_results.py --rows 500
+    python benchmark_results.py --rows 1000 --guide-shared --empty-rate 0.05
+"""
+
+import io
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import contextlib
+import tracemalloc
+from pathlib import Path
+
+from benchmark_parser import legacy_parse_stage_data
+
+BASE_DIR = Path(__file__).resolve().parent
+
+def capture_stage_data(work_dir, config):
+    """가짜 모델로 파이프라인 실행 → ([(작업 단위 라벨, 응답 텍스트, Stage)], 작업 단위 라벨 → 화물 목록)"""
+    from auto_restart_analysis import AutoRestartAnalyzer, RateLimiter, ProgressLedger, DEFAULT_STAGE_POLICY
+    from fake_backend import FakeModelProvider
+
+    cargo_list = work_dir / 'cargolist.csv'
+    with open(config['cargo_list'], 'r', encoding='utf-8') as src, open(cargo_list, 'w', encoding='utf-8') as dst:
+        for i, line in enumerate(src):
+            if config['rows'] and i > config['rows']:
+                break
+            dst.write(line)
+    analyzer = AutoRestartAnalyzer(
+        model=FakeModelProvider(latency=0, empty_rate=config['empty_rate'], seed=config['seed']),
+        max_workers=8,
+        rate_limiter=RateLimiter(rpm=None),
+        dedupe=not config['no_dedup'],
+        stage_policy=dict(DEFAULT_STAGE_POLICY) if config['guide_shared'] else None,
+        ledger=ProgressLedger(work_dir / 'progress.sqlite3'),
+        cargo_list_path=str(cargo_list),
+        writer_options={'path': str(work_dir / 'capture.csv')},
+    )
+    captured = []
+    parse = analyzer.parse_stage_data
+
+    def capture(cargo, stage_data, stage_name):
+        captured.append((cargo, stage_data, stage_name))
+        return parse(cargo, stage_data, stage_name)
+
+    analyzer.parse_stage_data = capture
+    with contextlib.redirect_stdout(io.StringIO()):
+        analyzer.run_analysis()
+    return captured, dict(analyzer.unit_members)
+
+def build_legacy_rows(captured, members):
+    """이전 경로: 응답마다 행 dict, 작업 단위 화물마다 dict 복사"""
+    rows = []
+    for cargo, stage_data, stage_name in captured:
+        stage_rows = legacy_parse_stage_data(cargo, stage_data, stage_name)
+        unit = members.get(cargo, [cargo])
+        if unit == [cargo]:
+            rows.extend(stage_rows)
+        else:
+            rows.extend(dict(row, Cargo=member) for member in unit for row in stage_rows)
+    return rows
+
+def build_compact_rows(captured, members):
+    """현재 경로: parse_stage_data(ResultRow) + 작업 단위 화물마다 with_cargo"""
+    from auto_restart_analysis import AutoRestartAnalyzer, shared_stage_rows
+
+    shared_stage_rows.cache_clear()
+    parse = AutoRestartAnalyzer.parse_stage_data
+    rows = []
+    for cargo, stage_data, stage_name in captured:
+        stage_rows = parse(None, cargo, stage_data, stage_name)
+        unit = members.get(cargo, [cargo])
+        if unit == [cargo]:
+            rows.extend(stage_rows)
+        else:
+            rows.extend(row.with_cargo(member) for member in unit for row in stage_rows)
+    return rows
+
+def traced(build):
+    """build()가 만든 객체와 그동안 늘어난 추적 메모리(바이트)"""
+    tracemalloc.start()
+    try:
+        start = tracemalloc.get_traced_memory()[0]
+        value = build()
+        return value, tracemalloc.get_traced_memory()[0] - start
+    finally:
+        tracemalloc.stop()
+
+def timed(func):
+    start = time.perf_counter()
+    value = func()
+    return value, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description="결과 행 표현 메모리 / 파일 크기 벤치마크")
+    parser.add_argument("--cargo-list", default=str(BASE_DIR / 'cargolist.csv'))
+    parser.add_argument("--rows", type=int, default=500, help="사용할 화물 행 수 (0 = 전체)")
+    parser.add_argument("--empty-rate", type=float, default=0.05, help="빈 응답(대체 데이터) 확률")
+    parser.add_argument("--guide-shared", action="store_true", help="선박 의약품 단계를 Guide_No마다 한 번만 생성")
+    parser.add_argument("--no-dedup", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="결과를 JSON으로 출력")
+    args = parser.parse_args()
+
+    from auto_restart_analysis import ResultWriter, read_result_rows
+
+    work_dir = Path(tempfile.mkdtemp(prefix='results_bench_'))
+    try:
+        print(f"⏱️ 가짜 결과 생성 중 (화물 {args.rows or '전체'}개)...", file=sys.stderr)
+        captured, members = capture_stage_data(work_dir, dict(vars(args)))
+
+        legacy, legacy_bytes = traced(lambda: build_legacy_rows(captured, members))
+        compact, compact_bytes = traced(lambda: build_compact_rows(captured, members))
+        assert [dict(row) for row in compact] == legacy, "두 경로의 행이 다름"
+
+        result = {
+            'rows': len(compact),
+            'memory_mb': {'dict_rows': legacy_bytes / 1024**2, 'result_rows': compact_bytes / 1024**2},
+            'files': {},
+        }
+
+        try:
+            import pandas as pd
+        except ImportError:
+            pd = None
+        if pd is not None:
+            frame, build_s = timed(lambda: pd.DataFrame(legacy))
+            result['memory_mb']['dataframe'] = frame.memory_usage(deep=True).sum() / 1024**2
+            path = work_dir / 'dataframe.csv'
+            _, write_s = timed(lambda: frame.to_csv(path, index=False, encoding='utf-8-sig'))
+            _, read_s = timed(lambda: pd.read_csv(path, encoding='utf-8-sig'))
+            result['files']['dataframe.csv'] = {'mb': path.stat().st_size / 1024**2,
+                                                'write_s': build_s + write_s, 'read_s': read_s}
+            del frame
+
+        for suffix in ('csv', 'jsonl', 'djsonl'):
+            path = work_dir / f'results.{suffix}'
+
+            def write():
+                writer = ResultWriter(path, flush_interval=float('inf'))
+                writer.write_rows(compact)
+                writer.close()
+
+            _, write_s = timed(write)
+            read_rows, read_s = timed(lambda: list(read_result_rows(path)))
+            assert len(read_rows) == len(compact)
+            result['files'][f'results.{suffix}'] = {'mb': path.stat().st_size / 1024**2,
+                                                     'write_s': write_s, 'read_s': read_s}
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+        return
+
+    memory = result['memory_mb']
+    print(f"📄 결과 행 {result['rows']}개")
+    print(f"🧠 메모리: 행 dict {memory['dict_rows']:.1f}MB → ResultRow {memory['result_rows']:.1f}MB "
+          f"(x{memory['dict_rows'] / memory['result_rows']:.1f} 절약)"
+          + (f" | DataFrame {memory['dataframe']:.1f}MB" if 'dataframe' in memory else ""))
+    print(f"{'file':<16} {'MB':>8} {'write(s)':>9} {'read(s)':>8}")
+    print("-" * 44)
+    for name, entry in result['files'].items():
+        print(f"{name:<16} {entry['mb']:>8.2f} {entry['write_s']:>9.2f} {entry['read_s']:>8.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+
+"""
+오프라인 가짜 모델 백엔드
+실제 Gemini 할당량 없이 AutoRestartAnalyzer 전체 흐름을 실행/측정하기 위한 대체 모델
+"""
+
+import re
+import json
+import time
+import random
+import hashlib
+import threading
+
+from auto_restart_analysis import ModelProvider
+
+# 프롬프트의 Format / 최소·최대 항목 수 줄
+FORMAT_PATTERN = re.compile(r'Format:\s*([A-Z_|]+)')
+COUNT_PATTERN = re.compile(r'MINIMUM (\d+) entries, MAXIMUM (\d+) entries')
+# 묶음 요청의 화물 목록 줄
+PACKED_CARGO_PATTERN = re.compile(r'^\s*CARGO (\d+): (.+)$', re.MULTILINE)
+
+# 응답 본문에 섞을 단어 (파서 백업 경로 키워드 포함)
+FILLER_WORDS = [
+    "exposure", "toxic", "respiratory", "hazard", "treatment", "monitoring", "vapor",
+    "concentration", "effect", "protocol", "symptoms", "irritation", "risk", "data",
+    "clinical", "acute", "chronic", "decontamination", "procedure", "onset",
+]
+
+SHIP_MEDICINE_SAMPLES = [
+    "에피네프린 1앰플", "아세트아미노펜 500mg", "생리식염주사액 500mL", "베타딘액",
+    "아미노필린 1앰플", "염산리도카인 1%", "테라마이신연고", "화상가아제", "아목시실린 500mg",
+]
+# 선박 비치 목록(medi_inventory.json)에 없는 의약품 - 비치 목록 검사 측정용
+UNLISTED_MEDICINE_SAMPLES = ["모르핀 10mg", "날록손 0.4mg", "활성탄 50g", "아트로핀 1mg", "하이드록소코발라민 5g"]
+
+class FakeRateLimitError(Exception):
+    """가짜 429 오류 (google.api_core ResourceExhausted와 같은 code)"""
+    code = 429
+
+class FakeServerError(Exception):
+    """가짜 500 오류"""
+    code = 500
+
+class _Part:
+    def __init__(self, text):
+        self.text = text
+
+class _Content:
+    def __init__(self, parts):
+        self.parts = parts
+
+class _Candidate:
+    def __init__(self, parts, finish_reason):
+        self.content = _Content(parts)
+        self.finish_reason = finish_reason
+
+class _Usage:
+    def __init__(self, prompt_tokens, output_tokens, cached_tokens=0):
+        self.prompt_token_count = prompt_tokens
+        self.cached_content_token_count = cached_tokens
+        self.candidates_token_count = output_tokens
+        self.total_token_count = prompt_tokens + output_tokens
+
+class FakeResponse:
+    """google.generativeai 응답과 같은 모양 (text, candidates, usage_metadata)"""
+    def __init__(self, text, finish_reason=1, prompt_tokens=0, cached_tokens=0):
+        self.text = text
+        parts = [_Part(text)] if text else []
+        self.candidates = [_Candidate(parts, finish_reason)]
+        self.usage_metadata = _Usage(prompt_tokens, len(text) // 4, cached_tokens)
+
+class FakeStream:
+    """stream=True 응답 - 텍스트를 chunk_chars자씩 나눈 청크 응답을 차례로 반환
+
+    지연은 첫 청크 전과 청크 사이에 고르게 나누고, stall_seconds가 있으면 중간 청크에서 멈춘다.
+    마지막 청크에 finish_reason과 전체 토큰 사용량을 담는다.
+    """
+    def __init__(self, response, duration, chunk_chars=160, stall_seconds=0.0):
+        self.response = response
+        self.duration = duration
+        self.chunk_chars = chunk_chars
+        self.stall_seconds = stall_seconds
+
+    def __iter__(self):
+        text = self.response.text
+        pieces = [text[i:i + self.chunk_chars] for i in range(0, len(text), self.chunk_chars)] or ['']
+        delay = self.duration / (len(pieces) + 1)
+        time.sleep(delay)  # 첫 청크까지 (프롬프트 처리)
+        for i, piece in enumerate(pieces):
+            if self.stall_seconds and i == len(pieces) // 2:
+                time.sleep(self.stall_seconds)
+            time.sleep(delay)
+            if i + 1 < len(pieces):
+                yield FakeResponse(piece, finish_reason=0)
+                continue
+            last = FakeResponse(piece, finish_reason=self.response.candidates[0].finish_reason)
+            last.usage_metadata = self.response.usage_metadata
+            yield last
+
+class FakeModelProvider(ModelProvider):
+    """파이프 구분 응답을 만들어 주는 가짜 모델
+
+    latency: 호출 지연 중앙값(초, 로그정규 분포)
+    error_rate / rate_limit_rate / empty_rate / hang_rate: 호출별 오류 주입 확률
+    invalid_json_rate: JSON 응답 모드(response_mime_type)에서 스키마에 맞지 않는 응답 확률
+    pack_drop_rate: 묶음 요청 응답에서 화물 조각 하나가 빠질 확률
+    repeat_rate: 몇 행 뒤 같은 행을 출력 한도까지 반복하는(반복 루프) 응답 확률
+    stall_rate: 스트리밍(stream=True) 응답이 중간에 hang_seconds 동안 멈출 확률
+    unlisted_medicine_rate: 의약품 열이 있는 응답에서 한 행의 의약품을 비치 목록 밖 약으로 바꿀 확률 (호출마다 새로 뽑음)
+    max_output_tokens: 응답을 이 길이(문자 4개 ≈ 1토큰)에서 자름 (None이면 자르지 않음)
+    hang_seconds: 멈춘 호출이 붙잡고 있는 시간
+    같은 프롬프트에는 항상 같은 응답을 만든다 (seed 기준). stream=True면 FakeStream을 반환한다.
+    system_instruction은 프롬프트 뒤에 붙여 해석하고, 두 번째 호출부터는 캐시 적중 토큰으로 보고한다.
+    """
+    model_name = "fake-model"
+
+    def __init__(self, latency=0.05, latency_sigma=0.5, error_rate=0.0, rate_limit_rate=0.0,
+                 empty_rate=0.0, hang_rate=0.0, hang_seconds=600.0, invalid_json_rate=0.0,
+                 pack_drop_rate=0.0, repeat_rate=0.0, stall_rate=0.0, unlisted_medicine_rate=0.0,
+                 max_output_tokens=None, seed=0):
+        self.latency = latency
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.empty_rate = empty_rate
+        self.hang_rate = hang_rate
+        self.hang_seconds = hang_seconds
+        self.invalid_json_rate = invalid_json_rate
+        self.pack_drop_rate = pack_drop_rate
+        self.repeat_rate = repeat_rate
+        self.stall_rate = stall_rate
+        self.unlisted_medicine_rate = unlisted_medicine_rate
+        self.max_output_tokens = max_output_tokens
+        self.seed = seed
+        self.lock = threading.Lock()
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.seen_instructions = set()
+        self.injected = {'error': 0, 'rate_limit': 0, 'empty': 0, 'hang': 0, 'invalid_json': 0,
+                         'repeat': 0, 'stall': 0, 'unlisted_medicine': 0}
+
+    def _draw(self):
+        """호출별 무작위 값 (지연, 오류 판정)"""
+        with self.lock:
+            self.calls += 1
+            return self.random.lognormvariate(0, self.latency_sigma), self.random.random()
+
+    def _inject(self, kind):
+        with self.lock:
+            self.injected[kind] += 1
+
+    def generate_content(self, prompt, system_instruction=None, **kwargs):
+        latency_factor, roll = self._draw()
+        cached_tokens = 0
+        if system_instruction:
+            with self.lock:
+                if system_instruction in self.seen_instructions:
+                    cached_tokens = len(system_instruction) // 4
+                self.seen_instructions.add(system_instruction)
+            prompt = prompt + system_instruction
+
+        threshold = self.hang_rate
+        if roll < threshold:
+            self._inject('hang')
+            time.sleep(self.hang_seconds)
+        threshold += self.rate_limit_rate
+        if roll < threshold:
+            self._inject('rate_limit')
+            raise FakeRateLimitError("429 Resource has been exhausted (e.g. check quota).")
+        threshold += self.error_rate
+        if roll < threshold:
+            self._inject('error')
+            time.sleep(self.latency * latency_factor)
+            raise FakeServerError("500 Internal error encountered.")
+
+        duration = self.latency * latency_factor
+        stream = kwargs.get('stream')
+        if not stream:
+            time.sleep(duration)
+        prompt_tokens = len(prompt) // 4
+        response = self._respond(prompt, roll, threshold, prompt_tokens, cached_tokens, kwargs)
+        if not stream:
+            return response
+
+        stall_seconds = 0.0
+        if self.stall_rate and self._roll() < self.stall_rate:
+            self._inject('stall')
+            stall_seconds = self.hang_seconds
+        return FakeStream(response, duration, stall_seconds=stall_seconds)
+
+    def _roll(self):
+        with self.lock:
+            return self.random.random()
+
+    def _respond(self, prompt, roll, threshold, prompt_tokens, cached_tokens, kwargs):
+        threshold += self.empty_rate
+        if roll < threshold:
+            self._inject('empty')
+            # finish_reason 2 = MAX_TOKENS
+            return FakeResponse("", finish_reason=2, prompt_tokens=prompt_tokens, cached_tokens=cached_tokens)
+
+        unlisted = False
+        format_match = FORMAT_PATTERN.search(prompt)
+        if self.unlisted_medicine_rate and format_match and 'MEDICINE' in format_match.group(1):
+            if self._roll() < self.unlisted_medicine_rate:
+                self._inject('unlisted_medicine')
+                unlisted = True
+
+        generation_config = kwargs.get('generation_config') or {}
+        if generation_config.get('response_mime_type') == 'application/json':
+            threshold += self.invalid_json_rate
+            if roll < threshold:
+                self._inject('invalid_json')
+                return FakeResponse('[{"RISK_TYPE": "truncated', prompt_tokens=prompt_tokens, cached_tokens=cached_tokens)
+            return FakeResponse(self.render_json(prompt, unlisted), prompt_tokens=prompt_tokens,
+                                cached_tokens=cached_tokens)
+
+        text = self.render(prompt, unlisted)
+        finish_reason = 1
+        threshold += self.repeat_rate
+        if roll < threshold:
+            # 반복 루프: 앞 몇 행 뒤 같은 행만 출력 한도까지 반복
+            self._inject('repeat')
+            lines = text.split('\n')[:6]
+            limit = (self.max_output_tokens or 8192) * 4
+            text = "\n".join(lines + [lines[-1]] * (limit // (len(lines[-1]) + 1)))[:limit]
+            finish_reason = 2
+        if self.max_output_tokens and len(text) > self.max_output_tokens * 4:
+            text, finish_reason = text[:self.max_output_tokens * 4], 2
+        return FakeResponse(text, finish_reason=finish_reason, prompt_tokens=prompt_tokens, cached_tokens=cached_tokens)
+
+    def render(self, prompt, unlisted=False):
+        """프롬프트의 Format 줄과 항목 수에 맞는 파이프 구분 응답 생성 (묶음 요청이면 화물별 구분 줄 포함)"""
+        packed = PACKED_CARGO_PATTERN.findall(prompt)
+        if packed:
+            return self.render_packed(prompt, packed, unlisted)
+        lines = ["Here is the requested analysis:", ""]
+        lines.extend("|".join(values) for values in self.render_entries(prompt, unlisted)[1])
+        lines.append("")
+        lines.append("All entries are based on available toxicological data.")
+        return "\n".join(lines)
+
+    def render_packed(self, prompt, cargos, unlisted=False):
+        rng = random.Random(self._prompt_seed(prompt))
+        unlisted_cargo = rng.choice(cargos)[0] if unlisted else None
+        lines = ["Here is the requested analysis for each cargo:", ""]
+        for number, _ in cargos:
+            if rng.random() < self.pack_drop_rate:
+                continue
+            lines.append(f"### CARGO {number}")
+            entries = self.render_entries(f"{prompt}\0{number}", number == unlisted_cargo)[1]
+            lines.extend("|".join(values) for values in entries)
+            lines.append(f"### END CARGO {number}")
+            lines.append("")
+        return "\n".join(lines)
+
+    def _prompt_seed(self, prompt):
+        return int(hashlib.sha256(f"{self.seed}\0{prompt}".encode('utf-8')).hexdigest()[:16], 16)
+
+    def render_json(self, prompt, unlisted=False):
+        """render와 같은 항목을 JSON 배열로 생성 (구조화 출력 모드)"""
+        fields, entries = self.render_entries(prompt, unlisted)
+        return json.dumps([dict(zip(fields, values)) for values in entries], ensure_ascii=False)
+
+    def render_entries(self, prompt, unlisted=False):
+        """(필드 목록, 항목별 값 목록) 생성 - unlisted면 한 행의 의약품 열에 비치 목록 밖 약을 넣음"""
+        rng = random.Random(self._prompt_seed(prompt))
+
+        format_match = FORMAT_PATTERN.search(prompt)
+        fields = format_match.group(1).split('|') if format_match else ['ITEM', 'DESCRIPTION', 'DETAIL']
+        count_match = COUNT_PATTERN.search(prompt)
+        low, high = (int(count_match.group(1)), int(count_match.group(2))) if count_match else (5, 10)
+
+        entries = []
+        for i in range(rng.randint(low, high)):
+            values = [f"{fields[0]}_{i + 1}"]
+            for field in fields[1:]:
+                if 'MEDICINE' in field:
+                    values.append(", ".join(rng.sample(SHIP_MEDICINE_SAMPLES, rng.randint(1, 3))))
+                else:
+                    words = rng.sample(FILLER_WORDS, rng.randint(3, 8))
+                    values.append(f"{field.title().replace('_', ' ')}: " + " ".join(words))
+            entries.append(values)
+        medicine_fields = [i for i, field in enumerate(fields) if 'MEDICINE' in field]
+        if unlisted and medicine_fields and entries:
+            # 정상 응답 항목은 그대로 두고 바꿀 행과 약만 별도 난수로 고름
+            picker = random.Random(self._prompt_seed(prompt + "\0unlisted"))
+            values = picker.choice(entries)
+            values[medicine_fields[0]] = picker.choice(UNLISTED_MEDICINE_SAMPLES)
+        return fields, entries
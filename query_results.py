@@ -0,0 +1,540 @@
+#!/usr/bin/env python3
+
+"""
+OFFLINE RESULT QUERY
+분석 결과 파일(이전 배치 CSV, 결과 파일과 롤오버 파트, 샤드 파일)을 하나의 색인된 SQLite 파일로
+모아 네트워크 없이 ID_No / 물질명(유사 검색) / Guide_No / 단계 / 본문 전문 검색으로 바로 조회한다.
+
+예:
+    python query_results.py build
+    python query_results.py id 1005 --stage 2
+    python query_results.py name "amonia anhydrous"
+    python query_results.py guide 125 --stage "Maritime Medical"
+    python query_results.py search "에피네프린" --stage 5
+"""
+
+import os
+import re
+import sys
+import csv
+import json
+import time
+import sqlite3
+import difflib
+import argparse
+from pathlib import Path
+from datetime import datetime
+
+from auto_restart_analysis import (STAGES, OUTPUT_FIELDS, SHARD_FILE_PATTERN, BASE_DIR,
+                                   format_cargo_entry, read_result_rows)
+
+DEFAULT_STORE_PATH = 'results_index.sqlite3'
+SCHEMA_VERSION = '1'
+
+# 결과 파일에 화물 리스트 행이 없을 때 화물 문자열 해석 ("ID: 이름 (Guide: G)")
+CARGO_PATTERN = re.compile(r'^(?:(?P<id>[^:]+?): )?(?P<name>.*?)(?: \(Guide: (?P<guide>[^)]*)\))?$')
+LEGACY_BATCH_PATTERN = re.compile(r'^maximum_data_batch_(\d+)_(\d{8})_(\d{4})\.csv$')
+
+STAGE_ORDER = {stage_key: i for i, (_, _, stage_key) in enumerate(STAGES)}
+
+SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE cargos (
+    cargo_id INTEGER PRIMARY KEY,
+    cargo TEXT NOT NULL UNIQUE,
+    id_no TEXT,
+    guide_no TEXT,
+    name TEXT,
+    name_key TEXT,
+    list_order INTEGER
+);
+CREATE INDEX cargos_id_no ON cargos(id_no);
+CREATE INDEX cargos_guide_no ON cargos(guide_no);
+CREATE INDEX cargos_name_key ON cargos(name_key);
+CREATE TABLE results (
+    row_id INTEGER PRIMARY KEY,
+    cargo_id INTEGER NOT NULL REFERENCES cargos(cargo_id),
+    stage TEXT NOT NULL,
+    stage_no INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    category TEXT,
+    description TEXT,
+    detail1 TEXT,
+    detail2 TEXT,
+    detail3 TEXT
+);
+CREATE INDEX results_cargo_stage ON results(cargo_id, stage_no, position);
+CREATE INDEX results_stage_category ON results(stage_no, category);
+"""
+
+# 한글 조사가 붙은 단어도 부분 일치하도록 trigram 우선, 없으면 기본 토크나이저, FTS5가 없으면 LIKE 검색
+FTS_TOKENIZERS = ("trigram", "unicode61")
+
+def name_key(name):
+    """유사 검색용 물질명 키 (대소문자, 문장부호, 공백 무시)"""
+    return " ".join(re.sub(r'[^\w]+', ' ', name.casefold()).split())
+
+def name_similarity(key, candidate):
+    """물질명 키 유사도 (0-1) - 전체 문자열 또는 검색어 단어별로 가장 비슷한 단어 기준 중 높은 값
+
+    "acetylne"처럼 긴 이름의 첫 단어만 입력해도 짧은 다른 물질명보다 높게 나오도록 단어별 점수를 함께 본다.
+    """
+    whole = difflib.SequenceMatcher(None, key, candidate).ratio()
+    words = candidate.split()
+    per_word = sum(max(difflib.SequenceMatcher(None, token, word).ratio() for word in words)
+                   for token in key.split()) / len(key.split())
+    return max(whole, per_word * 0.95)
+
+def normalize_id(value):
+    """'UN1005', 'un 1005', '1005' → '1005'"""
+    value = value.strip()
+    return re.sub(r'^(?:UN|NA)\s*', '', value, flags=re.IGNORECASE)
+
+def resolve_stage(value):
+    """단계 번호(1-5), Stage 값, 한글 단계명 또는 그 앞부분 → Stage 값"""
+    if value is None:
+        return None
+    text = value.strip().casefold()
+    if text.isdigit() and 1 <= int(text) <= len(STAGES):
+        return STAGES[int(text) - 1][2]
+    for stage_name, _, stage_key in STAGES:
+        if text in (stage_key.casefold(), stage_name.casefold()):
+            return stage_key
+    matches = [stage_key for stage_name, _, stage_key in STAGES
+               if stage_key.casefold().startswith(text) or stage_name.casefold().startswith(text)]
+    if len(matches) == 1:
+        return matches[0]
+    raise ValueError(f"알 수 없는 단계입니다: {value} ({', '.join(key for _, _, key in STAGES)})")
+
+def load_cargo_list(path):
+    """화물 리스트 → {화물 문자열: (ID_No, Guide_No, 물질명, 순서)}"""
+    cargos = {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for i, row in enumerate(csv.DictReader(f)):
+                cargo = format_cargo_entry(row['ID_No'], row['Guide_No'], row['Name_of_Material'])
+                cargos.setdefault(cargo, (row['ID_No'].strip(), row['Guide_No'].strip(),
+                                          row['Name_of_Material'].strip(), i))
+    except FileNotFoundError:
+        print(f"⚠️ {path} 파일이 없어 화물 문자열에서 ID_No/Guide_No를 해석합니다", file=sys.stderr)
+    return cargos
+
+def parse_cargo(cargo):
+    """화물 문자열 → (ID_No, Guide_No, 물질명)"""
+    match = CARGO_PATTERN.match(cargo)
+    return (match.group('id') or '').strip(), (match.group('guide') or '').strip(), match.group('name').strip()
+
+def find_result_files(output='maximum_data_results.csv', directory='.'):
+    """색인할 결과 파일 목록 (뒤 파일의 (화물, Stage) 블록이 앞 파일을 덮어씀)
+
+    이전 배치 CSV(배치 번호, 날짜 순) → 샤드 파일 → 결과 파일과 롤오버 파트 순서.
+    """
+    directory = Path(directory)
+    output = Path(output)
+    if not output.is_absolute():
+        output = directory / output
+
+    legacy = []
+    for path in directory.glob('maximum_data_batch_*_*.csv'):
+        match = LEGACY_BATCH_PATTERN.match(path.name)
+        if match:
+            legacy.append(((match.group(2), match.group(3), int(match.group(1))), path))
+
+    shards = []
+    for path in output.parent.glob(f"{output.stem}.shard*{output.suffix}"):
+        match = SHARD_FILE_PATTERN.search(path.name[:len(path.name) - len(output.suffix)])
+        if match:
+            shards.append(((int(match.group(2)), int(match.group(1)), int(match.group(3) or 0)), path))
+
+    parts = [output] if output.exists() else []
+    part = 1
+    while (path := output.with_name(f"{output.stem}.part{part:04d}{output.suffix}")).exists():
+        parts.append(path)
+        part += 1
+
+    return [path for _, path in sorted(legacy)] + [path for _, path in sorted(shards)] + parts
+
+def collect_blocks(paths):
+    """결과 파일들 → {(화물, Stage): [행 튜플, ...]} (같은 키는 마지막 블록만 남김)"""
+    blocks = {}
+    replaced = 0
+    for path in paths:
+        current_key = None
+        for row in read_result_rows(path):
+            key = (row[0], row[1])
+            if not key[0]:
+                continue
+            if key != current_key:
+                current_key = key
+                if key in blocks:
+                    replaced += 1
+                blocks[key] = []
+            blocks[key].append(row)
+    return blocks, replaced
+
+def source_signature(paths):
+    """색인 원본 파일 (경로, 크기, 수정 시각) 목록 - 색인이 오래됐는지 판단용"""
+    signature = []
+    for path in paths:
+        stat = Path(path).stat()
+        signature.append([str(Path(path).resolve()), stat.st_size, stat.st_mtime_ns])
+    return signature
+
+def build_store(store_path, paths, cargo_list_path=None):
+    """결과 파일들을 색인된 SQLite 파일 하나로 컴파일 (임시 파일에 만든 뒤 교체)"""
+    store_path = Path(store_path)
+    cargo_list = load_cargo_list(cargo_list_path) if cargo_list_path else {}
+    blocks, replaced = collect_blocks(paths)
+
+    temp_path = store_path.with_name(store_path.name + '.building')
+    if temp_path.exists():
+        temp_path.unlink()
+    conn = sqlite3.connect(temp_path, isolation_level=None)
+    try:
+        conn.execute("PRAGMA journal_mode=OFF")
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.executescript(SCHEMA)
+        conn.execute("BEGIN")
+
+        # 화물 리스트의 모든 화물 (결과가 아직 없는 화물도 조회 가능) + 결과에만 있는 화물
+        cargo_ids = {}
+        entries = dict(cargo_list)
+        for cargo, _ in blocks:
+            if cargo not in entries:
+                entries[cargo] = parse_cargo(cargo) + (len(entries),)
+        for cargo_id, (cargo, (id_no, guide_no, name, order)) in enumerate(
+                sorted(entries.items(), key=lambda item: item[1][3]), 1):
+            cargo_ids[cargo] = cargo_id
+            conn.execute("INSERT INTO cargos VALUES (?, ?, ?, ?, ?, ?, ?)",
+                         (cargo_id, cargo, normalize_id(id_no) if id_no != "— —" else '', guide_no, name,
+                          name_key(name), order))
+
+        rows = 0
+        keys = sorted(blocks, key=lambda key: (cargo_ids[key[0]], STAGE_ORDER.get(key[1], len(STAGE_ORDER)), key[1]))
+        for cargo, stage in keys:
+            stage_no = STAGE_ORDER.get(stage, len(STAGE_ORDER)) + 1
+            conn.executemany(
+                "INSERT INTO results (cargo_id, stage, stage_no, position, category, description, "
+                "detail1, detail2, detail3) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(cargo_ids[cargo], stage, stage_no, position) + row[2:]
+                 for position, row in enumerate(blocks[(cargo, stage)])])
+            rows += len(blocks[(cargo, stage)])
+
+        tokenizer = None
+        for candidate in FTS_TOKENIZERS:
+            try:
+                conn.execute("CREATE VIRTUAL TABLE results_fts USING fts5(category, description, detail1, "
+                             f"detail2, detail3, content='results', content_rowid='row_id', tokenize='{candidate}')")
+            except sqlite3.OperationalError:
+                continue
+            conn.execute("INSERT INTO results_fts(results_fts) VALUES ('rebuild')")
+            tokenizer = candidate
+            if tokenizer == 'trigram':
+                # 철자가 틀린 물질명의 후보를 trigram 겹침으로 먼저 좁힘
+                conn.execute("CREATE VIRTUAL TABLE cargos_fts USING fts5(name_key, content='cargos', "
+                             "content_rowid='cargo_id', tokenize='trigram')")
+                conn.execute("INSERT INTO cargos_fts(cargos_fts) VALUES ('rebuild')")
+            break
+
+        meta = {
+            'schema_version': SCHEMA_VERSION,
+            'built_at': datetime.now().isoformat(timespec='seconds'),
+            'sources': json.dumps(source_signature(paths), ensure_ascii=False),
+            'fts_tokenizer': tokenizer or '',
+        }
+        conn.executemany("INSERT INTO meta VALUES (?, ?)", meta.items())
+        conn.execute("COMMIT")
+        conn.execute("ANALYZE")
+    finally:
+        conn.close()
+    os.replace(temp_path, store_path)
+
+    return {
+        'files': len(paths),
+        'cargos': len({cargo for cargo, _ in blocks}),
+        'stages': len(blocks),
+        'rows': rows,
+        'replaced_blocks': replaced,
+        'fts_tokenizer': tokenizer,
+        'bytes': store_path.stat().st_size,
+    }
+
+class ResultStore:
+    """색인된 결과 파일 읽기 전용 조회 API
+
+    파일은 읽기 전용 + 메모리 매핑으로 열어 프로세스 시작 직후 첫 조회도 전체 파일을 읽지 않는다.
+    조회 결과 행은 OUTPUT_FIELDS + ID_No / Guide_No / Name dict로 반환한다.
+    """
+    def __init__(self, path=DEFAULT_STORE_PATH, mmap_bytes=256 * 1024**2):
+        self.path = Path(path)
+        if not self.path.exists():
+            raise FileNotFoundError(f"{self.path} 색인이 없습니다 (먼저 'python query_results.py build' 실행)")
+        self.conn = sqlite3.connect(f"{self.path.resolve().as_uri()}?mode=ro", uri=True)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute(f"PRAGMA mmap_size={int(mmap_bytes)}")
+        self.meta = dict(self.conn.execute("SELECT key, value FROM meta"))
+        self._name_keys = None
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def stale_sources(self):
+        """색인 이후 바뀌었거나 사라진 원본 파일 목록"""
+        stale = []
+        for path, size, mtime_ns in json.loads(self.meta.get('sources') or '[]'):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                stale.append(path)
+                continue
+            if (stat.st_size, stat.st_mtime_ns) != (size, mtime_ns):
+                stale.append(path)
+        return stale
+
+    def _cargos(self, where, params, limit=None):
+        sql = ("SELECT cargo_id, cargo, id_no, guide_no, name, "
+               "(SELECT COUNT(DISTINCT stage_no) FROM results r WHERE r.cargo_id = c.cargo_id) AS stages "
+               f"FROM cargos c WHERE {where} ORDER BY list_order")
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        return [dict(row) for row in self.conn.execute(sql, params)]
+
+    def by_id(self, id_no):
+        """UN ID_No로 화물 찾기 (같은 ID의 여러 물질 포함)"""
+        return self._cargos("id_no = ?", (normalize_id(id_no),))
+
+    def by_guide(self, guide_no):
+        """ERG Guide_No로 화물 찾기"""
+        return self._cargos("guide_no = ?", (guide_no.strip(),))
+
+    def by_name(self, name, limit=5, cutoff=0.6):
+        """물질명 유사 검색: 정확히 일치 → 모든 단어 포함 → 철자 유사도(name_similarity) 순으로 찾기"""
+        key = name_key(name)
+        if not key:
+            return []
+        found = self._cargos("name_key = ?", (key,), limit)
+        if found:
+            return found
+
+        tokens = key.split()
+        where = " AND ".join("name_key LIKE ? ESCAPE '\\'" for _ in tokens)
+        params = ['%' + re.sub(r'([%_\\])', r'\\\1', token) + '%' for token in tokens]
+        found = self._cargos(where, params)
+        if found:
+            found.sort(key=lambda cargo: len(cargo['name']))
+            return found[:limit]
+
+        candidates = self._name_candidates(key)
+        scored = ((name_similarity(key, candidate), candidate) for candidate in candidates)
+        matches = [candidate for score, candidate in sorted(
+            (item for item in scored if item[0] >= cutoff), key=lambda item: (-item[0], len(item[1])))][:limit]
+        found = []
+        for match in matches:
+            ids = candidates[match]
+            found.extend(self._cargos(f"cargo_id IN ({','.join('?' * len(ids))})", ids))
+        return found[:limit]
+
+    def _name_candidates(self, key, limit=100):
+        """유사도를 비교할 {물질명 키: [cargo_id, ...]} (trigram 색인이 있으면 겹치는 trigram이 많은 후보만)"""
+        grams = {key[i:i + 3] for i in range(len(key) - 2)}
+        if self.meta.get('fts_tokenizer') == 'trigram' and grams:
+            query = " OR ".join('"' + gram.replace('"', '""') + '"' for gram in sorted(grams))
+            rows = self.conn.execute("SELECT c.name_key, c.cargo_id FROM cargos_fts f JOIN cargos c "
+                                     "ON c.cargo_id = f.rowid WHERE cargos_fts MATCH ? ORDER BY f.rank "
+                                     f"LIMIT {int(limit)}", (query,))
+        else:
+            if self._name_keys is None:
+                self._name_keys = self.conn.execute(
+                    "SELECT name_key, cargo_id FROM cargos ORDER BY list_order").fetchall()
+            rows = self._name_keys
+        candidates = {}
+        for row_key, cargo_id in rows:
+            candidates.setdefault(row_key, []).append(cargo_id)
+        return candidates
+
+    def rows(self, cargo_ids, stage=None, category=None):
+        """화물들의 결과 행 (화물 리스트 순서 → 단계 순서 → 원래 행 순서)
+
+        stage: 단계 번호/Stage 값/앞부분, category: Category 앞부분 (대소문자 무시)
+        """
+        cargo_ids = list(cargo_ids)
+        if not cargo_ids:
+            return []
+        where = [f"r.cargo_id IN ({','.join('?' * len(cargo_ids))})"]
+        params = list(cargo_ids)
+        stage = resolve_stage(stage)
+        if stage:
+            where.append("r.stage_no = ?")
+            params.append(STAGE_ORDER[stage] + 1)
+        if category:
+            where.append("r.category LIKE ?")
+            params.append(category.strip() + '%')
+        return self._rows(" AND ".join(where), params)
+
+    def _rows(self, where, params, limit=None, fts=False):
+        # 행은 화물 리스트 → 단계 → 원래 순서로 넣었으므로 row_id 순서가 곧 출력 순서.
+        # CROSS JOIN으로 results를 바깥 루프에 고정해 검색이 LIMIT 행을 찾는 즉시 멈추게 한다.
+        source = "results_fts f JOIN results r ON r.row_id = f.rowid" if fts else "results r"
+        sql = ("SELECT c.cargo, r.stage, r.category, r.description, r.detail1, r.detail2, r.detail3, "
+               f"c.id_no, c.guide_no, c.name FROM {source} CROSS JOIN cargos c ON c.cargo_id = r.cargo_id "
+               f"WHERE {where} ORDER BY {'f.rowid' if fts else 'r.row_id'}")
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        return [dict(zip(OUTPUT_FIELDS + ['ID_No', 'Guide_No', 'Name'], tuple(row)))
+                for row in self.conn.execute(sql, params)]
+
+    def lookup(self, id_no=None, name=None, guide_no=None, stage=None, category=None):
+        """ID_No / 물질명 / Guide_No 조건에 맞는 화물과 결과 행 → (화물 목록, 행 목록)"""
+        if id_no:
+            cargos = self.by_id(id_no)
+        elif name:
+            cargos = self.by_name(name)[:1]
+        elif guide_no:
+            cargos = self.by_guide(guide_no)
+        else:
+            raise ValueError("id_no, name, guide_no 중 하나가 필요합니다")
+        if guide_no and (id_no or name):
+            cargos = [cargo for cargo in cargos if cargo['guide_no'] == guide_no.strip()]
+        return cargos, self.rows([cargo['cargo_id'] for cargo in cargos], stage=stage, category=category)
+
+    def search(self, text, stage=None, limit=50):
+        """결과 본문(Category, Description, Detail1-3) 전문 검색"""
+        text = text.strip()
+        if not text:
+            return []
+        where, params = [], []
+        tokenizer = self.meta.get('fts_tokenizer')
+        # trigram은 3글자 미만 검색어를 찾지 못하므로 LIKE로 대신 검색
+        fts = bool(tokenizer) and not (tokenizer == 'trigram' and len(text) < 3)
+        if fts:
+            where.append("results_fts MATCH ?")
+            params.append('"' + text.replace('"', '""') + '"')
+        else:
+            pattern = '%' + text + '%'
+            where.append("(r.category LIKE ? OR r.description LIKE ? OR r.detail1 LIKE ? "
+                         "OR r.detail2 LIKE ? OR r.detail3 LIKE ?)")
+            params.extend([pattern] * 5)
+        stage = resolve_stage(stage)
+        if stage:
+            where.append("r.stage_no = ?")
+            params.append(STAGE_ORDER[stage] + 1)
+        return self._rows(" AND ".join(where), params, limit, fts=fts)
+
+def print_rows(rows):
+    """행 목록을 화물 → 단계별로 묶어 출력"""
+    cargo = stage = None
+    for row in rows:
+        if row['Cargo'] != cargo:
+            cargo, stage = row['Cargo'], None
+            print(f"\n🔎 {cargo}")
+        if row['Stage'] != stage:
+            stage = row['Stage']
+            print(f"  [{stage}]")
+        details = " | ".join(value for value in (row['Detail1'], row['Detail2'], row['Detail3']) if value)
+        print(f"    - {row['Category']}: {row['Description']}" + (f" | {details}" if details else ""))
+
+def print_cargos(cargos):
+    for cargo in cargos:
+        print(f"  • {cargo['cargo']} - 단계 {cargo['stages']}/{len(STAGES)}")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="분석 결과 색인 생성 및 오프라인 조회")
+    parser.add_argument("--store", default=DEFAULT_STORE_PATH, help=f"색인 파일 경로 (기본 {DEFAULT_STORE_PATH})")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build = commands.add_parser("build", help="결과 파일들을 색인 파일 하나로 컴파일")
+    build.add_argument("inputs", nargs="*", help="색인할 결과 파일 (기본: 이전 배치 CSV + --output 결과/파트/샤드 파일)")
+    build.add_argument("--output", default="maximum_data_results.csv", help="분석 실행의 --output 경로")
+    build.add_argument("--cargo-list", default=str(BASE_DIR / 'cargolist.csv'),
+                       help="ID_No/Guide_No/물질명 해석용 화물 리스트")
+
+    for name, help_text, metavar in (("id", "UN ID_No로 조회", "ID_NO"),
+                                     ("name", "물질명 유사 검색으로 조회", "NAME"),
+                                     ("guide", "ERG Guide_No로 조회", "GUIDE_NO"),
+                                     ("search", "결과 본문 전문 검색", "TEXT")):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument("value", metavar=metavar)
+        command.add_argument("--stage", default=None, help="단계 번호(1-5) 또는 Stage 이름/앞부분")
+        if name != "search":
+            command.add_argument("--category", default=None, help="Category 앞부분")
+        if name == "name":
+            command.add_argument("--limit", type=int, default=5, help="이름 후보 수 (기본 5)")
+        elif name == "search":
+            command.add_argument("--limit", type=int, default=50, help="검색 행 수 (기본 50)")
+        command.add_argument("--json", action="store_true", help="결과를 JSON으로 출력")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    start = time.perf_counter()
+
+    if args.command == "build":
+        paths = [Path(path) for path in args.inputs] or find_result_files(args.output)
+        if not paths:
+            print(f"❌ 색인할 결과 파일이 없습니다 ({args.output}, maximum_data_batch_*_*.csv)")
+            sys.exit(1)
+        print(f"📂 결과 파일 {len(paths)}개 색인 중...")
+        summary = build_store(args.store, paths, args.cargo_list)
+        print(f"✅ {args.store}: 화물 {summary['cargos']}개, 단계 {summary['stages']}개, 행 {summary['rows']}개 "
+              f"({summary['bytes'] / 1024**2:.1f}MB, 전문 검색: {summary['fts_tokenizer'] or '없음 (LIKE)'}, "
+              f"{time.perf_counter() - start:.1f}초)")
+        if summary['replaced_blocks']:
+            print(f"  ↺ 중복 (화물, 단계) 블록 {summary['replaced_blocks']}개는 나중 파일 기준")
+        return
+
+    try:
+        store = ResultStore(args.store)
+        stage = resolve_stage(args.stage)
+    except (FileNotFoundError, ValueError) as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+
+    with store:
+        stale = store.stale_sources()
+        if stale:
+            print(f"⚠️ 색인 이후 바뀐 결과 파일 {len(stale)}개 - 'build'를 다시 실행하세요", file=sys.stderr)
+
+        cargos = []
+        if args.command == "search":
+            rows = store.search(args.value, stage=stage, limit=args.limit)
+        elif args.command == "name":
+            cargos = store.by_name(args.value, limit=args.limit)
+            rows = store.rows([cargo['cargo_id'] for cargo in cargos[:1]], stage=stage, category=args.category)
+        elif args.command == "guide":
+            cargos = store.by_guide(args.value)
+            # 가이드 하나에 화물이 많으므로 단계/Category를 지정했을 때만 행 출력
+            rows = (store.rows([cargo['cargo_id'] for cargo in cargos], stage=stage, category=args.category)
+                    if stage or args.category else [])
+        else:
+            cargos = store.by_id(args.value)
+            rows = store.rows([cargo['cargo_id'] for cargo in cargos], stage=stage, category=args.category)
+        elapsed = time.perf_counter() - start
+
+        if args.json:
+            print(json.dumps({'cargos': cargos, 'rows': rows}, ensure_ascii=False, indent=2))
+        else:
+            if args.command == "name" and cargos:
+                print(f"🔎 '{args.value}' → {cargos[0]['cargo']}")
+                if len(cargos) > 1:
+                    print("  다른 후보:")
+                    print_cargos(cargos[1:])
+            elif args.command == "guide":
+                print(f"📋 Guide {args.value}: 화물 {len(cargos)}개")
+                print_cargos(cargos)
+                if not rows:
+                    print("  (행을 보려면 --stage 또는 --category 지정)")
+            if args.command != "guide" and not cargos and not rows:
+                print("❌ 일치하는 결과가 없습니다")
+            elif args.command != "search" and cargos and not rows and (args.command != "guide" or stage):
+                print("  (조건에 맞는 결과 행이 아직 없습니다)")
+            print_rows(rows)
+        print(f"⏱️ {elapsed * 1000:.1f}ms", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+import sys
+import random
+import threading
+from types import SimpleNamespace
+from pathlib import Path
+
+import pytest
+
+# 저장소 루트의 스크립트 모듈을 import할 수 있게 함
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from auto_restart_analysis import ModelProvider
+
+class StubModel(ModelProvider):
+    """프롬프트마다 항상 같은 파이프 행을 돌려주는 모델 (완료 순서가 섞이게 조금씩 지연)"""
+    def __init__(self):
+        self.calls = 0
+    
+    def generate_content(self, prompt, **kwargs):
+        self.calls += 1
+        rng = random.Random(prompt)
+        threading.Event().wait(rng.random() * 0.01)
+        lines = [f"ITEM_{i}|{rng.random():.6f} generated description|detail|more|end" for i in range(rng.randint(3, 8))]
+        return SimpleNamespace(text="\n".join(lines))
+
+@pytest.fixture
+def stub_model(monkeypatch):
+    import auto_restart_analysis
+    model = StubModel()
+    # 모델을 따로 주지 않은 분석기는 Gemini 대신 이 모델을 사용
+    monkeypatch.setattr(auto_restart_analysis, 'GeminiProvider', lambda *args, **kwargs: model)
+    return model
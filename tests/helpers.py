@@ -0,0 +1,38 @@
+import io
+import csv
+import itertools
+import contextlib
+from pathlib import Path
+
+from auto_restart_analysis import AutoRestartAnalyzer, RateLimiter, ProgressLedger
+
+ROOT = Path(__file__).resolve().parent.parent
+
+def make_cargo_list(work_dir, units=6):
+    """저장소 화물 리스트의 앞 units행으로 work_dir/cargolist.csv 생성"""
+    lines = (ROOT / 'cargolist.csv').read_text(encoding='utf-8').splitlines(keepends=True)
+    (Path(work_dir) / 'cargolist.csv').write_text("".join(lines[:units + 1]), encoding='utf-8')
+
+def run(work_dir, workers, **options):
+    """work_dir(작업 디렉토리)의 화물 리스트 분석 → 분석기 (진행 기록과 출력도 work_dir에, 출력은 단계마다 바로 fsync)"""
+    work_dir = Path(work_dir)
+    options.setdefault('writer_options', {'path': str(work_dir / 'results.csv'), 'flush_interval': 0})
+    analyzer = AutoRestartAnalyzer(
+        max_workers=workers,
+        rate_limiter=RateLimiter(rpm=None),
+        ledger=ProgressLedger(work_dir / 'progress.sqlite3'),
+        **options,
+    )
+    with contextlib.redirect_stdout(io.StringIO()):
+        analyzer.run_analysis()
+    analyzer.ledger.close()
+    return analyzer
+
+def result_rows(path):
+    """출력 CSV의 행 목록 (Cargo, Stage, Category, ...)"""
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        return [tuple(row) for row in csv.reader(f)][1:]
+
+def blocks(path):
+    """출력 파일의 (화물, Stage) 블록 순서"""
+    return [key for key, _ in itertools.groupby(row[:2] for row in result_rows(path))]
@@ -0,0 +1,69 @@
+import sys
+import hashlib
+
+import pytest
+
+import auto_restart_analysis
+from auto_restart_analysis import STAGES, STAGE_PROMPTS, main
+from helpers import make_cargo_list, run, result_rows, blocks
+
+pytestmark = pytest.mark.usefixtures('stub_model')
+
+CHANGED_STAGE = STAGES[2][2]
+
+def change_prompt(monkeypatch, stage_key=CHANGED_STAGE):
+    header, instructions = STAGE_PROMPTS[stage_key]
+    monkeypatch.setitem(STAGE_PROMPTS, stage_key, (header, instructions + "\n- 출처를 함께 적을 것"))
+
+@pytest.mark.parametrize('workers', [1, 4])
+def test_changed_prompt_reruns_only_that_stage_in_place(tmp_path, monkeypatch, stub_model, workers):
+    make_cargo_list(tmp_path, units=6)
+    monkeypatch.chdir(tmp_path)
+    analyzer = run(tmp_path, workers)
+    units = len(analyzer.unit_members)
+    before, before_blocks = result_rows(tmp_path / 'results.csv'), blocks(tmp_path / 'results.csv')
+    
+    change_prompt(monkeypatch)
+    stub_model.calls = 0
+    run(tmp_path, workers)
+    after = result_rows(tmp_path / 'results.csv')
+    
+    # 바뀐 단계만 작업 단위마다 한 번씩 다시 생성하고 블록 자리는 그대로
+    assert stub_model.calls == units
+    assert blocks(tmp_path / 'results.csv') == before_blocks
+    assert [row for row in after if row[1] != CHANGED_STAGE] == [row for row in before if row[1] != CHANGED_STAGE]
+    assert [row for row in after if row[1] == CHANGED_STAGE] != [row for row in before if row[1] == CHANGED_STAGE]
+    
+    # 새 지문이 기록되어 다음 실행은 호출 없이 끝남
+    stub_model.calls = 0
+    run(tmp_path, workers)
+    assert stub_model.calls == 0
+    assert result_rows(tmp_path / 'results.csv') == after
+
+def run_plan(work_dir, monkeypatch):
+    monkeypatch.chdir(work_dir)
+    monkeypatch.setattr(auto_restart_analysis.signal, 'signal', lambda *args: None)
+    monkeypatch.setattr(sys, 'argv', ['auto_restart_analysis.py', '--plan', '--no-cache',
+                                      '--output', 'results.csv', '--ledger-path', 'progress.sqlite3'])
+    main()
+
+def file_digests(work_dir):
+    return {path.name: hashlib.sha256(path.read_bytes()).hexdigest() for path in work_dir.iterdir()}
+
+def test_plan_makes_no_calls_and_leaves_ledger_untouched(tmp_path, monkeypatch, stub_model, capsys):
+    make_cargo_list(tmp_path, units=6)
+    run_plan(tmp_path, monkeypatch)
+    # 진행 기록이 없으면 만들지 않음
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['cargolist.csv']
+    
+    units = len(run(tmp_path, 1).unit_members)
+    change_prompt(monkeypatch)
+    digests = file_digests(tmp_path)
+    stub_model.calls = 0
+    capsys.readouterr()
+    run_plan(tmp_path, monkeypatch)
+    
+    assert stub_model.calls == 0
+    assert file_digests(tmp_path) == digests
+    plan_line = next(line for line in capsys.readouterr().out.splitlines() if line.strip().startswith(CHANGED_STAGE))
+    assert plan_line.split()[-3] == str(units)  # changed 열
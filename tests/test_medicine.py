@@ -0,0 +1,106 @@
+import pytest
+
+from auto_restart_analysis import (MEDICINE_MAX_GENERICS, MEDICINE_STAGE, MEDICINE_UNLISTED_NOTE, build_medicine_matcher,
+                                   flag_unlisted_medicine_rows, load_medicine_inventory, medicine_name_key, parse_args,
+                                   read_result_rows)
+from fake_backend import FakeModelProvider
+from helpers import make_cargo_list, run
+
+@pytest.fixture(scope='module')
+def matcher():
+    return build_medicine_matcher()
+
+@pytest.fixture(scope='module')
+def inventory():
+    return load_medicine_inventory()
+
+def find_entry(inventory, brand):
+    return next(entry for entry in inventory if brand in entry['brands'])
+
+def test_inventory_covers_every_table_row(inventory):
+    assert len(inventory) == 110
+    assert [section for section in dict.fromkeys(entry['section'] for entry in inventory)] == ['주사약', '내용약', '외용약']
+    for entry in inventory:
+        assert entry['category'] and entry['generic'] and entry['brands']
+        # 줄바꿈에서 잘린 조각이나 깨진 글자가 이름으로 남지 않음
+        for name in entry['generic'] + entry['brands']:
+            assert len(name) >= 2 and 'fp' not in name
+        assert entry['unit'] or not (entry['international'] or entry['domestic'] or entry['minimal'])
+
+@pytest.mark.parametrize('brand, category, generic', [
+    ("클로람페니콜캅셀", "항생제", ["클로람페니콜"]),
+    ("박트림정", "항균제", ["설파메톡사졸", "트리메토프림"]),
+    ("배농산급탕엑스정", "화농성질환용제", ["길경", "감초", "대추", "작약", "건강", "지실"]),
+    ("말레인산클로르페니라민정", "항히스타민제", ["클로르페니라민말레이트"]),
+    ("레이드", "살충제", ["살충원액", "올소이소프로폭시페닐메칠카바메이트", "인산 2-2디클로로비닐디메칠"]),
+])
+def test_inventory_rows_are_split_as_in_medi_md(inventory, brand, category, generic):
+    entry = find_entry(inventory, brand)
+    assert (entry['category'], entry['generic']) == (category, generic)
+
+def test_aliases_point_at_matched_generics(inventory, matcher):
+    for entry in inventory:
+        if entry['aliases']:
+            assert len(entry['generic']) <= MEDICINE_MAX_GENERICS
+        for alias in entry['aliases']:
+            assert matcher.names[medicine_name_key(alias)] == entry['generic'][0]
+            assert matcher.unlisted(f"{alias.title()} 1정") == []
+
+@pytest.mark.parametrize('cell', [
+    "5% 포도당 링겔 500ml",
+    "5% 포도당 링거액 1L",
+    "0.9% 생리식염수 1L",
+    "Epinephrine 1mg IM",
+    "Adrenaline 0.5mg",
+    "Paracetamol 1g PO",
+    "Lidocaine 2%",
+    "Normal saline 1L",
+    "Lactated Ringer's 1L",
+    "독시사이클린 100mg",
+    "Oxygen 15L/min",
+])
+def test_listed_medicine_spellings_are_not_flagged(matcher, cell):
+    assert matcher.unlisted(cell) == []
+
+@pytest.mark.parametrize('cell', ["Morphine 10mg", "날록손 0.4mg", "아트로핀 1mg"])
+def test_unlisted_medicine_is_flagged(matcher, cell):
+    assert matcher.unlisted(cell) == [cell]
+
+def test_flag_keeps_rows_and_marks_unlisted_items(matcher):
+    text = ("MEDICAL_SCENARIO|SPECIFIC_SHIP_MEDICINES|DOSAGE_ROUTE\n"
+            "흡입 노출 응급처치 시나리오|에피네프린 1앰플, 모르핀 10mg|근육주사|호흡 감시|5분\n"
+            "피부 접촉 응급처치 시나리오|멸균생리식염수|세척|피부 관찰|즉시")
+    flagged = flag_unlisted_medicine_rows(text, matcher).split('\n')
+    
+    assert len(flagged) == 3
+    assert flagged[1].split('|')[1] == f"에피네프린 1앰플, 모르핀 10mg ({MEDICINE_UNLISTED_NOTE}: 모르핀 10mg)"
+    assert flagged[2] == text.split('\n')[2]
+    # 이미 표시한 행에는 다시 붙이지 않음
+    assert flag_unlisted_medicine_rows("\n".join(flagged), matcher) == "\n".join(flagged)
+
+def test_medicine_check_is_opt_in(monkeypatch):
+    monkeypatch.setattr('sys.argv', ['auto_restart_analysis.py'])
+    assert not parse_args().medicine_check
+    monkeypatch.setattr('sys.argv', ['auto_restart_analysis.py', '--medicine-check'])
+    assert parse_args().medicine_check
+
+@pytest.mark.parametrize('stream', [False, True])
+def test_unlisted_rows_are_kept_after_retries(tmp_path, monkeypatch, matcher, stream):
+    unchecked_dir, checked_dir = tmp_path / 'unchecked', tmp_path / 'checked'
+    for work_dir in (unchecked_dir, checked_dir):
+        work_dir.mkdir()
+        make_cargo_list(work_dir, units=3)
+    # 모든 응답에 비치 목록 밖 약이 들어가 재요청이 계속 실패하는 경우
+    monkeypatch.chdir(unchecked_dir)
+    run(unchecked_dir, 1, model=FakeModelProvider(latency=0, unlisted_medicine_rate=1.0), stream=stream)
+    monkeypatch.chdir(checked_dir)
+    run(checked_dir, 1, model=FakeModelProvider(latency=0, unlisted_medicine_rate=1.0), stream=stream,
+        medicine_matcher=matcher)
+    
+    def medicine_rows(work_dir):
+        return [row for row in read_result_rows(work_dir / 'results.csv') if row[1] == MEDICINE_STAGE]
+    
+    unchecked, checked = medicine_rows(unchecked_dir), medicine_rows(checked_dir)
+    assert len(checked) == len(unchecked)
+    flagged = [row for row in checked if MEDICINE_UNLISTED_NOTE in row[3]]
+    assert flagged and all(matcher.row_problem(row[2:]) for row in flagged)
@@ -0,0 +1,36 @@
+import json
+import sqlite3
+
+import pytest
+
+from auto_restart_analysis import MetricsRecorder
+from helpers import make_cargo_list, run
+
+@pytest.mark.parametrize('answer', ['error', 'no rows'])
+def test_stage_metric_uses_ledger_failure_rule(tmp_path, monkeypatch, stub_model, answer):
+    monkeypatch.chdir(tmp_path)
+    make_cargo_list(tmp_path, units=3)
+    generate = stub_model.generate_content
+    
+    def broken_risk_analysis(prompt, **kwargs):
+        if 'Analyze Ammonium nitrate-fuel oil mixtures' not in prompt:
+            return generate(prompt, **kwargs)
+        if answer == 'error':
+            raise RuntimeError("500 Internal error")
+        return type('Response', (), {'text': "Sorry, no data is available."})()
+    
+    monkeypatch.setattr(stub_model, 'generate_content', broken_risk_analysis)
+    metrics = MetricsRecorder(tmp_path / 'metrics.jsonl')
+    run(tmp_path, 1, metrics=metrics)
+    metrics.close()
+    
+    with open(tmp_path / 'metrics.jsonl', encoding='utf-8') as f:
+        events = [json.loads(line) for line in f]
+    metric_failures = {(event['cargo'], event['stage']) for event in events
+                       if event['event'] == 'stage' and event['failed']}
+    conn = sqlite3.connect(tmp_path / 'progress.sqlite3')
+    ledger_failures = set(conn.execute("SELECT cargo, stage FROM stage_progress WHERE failed = 1"))
+    conn.close()
+    
+    assert metric_failures
+    assert metric_failures == ledger_failures
@@ -0,0 +1,38 @@
+import pytest
+
+from auto_restart_analysis import PackSizer, ProgressLedger, split_packed_stage_data
+from fake_backend import FakeModelProvider
+from helpers import make_cargo_list, run, blocks
+
+def test_split_keeps_only_closed_slices_with_rows():
+    stage_data = "\n".join([
+        "### CARGO 1", "RISK|first cargo|high", "### END CARGO 1",
+        "### CARGO 2", "no pipe rows here", "### END CARGO 2",
+        "### CARGO 3", "RISK|cut off by the output limit|",
+    ])
+    
+    assert split_packed_stage_data(stage_data, 3) == {0: "RISK|first cargo|high"}
+
+@pytest.mark.parametrize('workers', [1, 4])
+def test_packed_run_writes_every_block_once(tmp_path, monkeypatch, workers):
+    single_dir, packed_dir = tmp_path / 'single', tmp_path / 'packed'
+    for work_dir in (single_dir, packed_dir):
+        work_dir.mkdir()
+        make_cargo_list(work_dir, units=12)
+    
+    single_model = FakeModelProvider(latency=0)
+    monkeypatch.chdir(single_dir)
+    run(single_dir, workers, model=single_model)
+    
+    # 묶음 응답에서 빠진 화물은 단독 요청으로 채워짐
+    packed_model = FakeModelProvider(latency=0, pack_drop_rate=0.3)
+    monkeypatch.chdir(packed_dir)
+    run(packed_dir, workers, model=packed_model, pack_sizer=PackSizer(max_pack=4))
+    
+    assert packed_model.calls < single_model.calls
+    packed = blocks(packed_dir / 'results.csv')
+    assert len(packed) == len(set(packed))
+    assert packed == blocks(single_dir / 'results.csv')
+    ledger = ProgressLedger(packed_dir / 'progress.sqlite3')
+    assert len(ledger.processed_cargos()) == 12
+    ledger.close()
@@ -0,0 +1,104 @@
+import io
+import contextlib
+
+import pytest
+
+from auto_restart_analysis import AutoRestartAnalyzer, RateLimiter, ProgressLedger, ResultRow
+from helpers import make_cargo_list, run
+
+def test_progress_survives_reopen(tmp_path):
+    ledger = ProgressLedger(tmp_path / 'progress.sqlite3')
+    ledger.record_batch(3, {'A': ['Risk Analysis', 'Statistical Data']})
+    ledger.record_batch(2, {'B': ['Risk Analysis']})
+    ledger.close()
+    
+    ledger = ProgressLedger(tmp_path / 'progress.sqlite3')
+    assert ledger.processed_cargos() == {'A', 'B'}
+    assert ledger.completed_stages('A') == {'Risk Analysis', 'Statistical Data'}
+    assert ledger.last_batch() == 3
+
+def rows(stage, *texts):
+    return [ResultRow('A', stage, ('Info', text, '', '', '')) for text in texts]
+
+def test_failed_stage_is_not_resumed(tmp_path):
+    ledger = ProgressLedger(tmp_path / 'progress.sqlite3')
+    ledger.record_stage(['A'], 'Risk Analysis', 1, rows('Risk Analysis', 'ok'))
+    ledger.record_stage(['A'], 'Statistical Data', 1, rows('Statistical Data', 'API 오류: 500'), failed=True)
+    ledger.record_stage(['A'], 'Emergency Procedures', 1, [], failed=True)
+    
+    assert set(ledger.stage_results('A')) == {'Risk Analysis'}
+    assert ledger.completed_stages('A') == {'Risk Analysis'}
+
+def test_successful_retry_clears_failure(tmp_path):
+    ledger = ProgressLedger(tmp_path / 'progress.sqlite3')
+    ledger.record_stage(['A'], 'Risk Analysis', 1, [], failed=True)
+    ledger.record_stage(['A'], 'Risk Analysis', 2, rows('Risk Analysis', 'retried'))
+    
+    assert ledger.stage_results('A') == {'Risk Analysis': ([['Info', 'retried', '', '', '']], False)}
+
+def test_batch_files_are_imported_once(tmp_path):
+    for batch_num, date, cargo in [(1, '20250101_0900', 'A'), (2, '20250302_1830', 'B')]:
+        (tmp_path / f'maximum_data_batch_{batch_num}_{date}.csv').write_text(
+            f"Cargo,Stage,Category,Description\n{cargo},Risk Analysis,Info,text\n", encoding='utf-8-sig')
+    ledger = ProgressLedger(tmp_path / 'progress.sqlite3')
+    
+    assert ledger.import_batch_files(tmp_path) == 2
+    assert ledger.processed_cargos() == {'A', 'B'}
+    assert ledger.last_batch() == 2
+    assert ledger.import_batch_files(tmp_path) == 0
+
+@pytest.mark.parametrize('workers', [1, 4])
+def test_interrupted_cargo_is_resumed(tmp_path, monkeypatch, stub_model, workers):
+    monkeypatch.chdir(tmp_path)
+    make_cargo_list(tmp_path, units=3)
+    generate = stub_model.generate_content
+    
+    def stop_after_seven_calls(prompt, **kwargs):
+        if stub_model.calls == 7:
+            analyzer.should_stop = True
+        return generate(prompt, **kwargs)
+    
+    monkeypatch.setattr(stub_model, 'generate_content', stop_after_seven_calls)
+    ledger = ProgressLedger(tmp_path / 'progress.sqlite3')
+    analyzer = AutoRestartAnalyzer(max_workers=workers, rate_limiter=RateLimiter(rpm=None), ledger=ledger)
+    with contextlib.redirect_stdout(io.StringIO()):
+        analyzer.run_analysis()
+    processed = ledger.processed_cargos()
+    ledger.close()
+    # 단계가 빠진 화물은 완료로 기록하지 않음
+    assert len(processed) < 3
+    
+    monkeypatch.setattr(stub_model, 'generate_content', generate)
+    run(tmp_path, workers)
+    ledger = ProgressLedger(tmp_path / 'progress.sqlite3')
+    assert len(ledger.processed_cargos()) == 3
+    
+    calls = stub_model.calls
+    run(tmp_path, workers)
+    assert stub_model.calls == calls
+
+@pytest.mark.parametrize('workers', [1, 4])
+def test_resume_requests_only_failed_stages(tmp_path, monkeypatch, stub_model, workers):
+    monkeypatch.chdir(tmp_path)
+    make_cargo_list(tmp_path, units=3)
+    generate = stub_model.generate_content
+    
+    def failing_risk_analysis(prompt, **kwargs):
+        if 'Analyze Ammonium nitrate-fuel oil mixtures' in prompt:
+            raise RuntimeError("500 Internal error")
+        return generate(prompt, **kwargs)
+    
+    monkeypatch.setattr(stub_model, 'generate_content', failing_risk_analysis)
+    run(tmp_path, workers)
+    ledger = ProgressLedger(tmp_path / 'progress.sqlite3')
+    # 오류로 끝난 단계가 있는 화물은 완료로 기록하지 않음
+    assert len(ledger.processed_cargos()) == 2
+    ledger.close()
+    
+    monkeypatch.setattr(stub_model, 'generate_content', generate)
+    calls = stub_model.calls
+    run(tmp_path, workers)
+    # 다시 요청하는 것은 실패한 단계 하나뿐
+    assert stub_model.calls == calls + 1
+    ledger = ProgressLedger(tmp_path / 'progress.sqlite3')
+    assert len(ledger.processed_cargos()) == 3
@@ -0,0 +1,17 @@
+import pytest
+
+from query_results import parse_args
+
+@pytest.mark.parametrize('command, limit', [('name', 5), ('search', 50)])
+def test_limit_defaults(monkeypatch, command, limit):
+    monkeypatch.setattr('sys.argv', ['query_results.py', command, 'ammonia'])
+    assert parse_args().limit == limit
+    monkeypatch.setattr('sys.argv', ['query_results.py', command, 'ammonia', '--limit', '3'])
+    assert parse_args().limit == 3
+
+@pytest.mark.parametrize('command', ['id', 'guide'])
+def test_limit_is_rejected_where_it_does_not_apply(monkeypatch, command):
+    # id / guide는 일치하는 화물의 행을 모두 출력하므로 --limit을 받으면 조용히 무시하게 됨
+    monkeypatch.setattr('sys.argv', ['query_results.py', command, '1005', '--limit', '3'])
+    with pytest.raises(SystemExit):
+        parse_args()
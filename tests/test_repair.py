@@ -0,0 +1,44 @@
+import io
+import contextlib
+
+import pytest
+
+from auto_restart_analysis import AutoRestartAnalyzer, RateLimiter, ProgressLedger, STAGE_ENTRY_LIMITS
+from fake_backend import FakeModelProvider
+from helpers import make_cargo_list, run, result_rows, blocks
+
+def repair(work_dir, model, workers=1):
+    """work_dir의 진행 기록과 출력 파일을 --repair로 고치기"""
+    analyzer = AutoRestartAnalyzer(
+        model=model,
+        max_workers=workers,
+        rate_limiter=RateLimiter(rpm=None),
+        ledger=ProgressLedger(work_dir / 'progress.sqlite3'),
+        writer_options={'path': str(work_dir / 'results.csv'), 'flush_interval': 0},
+    )
+    with contextlib.redirect_stdout(io.StringIO()):
+        analyzer.run_repair()
+    analyzer.ledger.close()
+
+@pytest.mark.parametrize('workers', [1, 4])
+def test_repair_replaces_short_stages_in_place(tmp_path, monkeypatch, stub_model, workers):
+    monkeypatch.chdir(tmp_path)
+    make_cargo_list(tmp_path, units=3)
+    # 가짜 모델 응답(3~8행)은 모든 단계의 최소 항목 수보다 짧음
+    run(tmp_path, workers)
+    before = blocks(tmp_path / 'results.csv')
+    
+    model = FakeModelProvider(latency=0)
+    repair(tmp_path, model, workers)
+    
+    assert model.calls == len(before)
+    assert blocks(tmp_path / 'results.csv') == before
+    counts = {}
+    for row in result_rows(tmp_path / 'results.csv'):
+        counts[row[:2]] = counts.get(row[:2], 0) + 1
+    assert all(count >= STAGE_ENTRY_LIMITS[stage][0] for (_, stage), count in counts.items())
+    
+    # 고친 뒤에는 다시 요청할 단계가 없음
+    calls = model.calls
+    repair(tmp_path, model, workers)
+    assert model.calls == calls
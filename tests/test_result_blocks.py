@@ -0,0 +1,31 @@
+from auto_restart_analysis import OUTPUT_FIELDS, ResultWriter, read_result_rows, replace_result_blocks
+
+def write_file(path, rows):
+    writer = ResultWriter(path, flush_interval=float('inf'))
+    writer.write_rows(rows)
+    writer.close()
+
+def row(cargo, stage, text):
+    return dict(zip(OUTPUT_FIELDS, (cargo, stage, 'Info', text, '', '', '')))
+
+def test_replace_returns_only_written_blocks(tmp_path):
+    path = tmp_path / 'results.csv'
+    write_file(path, [row('A', 'Risk Analysis', 'old'), row('A', 'Statistical Data', 'kept'),
+                      row('B', 'Risk Analysis', 'b')])
+    
+    written = replace_result_blocks(path, {
+        ('A', 'Risk Analysis'): [row('A', 'Risk Analysis', 'new')],
+        ('A', 'Emergency Procedures'): [row('A', 'Emergency Procedures', 'inserted')],
+        ('B', 'Statistical Data'): [],  # 행이 없는 교체는 기록하지 않음
+    })
+    
+    assert sorted(written) == [('A', 'Emergency Procedures'), ('A', 'Risk Analysis')]
+    assert [r[3] for r in read_result_rows(path)] == ['new', 'inserted', 'kept', 'b']
+
+def test_replace_without_changes_keeps_file(tmp_path):
+    path = tmp_path / 'results.csv'
+    write_file(path, [row('A', 'Risk Analysis', 'old')])
+    before = path.stat().st_mtime_ns
+    
+    assert replace_result_blocks(path, {('A', 'Statistical Data'): []}) == []
+    assert path.stat().st_mtime_ns == before
@@ -0,0 +1,43 @@
+import json
+
+import pytest
+
+from auto_restart_analysis import DEFAULT_STAGE_POLICY, ResultRow, read_result_rows
+from fake_backend import FakeModelProvider
+from helpers import make_cargo_list, run
+
+def test_result_row_reads_like_the_old_row_dict():
+    row = ResultRow('A', 'Risk Analysis', ('Info', 'text', 'd1', '', ''))
+    
+    assert row['Description'] == 'text' and row.get('Missing', '-') == '-'
+    assert dict(row) == {'Cargo': 'A', 'Stage': 'Risk Analysis', 'Category': 'Info', 'Description': 'text',
+                         'Detail1': 'd1', 'Detail2': '', 'Detail3': ''}
+    # 작업 단위 화물끼리는 내용 튜플을 공유
+    other = row.with_cargo('B')
+    assert other.values is row.values and other['Cargo'] == 'B'
+
+@pytest.mark.parametrize('options', [{}, {'stage_policy': dict(DEFAULT_STAGE_POLICY)}], ids=['default', 'guide-shared'])
+def test_dictionary_output_reads_back_as_csv_rows(tmp_path, monkeypatch, options):
+    csv_dir, dict_dir = tmp_path / 'csv', tmp_path / 'djsonl'
+    for work_dir in (csv_dir, dict_dir):
+        work_dir.mkdir()
+        make_cargo_list(work_dir, units=12)
+    
+    monkeypatch.chdir(csv_dir)
+    run(csv_dir, 1, model=FakeModelProvider(latency=0), **options)
+    monkeypatch.chdir(dict_dir)
+    writer_options = {'path': str(dict_dir / 'results.djsonl'), 'flush_interval': 0}
+    run(dict_dir, 1, model=FakeModelProvider(latency=0), writer_options=writer_options, **options)
+    
+    expected = list(read_result_rows(csv_dir / 'results.csv'))
+    assert list(read_result_rows(dict_dir / 'results.djsonl')) == expected
+    assert (dict_dir / 'results.djsonl').stat().st_size < (csv_dir / 'results.csv').stat().st_size
+    # 가이드 공유 단계의 같은 내용 블록은 블록 번호로만 기록
+    lines = [json.loads(line) for line in (dict_dir / 'results.djsonl').read_text(encoding='utf-8').splitlines()[1:]]
+    assert any(isinstance(line[2], int) for line in lines if line[0] != 'S') == bool(options)
+    
+    # 이어서 실행해도 사전을 다시 읽어 같은 파일 유지
+    model = FakeModelProvider(latency=0)
+    run(dict_dir, 1, model=model, writer_options=writer_options, **options)
+    assert model.calls == 0
+    assert list(read_result_rows(dict_dir / 'results.djsonl')) == expected
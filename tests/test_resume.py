@@ -0,0 +1,207 @@
+import sys
+import sqlite3
+import signal
+import functools
+import subprocess
+
+import pytest
+
+import fake_backend
+import auto_restart_analysis
+from auto_restart_analysis import AutoRestartAnalyzer, ResultWriter, STAGES
+from fake_backend import FakeModelProvider
+from helpers import ROOT, make_cargo_list, run, result_rows, blocks
+
+# 출력 파일 fsync 후 진행 기록(mark_written) 커밋 전에 SIGKILL로 죽는 실행
+KILLED_RUN = """
+import os, sys, signal
+sys.path.insert(0, {root!r})
+sys.path.insert(0, {tests!r})
+import auto_restart_analysis
+from conftest import StubModel
+from helpers import run
+
+calls = 0
+mark_written = auto_restart_analysis.ProgressLedger.mark_written
+
+def killing_mark_written(self, cargo_stages, position=None):
+    global calls
+    calls += 1
+    if calls == {kill_at}:
+        os.kill(os.getpid(), signal.SIGKILL)
+    return mark_written(self, cargo_stages, position)
+
+auto_restart_analysis.GeminiProvider = StubModel
+auto_restart_analysis.ProgressLedger.mark_written = killing_mark_written
+os.chdir(sys.argv[1])
+run(sys.argv[1], int(sys.argv[2]))
+"""
+
+# 모델 호출마다 조금씩 지연되는 CLI 실행 (SIGTERM을 보낼 틈을 줌)
+SLOW_CLI_RUN = """
+import os, sys, time
+sys.path.insert(0, {root!r})
+sys.path.insert(0, {tests!r})
+import auto_restart_analysis
+from conftest import StubModel
+
+class SlowStubGemini(auto_restart_analysis.GeminiProvider):
+    def generate_content(self, prompt, **kwargs):
+        time.sleep(0.05)
+        return StubModel().generate_content(prompt, **kwargs)
+
+os.environ.setdefault('GEMINI_API_KEY', 'test')
+auto_restart_analysis.GeminiProvider = SlowStubGemini
+os.chdir(sys.argv[1])
+sys.argv = ['auto_restart_analysis.py', '--workers', sys.argv[2], '--rpm', '0', '--no-cache',
+            '--output', 'results.csv', '--ledger-path', 'progress.sqlite3', '--flush-interval', '0']
+auto_restart_analysis.main()
+"""
+
+def test_writer_discards_rows_after_confirmed_position(tmp_path):
+    path = tmp_path / 'results.csv'
+    row = {'Cargo': 'A', 'Stage': 'Risk Analysis', 'Category': 'Info', 'Description': 'confirmed'}
+    positions = []
+    writer = ResultWriter(path, flush_interval=float('inf'), on_flush=lambda keys, position: positions.append(position))
+    writer.write_rows([row], keys=[('A', 'Risk Analysis')])
+    writer.flush()
+    writer.write_rows([dict(row, Cargo='B', Description='unconfirmed')])
+    writer.close()
+    confirmed = positions[0][1:]
+    
+    writer = ResultWriter(path, confirmed=confirmed)
+    writer.close()
+    assert writer.discarded_bytes > 0
+    assert [r[3] for r in result_rows(path)] == ['confirmed']
+    
+    # 확정 이후 다른 방법으로 다시 쓴 파일은 자르지 않음
+    other = ResultWriter(tmp_path / 'other.csv')
+    other.write_rows([dict(row, Cargo='C', Description='merged ' * 40)] * 3)
+    other.close()
+    (tmp_path / 'other.csv').replace(path)
+    writer = ResultWriter(path, confirmed=confirmed)
+    writer.close()
+    assert writer.discarded_bytes == 0
+    assert len(result_rows(path)) == 3
+
+@pytest.mark.usefixtures('stub_model')
+@pytest.mark.parametrize('workers', [1, 4])
+def test_interrupted_run_writes_each_block_once(tmp_path, monkeypatch, workers):
+    clean_dir, stopped_dir = tmp_path / 'clean', tmp_path / 'stopped'
+    for work_dir in (clean_dir, stopped_dir):
+        work_dir.mkdir()
+        make_cargo_list(work_dir)
+    monkeypatch.chdir(clean_dir)
+    run(clean_dir, workers)
+    
+    monkeypatch.chdir(stopped_dir)
+    emit = AutoRestartAnalyzer.emit_stage_results
+    
+    def stop_after_two_cargos(self, cargo, stage_key, stage_results):
+        emit(self, cargo, stage_key, stage_results)
+        if len(blocks(self.writer.path)) >= 2 * len(STAGES):
+            self.should_stop = True
+    
+    monkeypatch.setattr(AutoRestartAnalyzer, 'emit_stage_results', stop_after_two_cargos)
+    run(stopped_dir, workers)
+    monkeypatch.setattr(AutoRestartAnalyzer, 'emit_stage_results', emit)
+    assert 0 < len(blocks(stopped_dir / 'results.csv')) < len(blocks(clean_dir / 'results.csv'))
+    
+    run(stopped_dir, workers)
+    
+    resumed = blocks(stopped_dir / 'results.csv')
+    assert len(resumed) == len(set(resumed))
+    assert (stopped_dir / 'results.csv').read_bytes() == (clean_dir / 'results.csv').read_bytes()
+
+@pytest.mark.parametrize('workers', [1, 4])
+@pytest.mark.parametrize('kill_at', [2, 7])
+def test_kill_between_flush_and_ledger_commit(tmp_path, monkeypatch, stub_model, workers, kill_at):
+    clean_dir, killed_dir = tmp_path / 'clean', tmp_path / 'killed'
+    for work_dir in (clean_dir, killed_dir):
+        work_dir.mkdir()
+        make_cargo_list(work_dir)
+    monkeypatch.chdir(clean_dir)
+    run(clean_dir, workers)
+    
+    script = KILLED_RUN.format(root=str(ROOT), tests=str(ROOT / 'tests'), kill_at=kill_at)
+    process = subprocess.run([sys.executable, '-c', script, str(killed_dir), str(workers)],
+                             capture_output=True, cwd=ROOT)
+    assert process.returncode == -signal.SIGKILL
+    # 죽기 전에 fsync된 행이 확정 기록 없이 파일에 남아 있음
+    assert len(result_rows(killed_dir / 'results.csv')) > 0
+    
+    monkeypatch.chdir(killed_dir)
+    run(killed_dir, workers)
+    
+    resumed = blocks(killed_dir / 'results.csv')
+    assert len(resumed) == len(set(resumed))
+    assert sorted(result_rows(killed_dir / 'results.csv')) == sorted(result_rows(clean_dir / 'results.csv'))
+    if workers == 1:
+        assert (killed_dir / 'results.csv').read_bytes() == (clean_dir / 'results.csv').read_bytes()
+
+def stored_failures(work_dir):
+    """진행 기록에 실패(오류 / 대체 데이터 / 빈 결과)로 남은 (화물, Stage) - 가짜 모델에서는 없어야 함"""
+    conn = sqlite3.connect(work_dir / 'progress.sqlite3')
+    try:
+        return conn.execute("SELECT cargo, stage FROM stage_progress WHERE failed = 1").fetchall()
+    finally:
+        conn.close()
+
+@pytest.mark.parametrize('workers', [1, 8])
+def test_sigterm_stops_without_recording_errors(tmp_path, monkeypatch, stub_model, workers):
+    clean_dir, stopped_dir = tmp_path / 'clean', tmp_path / 'stopped'
+    for work_dir in (clean_dir, stopped_dir):
+        work_dir.mkdir()
+        make_cargo_list(work_dir, units=20)
+    monkeypatch.chdir(clean_dir)
+    run(clean_dir, workers)
+    
+    script = SLOW_CLI_RUN.format(root=str(ROOT), tests=str(ROOT / 'tests'))
+    process = subprocess.Popen([sys.executable, '-u', '-c', script, str(stopped_dir), str(workers)],
+                               cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    stopped_at = None
+    errors = []
+    for line in process.stdout:
+        if stopped_at is None and '✓' in line:
+            stopped_at = line
+            process.send_signal(signal.SIGTERM)
+        if '오류' in line:
+            errors.append(line)
+    assert process.wait(timeout=60) == 0
+    assert stopped_at is not None
+    assert errors == []
+    assert stored_failures(stopped_dir) == []
+    
+    monkeypatch.chdir(stopped_dir)
+    run(stopped_dir, workers)
+    
+    assert stored_failures(stopped_dir) == []
+    resumed = blocks(stopped_dir / 'results.csv')
+    assert len(resumed) == len(set(resumed)) == len(blocks(clean_dir / 'results.csv'))
+    assert sorted(result_rows(stopped_dir / 'results.csv')) == sorted(result_rows(clean_dir / 'results.csv'))
+
+def run_cli(work_dir, monkeypatch, capsys, **model_options):
+    monkeypatch.chdir(work_dir)
+    monkeypatch.setattr(auto_restart_analysis.signal, 'signal', lambda *args: None)
+    monkeypatch.setattr(fake_backend, 'FakeModelProvider', functools.partial(FakeModelProvider, latency=0, **model_options))
+    monkeypatch.setattr(sys, 'argv', ['auto_restart_analysis.py', '--backend', 'fake', '--rpm', '0',
+                                      '--output', 'results.csv', '--ledger-path', 'progress.sqlite3',
+                                      '--cache-path', 'cache.sqlite3'])
+    capsys.readouterr()
+    auto_restart_analysis.main()
+    return capsys.readouterr().out
+
+def test_completion_is_read_from_ledger_and_files_are_closed(tmp_path, monkeypatch, capsys):
+    make_cargo_list(tmp_path, units=3)
+    closed = []
+    for cls in (auto_restart_analysis.ProgressLedger, auto_restart_analysis.ResponseCache):
+        monkeypatch.setattr(cls, 'close', lambda self, close=cls.close: (closed.append(type(self).__name__), close(self)))
+    
+    # 모든 응답이 비어 실패한 단계만 남은 실행은 완료로 보지 않음
+    out = run_cli(tmp_path, monkeypatch, capsys, empty_rate=1.0)
+    assert "분석 일시 중단 (재시작 가능) - 남은 화물 3개" in out and "분석 완료" not in out
+    assert sorted(closed) == ['ProgressLedger', 'ResponseCache']
+    
+    out = run_cli(tmp_path, monkeypatch, capsys)
+    assert "🎉 분석 완료!" in out
+    assert len(closed) == 4
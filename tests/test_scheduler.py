@@ -0,0 +1,25 @@
+import pytest
+
+from auto_restart_analysis import DEFAULT_STAGE_POLICY, PackSizer
+from fake_backend import FakeModelProvider
+from helpers import make_cargo_list, run
+
+@pytest.mark.parametrize('options', [
+    {},
+    {'batch_size': 3},
+    {'stage_policy': dict(DEFAULT_STAGE_POLICY)},
+    {'pack_sizer': PackSizer(4)},
+], ids=['default', 'batch3', 'guide-shared', 'pack'])
+def test_concurrent_output_matches_serial(tmp_path, monkeypatch, options):
+    serial_dir, concurrent_dir = tmp_path / 'serial', tmp_path / 'concurrent'
+    for work_dir in (serial_dir, concurrent_dir):
+        work_dir.mkdir()
+        make_cargo_list(work_dir, units=40)
+    
+    monkeypatch.chdir(serial_dir)
+    run(serial_dir, 1, model=FakeModelProvider(latency=0), **options)
+    # 지연을 흩뿌려 작업 단위가 순서와 다르게 끝나게 함
+    monkeypatch.chdir(concurrent_dir)
+    run(concurrent_dir, 8, model=FakeModelProvider(latency=0.002), **options)
+    
+    assert (concurrent_dir / 'results.csv').read_bytes() == (serial_dir / 'results.csv').read_bytes()
@@ -0,0 +1,52 @@
+import pytest
+
+from auto_restart_analysis import AutoRestartAnalyzer, merge_shard_outputs, shard_path
+from helpers import make_cargo_list, run, result_rows, blocks
+
+pytestmark = pytest.mark.usefixtures('stub_model')
+
+SHARDS = 3
+
+def run_shard(work_dir, output, shard, workers=1):
+    make_cargo_list(work_dir, units=12)
+    return run(work_dir, workers, shard=shard,
+               writer_options={'path': str(shard_path(output, shard)), 'flush_interval': 0})
+
+@pytest.mark.parametrize('workers', [1, 4])
+def test_merged_shards_match_single_run(tmp_path, monkeypatch, workers):
+    clean_dir, shards_dir = tmp_path / 'clean', tmp_path / 'shards'
+    clean_dir.mkdir()
+    shards_dir.mkdir()
+    make_cargo_list(clean_dir, units=12)
+    monkeypatch.chdir(clean_dir)
+    run(clean_dir, workers)
+    
+    output = shards_dir / 'results.csv'
+    for index in range(1, SHARDS + 1):
+        work_dir = tmp_path / f'shard{index}'
+        work_dir.mkdir()
+        monkeypatch.chdir(work_dir)
+        run_shard(work_dir, output, (index, SHARDS), workers)
+    
+    # 모든 작업 단위가 정확히 한 샤드에만 들어감
+    shard_rows = [row for index in range(1, SHARDS + 1)
+                  for row in result_rows(shard_path(output, (index, SHARDS)))]
+    assert sorted(shard_rows) == sorted(result_rows(clean_dir / 'results.csv'))
+    
+    cargo_order = AutoRestartAnalyzer(cargo_list_path=str(clean_dir / 'cargolist.csv')).load_cargo_list()
+    summary = merge_shard_outputs(output, cargo_order)
+    
+    assert summary['missing_shards'] == [] and summary['missing_cargos'] == []
+    assert blocks(output) == blocks(clean_dir / 'results.csv')
+    assert result_rows(output) == result_rows(clean_dir / 'results.csv')
+
+def test_ledger_of_another_shard_is_refused(tmp_path, monkeypatch, stub_model):
+    monkeypatch.chdir(tmp_path)
+    output = tmp_path / 'results.csv'
+    run_shard(tmp_path, output, (1, SHARDS))
+    calls = stub_model.calls
+    
+    run_shard(tmp_path, output, (2, SHARDS))
+    
+    assert stub_model.calls == calls
+    assert not shard_path(output, (2, SHARDS)).exists()